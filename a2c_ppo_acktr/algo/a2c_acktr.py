@@ -30,6 +30,8 @@ class A2C_ACKTR():
             self.optimizer = optim.RMSprop(
                 actor_critic.parameters(), lr, eps=eps, alpha=alpha)
 
+    # Returns the value loss, action loss and entropy as tensors on the model's device, as
+    # PPO.update does
     def update(self, rollouts):
         obs_shape = rollouts.obs.size()[2:]
         action_shape = rollouts.actions.size()[-1]
@@ -76,4 +78,4 @@ class A2C_ACKTR():
 
         self.optimizer.step()
 
-        return value_loss.item(), action_loss.item(), dist_entropy.item()
+        return value_loss.detach(), action_loss.detach(), dist_entropy.detach()
@@ -1,3 +1,5 @@
+import time
+
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -15,13 +17,16 @@ class PPO():
                  eps=None,
                  max_grad_norm=None,
                  use_clipped_value_loss=True,
-                 burn_in=False):
+                 burn_in=False,
+                 bptt_length=None,
+                 target_kl=None):
 
         self.actor_critic = actor_critic
 
         self.clip_param = clip_param
         self.ppo_epoch = ppo_epoch
         self.num_mini_batch = num_mini_batch
+        self.bptt_length = bptt_length
 
         self.value_loss_coef = value_loss_coef
         self.entropy_coef = entropy_coef
@@ -32,8 +37,17 @@ class PPO():
         self.burn_in = burn_in
         self.bi_beta = 1.
 
+        # Stops the update after an epoch over which the policy moved further than this from the
+        # one that collected the rollout
+        self.target_kl = target_kl
+        self.epochs_used = 0
+        self.time_saved = 0.
+
         self.optimizer = optim.Adam(actor_critic.parameters(), lr=lr, eps=eps)
 
+    # Returns the mean value loss, action loss and entropy as tensors on the model's device, so
+    # that the host only waits for them if they're read. It waits once per update while burning
+    # in, and once per epoch with a target_kl.
     def update(self, rollouts):
         advantages = rollouts.returns[:-1] - rollouts.value_preds[:-1]
         advantages = (advantages - advantages.mean()) / (
@@ -45,14 +59,18 @@ class PPO():
 
         actor_loss_coef = 0. if self.burn_in else 1.
 
+        start = time.time()
+        num_updates = 0
         for e in range(self.ppo_epoch):
             if self.actor_critic.is_recurrent:
                 data_generator = rollouts.recurrent_generator(
-                    advantages, self.num_mini_batch)
+                    advantages, self.num_mini_batch, self.bptt_length)
             else:
                 data_generator = rollouts.feed_forward_generator(
                     advantages, self.num_mini_batch)
 
+            approx_kl = 0
+            num_batches = 0
             for sample in data_generator:
                 obs_batch, recurrent_hidden_states_batch, actions_batch, \
                    value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, \
@@ -85,18 +103,35 @@ class PPO():
                                          self.max_grad_norm)
                 self.optimizer.step()
 
-                value_loss_epoch += value_loss.item()
-                action_loss_epoch += action_loss.item()
-                dist_entropy_epoch += dist_entropy.item()
+                value_loss_epoch += value_loss.detach()
+                action_loss_epoch += action_loss.detach()
+                dist_entropy_epoch += dist_entropy.detach()
+                num_updates += 1
+
+                if self.target_kl is not None:
+                    # An estimate of KL(old || new) from the minibatch's log ratio, before the
+                    # step: E[ratio - 1 - log ratio]
+                    with torch.no_grad():
+                        log_ratio = action_log_probs - old_action_log_probs_batch
+                        approx_kl += (torch.exp(log_ratio) - 1 - log_ratio).mean()
+                    num_batches += 1
+
+            if self.target_kl is not None and approx_kl.item() / num_batches > self.target_kl:
+                break
 
-        num_updates = self.ppo_epoch * self.num_mini_batch
+        # The epochs left out are assumed to take as long as the ones run
+        self.epochs_used = e + 1
+        self.time_saved = (time.time() - start) / self.epochs_used * (
+            self.ppo_epoch - self.epochs_used)
 
         value_loss_epoch /= num_updates
         action_loss_epoch /= num_updates
         dist_entropy_epoch /= num_updates
 
         # Residual Policy Learning: https://arxiv.org/abs/1812.06298
-        if self.burn_in and value_loss_epoch < self.bi_beta:
+        # The comparison waits for the value loss, deliberately: whether the next update trains
+        # the actor depends on it, and burn in only lasts until the critic has caught up
+        if self.burn_in and value_loss_epoch.item() < self.bi_beta:
             print("Burned in")
             self.burn_in = False
 
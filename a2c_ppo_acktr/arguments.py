@@ -38,6 +38,9 @@ def get_args():
                         help='number of forward steps in A2C (default: 5)')
     parser.add_argument('--ppo-epoch', type=int, default=10,
                         help='number of ppo epochs (default: 4)')
+    parser.add_argument('--target-kl', type=float, default=None,
+                        help='stop a ppo update after an epoch whose approximate KL divergence '
+                             'from the rollout policy exceeds this (default: None)')
     parser.add_argument('--num-mini-batch', type=int, default=32,
                         help='number of batches for ppo (default: 32)')
     parser.add_argument('--clip-param', type=float, default=0.2,
@@ -48,6 +51,9 @@ def get_args():
                         help='save interval, one save per n updates (default: 100)')
     parser.add_argument('--eval-interval', type=int, default=None,
                         help='eval interval, one eval per n updates (default: None)')
+    parser.add_argument('--eval-processes', type=int, default=None,
+                        help='evaluate in the background on this many environments of its own, '
+                             'rather than pausing training (default: on the training ones)')
     parser.add_argument('--trg-succ-rate', type=int, default=None,
                         help='Require % success before stopping, instead of fixed training length.')
     parser.add_argument('--vis-interval', type=int, default=20,
@@ -58,10 +64,35 @@ def get_args():
                         help='base name for saved policies')
     parser.add_argument('--pipeline', default=None,
                         help='Pipeline of scenes to use CuRL on')
+    parser.add_argument('--pipelines', nargs='+', default=None,
+                        help='pipelines for schedule_curricula.py to train, sharing the stages '
+                             'they have in common (default: --pipeline)')
+    parser.add_argument('--parallel-stages', type=int, default=None,
+                        help='stages schedule_curricula.py trains at once (default: as many as '
+                             'there are cores for their simulators)')
     parser.add_argument('--scene-name', default=None,
                         help='An individual scene to load, cannot be used with --pipeline')
-    parser.add_argument('--first-stage', type=int, default=0,
-                        help="Index of starting curriculum stage.")
+    parser.add_argument('--first-stage', type=int, default=None,
+                        help="Index of starting curriculum stage (default: the one after the last "
+                             "completed by an earlier run with the same --save-as)")
+    parser.add_argument('--persistent-sims', action='store_true', default=False,
+                        help='keep simulators running between curriculum stages, loading each '
+                             'new scene into them')
+    parser.add_argument('--step-timeout', type=float, default=None,
+                        help='seconds a simulator may take to step before it is restarted '
+                             '(default: never restart hung simulators)')
+    parser.add_argument('--ready-envs', type=int, default=None,
+                        help='step environments asynchronously, acting as soon as this many are '
+                             'ready rather than waiting for all of them (default: synchronous)')
+    parser.add_argument('--randomise-interval', type=int, default=1,
+                        help='steps between randomisations of the domain in vision mode, besides '
+                             'those on reset (default: 1)')
+    parser.add_argument('--pipelined-stepping', action='store_true', default=False,
+                        help='simulate the next step while the policy acts, with one step of '
+                             'action latency (default: lock-step)')
+    parser.add_argument('--robots-per-sim', type=int, default=1,
+                        help='robots simulated by each V-Rep instance, each in its own copy of '
+                             'the scene (default: 1)')
     parser.add_argument('--initial-policy', default=None,
                         help='initial policy to use, located in trained_models/ppo/{name}.pt')
     parser.add_argument('--dense-ip', action='store_true', default=False,
@@ -82,6 +113,9 @@ def get_args():
                         help='add timestep to observations')
     parser.add_argument('--recurrent-policy', action='store_true', default=False,
                         help='use a recurrent policy')
+    parser.add_argument('--bptt-length', type=int, default=None,
+                        help='backpropagate a recurrent policy through chunks of this many steps, '
+                             'a divisor of --num-steps (default: the whole rollout)')
     parser.add_argument('--use-linear-lr-decay', action='store_true', default=True,
                         help='use a linear schedule on the learning rate')
     parser.add_argument('--use-linear-clip-decay', action='store_true', default=False,
@@ -0,0 +1,142 @@
+import copy
+import threading
+import weakref
+
+import torch
+import torch.nn as nn
+
+from a2c_ppo_acktr.utils import save_atomic
+
+
+# Copies the tensors of a state dict (of a model or an optimizer) into buffers, the like
+# structured result of an earlier call where it has the same shapes, or new ones. Buffers for
+# tensors on the GPU are pinned and filled asynchronously. Everything else is deep-copied.
+def copy_state(state, buffers=None):
+    if torch.is_tensor(state):
+        if buffers is None or buffers.size() != state.size() or buffers.dtype != state.dtype:
+            buffers = torch.empty(state.size(), dtype=state.dtype, pin_memory=state.is_cuda)
+        return buffers.copy_(state.detach(), non_blocking=state.is_cuda)
+    if isinstance(state, dict):
+        copied = type(state)((key, copy_state(value, buffers.get(key)
+                                               if isinstance(buffers, dict) else None))
+                             for key, value in state.items())
+        if hasattr(state, '_metadata'):
+            copied._metadata = copy.deepcopy(state._metadata)
+        return copied
+    if isinstance(state, (list, tuple)):
+        if not isinstance(buffers, type(state)) or len(buffers) != len(state):
+            buffers = [None] * len(state)
+        return type(state)(copy_state(value, buffer) for value, buffer in zip(state, buffers))
+    return copy.deepcopy(state)
+
+
+def on_gpu(source):
+    params = source.parameters() if isinstance(source, nn.Module) else \
+        (param for group in source.param_groups for param in group['params'])
+    return any(param.is_cuda for param in params)
+
+
+class CheckpointWriter(object):
+    """
+    Saves checkpoints in a thread of its own, so that training doesn't wait for the disk.
+
+    save(path, make_obj, *sources) copies the state dicts of the sources (models or optimizers)
+    into CPU buffers kept from earlier saves where possible, and returns. The thread then saves
+    make_obj(*copies) to path, through save_atomic. A model's copy is a CPU model, made once per
+    model, that the buffers are loaded into; an optimizer's is its state dict. make_obj is
+    called after save has returned, so anything else it uses that training goes on changing has
+    to be copied beforehand. A save to a path that is still waiting to be written replaces it,
+    so when saves pile up only the latest of each is written.
+    """
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.waiting = {}
+        self.writing = False
+        self.closed = False
+        self.error = None
+        # Sources' state buffers that no waiting save holds, and the CPU models they're loaded
+        # into for writing
+        self.free = weakref.WeakKeyDictionary()
+        self.cpu_models = weakref.WeakKeyDictionary()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def copy_to_cpu(self, source):
+        with self.lock:
+            free = self.free.setdefault(source, [])
+            buffers = free.pop() if free else None
+        if isinstance(source, nn.Module) and source not in self.cpu_models:
+            cpu_model = copy.deepcopy(source).cpu()
+            with self.lock:
+                self.cpu_models[source] = cpu_model
+        return copy_state(source.state_dict(), buffers)
+
+    def release(self, sources, states):
+        for source, state in zip(sources, states):
+            if source in self.free:
+                self.free[source].append(state)
+
+    def save(self, path, make_obj, *sources):
+        self.raise_error()
+        states = [self.copy_to_cpu(source) for source in sources]
+        # Asynchronous copies from the GPU are waited for by the thread
+        copied = None
+        if any(on_gpu(source) for source in sources):
+            copied = torch.cuda.Event()
+            copied.record()
+        with self.lock:
+            if path in self.waiting:
+                self.release(*self.waiting[path][2:])
+            self.waiting[path] = (make_obj, copied, sources, states)
+            self.lock.notify_all()
+
+    def run(self):
+        with self.lock:
+            while True:
+                while not self.waiting and not self.closed:
+                    self.lock.wait()
+                if not self.waiting:
+                    return
+                path = next(iter(self.waiting))
+                make_obj, copied, sources, states = self.waiting.pop(path)
+                self.writing = True
+                self.lock.release()
+                try:
+                    if copied is not None:
+                        copied.synchronize()
+                    copies = []
+                    for source, state in zip(sources, states):
+                        with self.lock:
+                            cpu_model = self.cpu_models.get(source)
+                        if cpu_model is not None:
+                            cpu_model.load_state_dict(state)
+                            state = cpu_model
+                        copies += [state]
+                    save_atomic(make_obj(*copies), path)
+                except Exception as e:
+                    self.error = e
+                finally:
+                    self.lock.acquire()
+                    self.writing = False
+                    self.release(sources, states)
+                    self.lock.notify_all()
+
+    # A failed save is raised in the training thread by the next call
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # Returns once everything saved so far is on disk
+    def flush(self):
+        with self.lock:
+            while self.waiting or self.writing:
+                self.lock.wait()
+        self.raise_error()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.thread.join()
+        self.raise_error()
@@ -0,0 +1,84 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from envs.envs import get_vec_normalize
+
+
+# Runs the policy deterministically from obs until num_episodes episodes have finished, or for
+# one round of episodes if there are more environments than that, and returns the number of
+# successful ones, of finished ones and the last observations. Assumes episodes are fixed length,
+# so that every environment finishes at once.
+def evaluate(actor_critic, envs, obs, num_episodes, device):
+    num_envs = envs.num_envs
+    i = 0
+    total_successes = 0
+    recurrent_hidden_states = torch.zeros(
+        num_envs, actor_critic.recurrent_hidden_state_size, device=device)
+    masks = torch.zeros(num_envs, 1, device=device)
+    while i == 0 or i + num_envs <= num_episodes:
+
+        with torch.no_grad():
+            _, action, _, recurrent_hidden_states = actor_critic.act(
+                obs, recurrent_hidden_states, masks, deterministic=True)
+
+        obs, _, dones, infos = envs.step(action)
+
+        if np.all(dones):  # Rigid - assumes episodes are fixed length
+            # Slots of restarted simulators didn't run an episode
+            rews = [info['rew_success'] for info in infos if not info.get('bad_transition')]
+            i += len(rews)
+            total_successes += sum([int(rew > 0) for rew in rews])
+
+    return total_successes, i, obs
+
+
+class BackgroundEvaluator(object):
+    """
+    Evaluates snapshots of the policy in a thread of its own, on environments made by make_envs
+    alongside the training ones, so that training carries on meanwhile. A snapshot handed to
+    submit while another is being evaluated waits for it, replacing any that was already
+    waiting, and is started by the next call to poll. poll returns the result of the evaluation
+    once it's done, as (total_num_steps, policy, ob_rms, successes, episodes).
+    """
+    def __init__(self, make_envs, num_episodes, device):
+        self.envs = make_envs()
+        self.vec_norm = get_vec_normalize(self.envs)
+        if self.vec_norm is not None:
+            self.vec_norm.eval()
+        self.num_episodes = num_episodes
+        self.device = device
+        self.thread = ThreadPoolExecutor(1)
+        self.waiting = None
+        self.running = None
+
+    # Copies the policy and normalisation, as training goes on changing them
+    def submit(self, total_num_steps, actor_critic, ob_rms):
+        self.waiting = (total_num_steps, copy.deepcopy(actor_critic), copy.deepcopy(ob_rms))
+
+    # The environments are reset so that the first observations are normalised like the rest
+    def run(self, actor_critic, ob_rms):
+        if self.vec_norm is not None:
+            self.vec_norm.ob_rms = ob_rms
+        successes, episodes, _ = evaluate(actor_critic, self.envs, self.envs.reset(),
+                                          self.num_episodes, self.device)
+        return successes, episodes
+
+    def poll(self):
+        if self.running is None and self.waiting is not None:
+            total_num_steps, actor_critic, ob_rms = self.waiting
+            self.running = (total_num_steps, actor_critic, ob_rms,
+                            self.thread.submit(self.run, actor_critic, ob_rms))
+            self.waiting = None
+        elif self.running is not None and self.running[-1].done():
+            *snapshot, future = self.running
+            self.running = None
+            return (*snapshot, *future.result())
+        return None
+
+    # Lets an evaluation in progress finish, as its simulators can't be stopped halfway
+    def close(self):
+        self.thread.shutdown()
+        self.envs.close()
@@ -1,5 +1,5 @@
+import numpy as np
 import torch
-from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
 
 from a2c_ppo_acktr.tuple_tensor import TupleTensor
 
@@ -8,6 +8,19 @@ def _flatten_helper(T, N, _tensor):
     return _tensor.view(T * N, *_tensor.size()[2:])
 
 
+# NumPy and views of the tensors if they're on the CPU, otherwise torch and the tensors, which
+# both take multiply(a, b, out=c) and add(a, b, out=c)
+def _array_ops(*tensors):
+    if tensors[0].device.type == 'cpu':
+        return (np, *[tensor.numpy() for tensor in tensors])
+    return (_TorchOps, *tensors)
+
+
+class _TorchOps(object):
+    multiply = torch.mul
+    add = torch.add
+
+
 class RolloutStorage(object):
     def __init__(self, num_steps, num_processes, obs_shape, action_space, recurrent_hidden_state_size):
         if len(obs_shape) == 2:
@@ -28,9 +41,17 @@ class RolloutStorage(object):
         if action_space.__class__.__name__ == 'Discrete':
             self.actions = self.actions.long()
         self.masks = torch.ones(num_steps + 1, num_processes, 1)
+        # Zero where a step didn't really happen (e.g. a restarted simulator's placeholder)
+        self.bad_masks = torch.ones(num_steps + 1, num_processes, 1)
 
         self.num_steps = num_steps
         self.step = 0
+        # Per environment write cursors, for when they step asynchronously (see insert_actions)
+        self.env_steps = torch.zeros(num_processes, dtype=torch.long)
+        # Minibatch buffers, allocated by the first feed_forward_generator
+        self.shuffled = None
+        # Minibatch buffers of recurrent_generator, by (chunk length, sequences per minibatch)
+        self.sequence_buffers = {}
 
     def to(self, device):
         self.obs = self.obs.to(device)
@@ -41,37 +62,101 @@ class RolloutStorage(object):
         self.action_log_probs = self.action_log_probs.to(device)
         self.actions = self.actions.to(device)
         self.masks = self.masks.to(device)
+        self.bad_masks = self.bad_masks.to(device)
+        self.shuffled = None
+        self.sequence_buffers = {}
 
-    def insert(self, obs, recurrent_hidden_states, actions, action_log_probs, value_preds, rewards, masks):
+    def insert(self, obs, recurrent_hidden_states, actions, action_log_probs, value_preds, rewards, masks,
+               bad_masks=None):
         self.obs[self.step + 1].copy_(obs)
+        self.rewards[self.step].copy_(rewards)
+        self.masks[self.step + 1].copy_(masks)
+        if bad_masks is not None:
+            self.bad_masks[self.step + 1].copy_(bad_masks)
+        self.insert_policy(recurrent_hidden_states, actions, action_log_probs, value_preds)
+
+    # Where the observations, rewards, masks and bad masks of the current step go, for
+    # VecPyTorch.step_wait_into to write them in place
+    def result_slots(self):
+        return self.obs[self.step + 1], self.rewards[self.step], self.masks[self.step + 1], \
+            self.bad_masks[self.step + 1]
+
+    # As insert, once the results are in their slots
+    def insert_policy(self, recurrent_hidden_states, actions, action_log_probs, value_preds):
         self.recurrent_hidden_states[self.step + 1].copy_(recurrent_hidden_states)
         self.actions[self.step].copy_(actions)
         self.action_log_probs[self.step].copy_(action_log_probs)
         self.value_preds[self.step].copy_(value_preds)
-        self.rewards[self.step].copy_(rewards)
-        self.masks[self.step + 1].copy_(masks)
 
         self.step = (self.step + 1) % self.num_steps
 
+    # Observation, hidden state and mask each of env_ids is at
+    def current(self, env_ids):
+        steps = self.env_steps[env_ids]
+        return self.obs[steps, env_ids], self.recurrent_hidden_states[steps, env_ids], \
+            self.masks[steps, env_ids]
+
+    # Asynchronous counterparts of insert, for the environments in env_ids only. What the policy
+    # did is recorded when they are sent their actions, and the results once they return, which
+    # moves their cursors on. The rollout is complete once every cursor reaches num_steps.
+    def insert_actions(self, env_ids, recurrent_hidden_states, actions, action_log_probs,
+                       value_preds):
+        steps = self.env_steps[env_ids]
+        self.recurrent_hidden_states[steps + 1, env_ids] = recurrent_hidden_states
+        self.actions[steps, env_ids] = actions
+        self.action_log_probs[steps, env_ids] = action_log_probs
+        self.value_preds[steps, env_ids] = value_preds
+
+    def insert_results(self, env_ids, obs, rewards, masks, bad_masks):
+        steps = self.env_steps[env_ids]
+        self.obs[steps + 1, env_ids] = obs
+        self.rewards[steps, env_ids] = rewards.to(self.rewards.device)
+        self.masks[steps + 1, env_ids] = masks.to(self.masks.device)
+        self.bad_masks[steps + 1, env_ids] = bad_masks.to(self.bad_masks.device)
+        self.env_steps[env_ids] += 1
+
     def after_update(self):
+        self.env_steps.zero_()
         self.obs[0].copy_(self.obs[-1])
         self.recurrent_hidden_states[0].copy_(self.recurrent_hidden_states[-1])
         self.masks[0].copy_(self.masks[-1])
+        self.bad_masks[0].copy_(self.bad_masks[-1])
 
+    # Only the recursion itself is stepped through in Python, everything else being computed
+    # for all steps at once beforehand. On the CPU the recursion works on NumPy views of the
+    # tensors, whose operations cost far less to launch. The operations are those of the step by
+    # step version, in the same order, so the results are identical.
     def compute_returns(self, next_value, use_gae, gamma, tau):
         if use_gae:
             self.value_preds[-1] = next_value
-            gae = 0
-            for step in reversed(range(self.rewards.size(0))):
-                delta = self.rewards[step] + gamma * self.value_preds[step + 1] * self.masks[step + 1] - self.value_preds[step]
-                gae = delta + gamma * tau * self.masks[step + 1] * gae
-                self.returns[step] = gae + self.value_preds[step]
+            masks = self.masks[1:]
+            deltas = self.rewards + gamma * self.value_preds[1:] * masks - self.value_preds[:-1]
+            decays = gamma * tau * masks
+            # The advantages are built up in returns, then the values added
+            ops, gaes, deltas, decays, bad_masks = _array_ops(self.returns[:-1], deltas, decays,
+                                                              self.bad_masks[1:])
+            ops.multiply(deltas[-1], bad_masks[-1], out=gaes[-1])
+            for step in reversed(range(self.rewards.size(0) - 1)):
+                ops.multiply(decays[step], gaes[step + 1], out=gaes[step])
+                ops.add(gaes[step], deltas[step], out=gaes[step])
+                ops.multiply(gaes[step], bad_masks[step], out=gaes[step])
+            self.returns[:-1] += self.value_preds[:-1]
         else:
             self.returns[-1] = next_value
+            # What replaces the return where the step didn't really happen
+            bootstraps = (1 - self.bad_masks[1:]) * self.value_preds[:-1]
+            ops, returns, masks, rewards, bad_masks, bootstraps = _array_ops(
+                self.returns, self.masks[1:], self.rewards, self.bad_masks[1:], bootstraps)
             for step in reversed(range(self.rewards.size(0))):
-                self.returns[step] = self.returns[step + 1] * \
-                    gamma * self.masks[step + 1] + self.rewards[step]
-
+                ops.multiply(returns[step + 1], gamma, out=returns[step])
+                ops.multiply(returns[step], masks[step], out=returns[step])
+                ops.add(returns[step], rewards[step], out=returns[step])
+                ops.multiply(returns[step], bad_masks[step], out=returns[step])
+                ops.add(returns[step], bootstraps[step], out=returns[step])
+
+    # The rollout is shuffled once per epoch into buffers kept from one call to the next, with
+    # the same permutation as sampling the indices minibatch by minibatch would give, and every
+    # minibatch is a slice of them. The slices are overwritten by the next epoch's shuffle.
     def feed_forward_generator(self, advantages, num_mini_batch):
         num_steps, num_processes = self.rewards.size()[0:2]
         batch_size = num_processes * num_steps
@@ -81,72 +166,83 @@ class RolloutStorage(object):
             "to be greater than or equal to the number of PPO mini batches ({})."
             "".format(num_processes, num_steps, num_processes * num_steps, num_mini_batch))
         mini_batch_size = batch_size // num_mini_batch
-        sampler = BatchSampler(SubsetRandomSampler(range(batch_size)), mini_batch_size, drop_last=False)
-        for indices in sampler:
-            obs_batch = self.obs[:-1].view(-1, *self.obs.size()[2:])[indices]
-            recurrent_hidden_states_batch = self.recurrent_hidden_states[:-1].view(-1,
-                self.recurrent_hidden_states.size(-1))[indices]
-            actions_batch = self.actions.view(-1, self.actions.size(-1))[indices]
-            value_preds_batch = self.value_preds[:-1].view(-1, 1)[indices]
-            return_batch = self.returns[:-1].view(-1, 1)[indices]
-            masks_batch = self.masks[:-1].view(-1, 1)[indices]
-            old_action_log_probs_batch = self.action_log_probs.view(-1, 1)[indices]
-            adv_targ = advantages.view(-1, 1)[indices]
-
-            yield obs_batch, recurrent_hidden_states_batch, actions_batch, \
-                value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, adv_targ
-
-    def recurrent_generator(self, advantages, num_mini_batch):
+        indices = torch.randperm(batch_size).to(self.rewards.device)
+
+        obs = self.obs[:-1]
+        obs_items = obs.items if isinstance(obs, TupleTensor) else [obs]
+        tensors = [item.view(batch_size, *item.size()[2:]) for item in obs_items] + [
+            self.recurrent_hidden_states[:-1].view(batch_size, -1),
+            self.actions.view(batch_size, -1),
+            self.value_preds[:-1].view(batch_size, 1),
+            self.returns[:-1].view(batch_size, 1),
+            self.masks[:-1].view(batch_size, 1),
+            self.action_log_probs.view(batch_size, 1),
+            advantages.view(batch_size, 1)]
+        if self.shuffled is None:
+            self.shuffled = [torch.empty_like(tensor) for tensor in tensors]
+        for tensor, shuffled in zip(tensors, self.shuffled):
+            torch.index_select(tensor, 0, indices, out=shuffled)
+
+        for start in range(0, batch_size, mini_batch_size):
+            batch = [shuffled[start:start + mini_batch_size] for shuffled in self.shuffled]
+            if len(obs_items) > 1:
+                batch = [TupleTensor(*batch[:len(obs_items)]), *batch[len(obs_items):]]
+            yield tuple(batch)
+
+    # Sequences of chunk_length steps (the whole rollout by default) are cut from every
+    # environment's rollout and shared out at random between the minibatches, each starting from
+    # the hidden state it was collected with. Every minibatch is gathered with one index_select
+    # per tensor into buffers kept from one call to the next, overwritten by the next minibatch.
+    def recurrent_generator(self, advantages, num_mini_batch, chunk_length=None):
         num_processes = self.rewards.size(1)
-        assert num_processes >= num_mini_batch, (
+        T = chunk_length or self.num_steps
+        assert self.num_steps % T == 0, (
+            "The number of steps ({}) has to be a multiple of the BPTT chunk length ({})."
+            "".format(self.num_steps, T))
+        num_chunks = self.num_steps // T
+        num_sequences = num_processes * num_chunks
+        assert num_sequences >= num_mini_batch, (
             "PPO requires the number of processes ({}) "
+            "* number of chunks per rollout ({}) "
             "to be greater than or equal to the number of "
-            "PPO mini batches ({}).".format(num_processes, num_mini_batch))
-        num_envs_per_batch = num_processes // num_mini_batch
-        perm = torch.randperm(num_processes)
-        for start_ind in range(0, num_processes, num_envs_per_batch):
-            obs_batch = []
-            recurrent_hidden_states_batch = []
-            actions_batch = []
-            value_preds_batch = []
-            return_batch = []
-            masks_batch = []
-            old_action_log_probs_batch = []
-            adv_targ = []
-
-            for offset in range(num_envs_per_batch):
-                ind = perm[start_ind + offset]
-                obs_batch.append(self.obs[:-1, ind])
-                recurrent_hidden_states_batch.append(self.recurrent_hidden_states[0:1, ind])
-                actions_batch.append(self.actions[:, ind])
-                value_preds_batch.append(self.value_preds[:-1, ind])
-                return_batch.append(self.returns[:-1, ind])
-                masks_batch.append(self.masks[:-1, ind])
-                old_action_log_probs_batch.append(self.action_log_probs[:, ind])
-                adv_targ.append(advantages[:, ind])
-
-            T, N = self.num_steps, num_envs_per_batch
-            # These are all tensors of size (T, N, -1)
-            obs_batch = torch.stack(obs_batch, 1)
-            actions_batch = torch.stack(actions_batch, 1)
-            value_preds_batch = torch.stack(value_preds_batch, 1)
-            return_batch = torch.stack(return_batch, 1)
-            masks_batch = torch.stack(masks_batch, 1)
-            old_action_log_probs_batch = torch.stack(old_action_log_probs_batch, 1)
-            adv_targ = torch.stack(adv_targ, 1)
-
-            # States is just a (N, -1) tensor
-            recurrent_hidden_states_batch = torch.stack(recurrent_hidden_states_batch, 1).view(N, -1)
+            "PPO mini batches ({}).".format(num_processes, num_chunks, num_mini_batch))
+        num_sequences_per_batch = num_sequences // num_mini_batch
+        perm = torch.randperm(num_sequences).to(self.rewards.device)
+
+        # (T, num_sequences, ...) tensors, sequence c * num_processes + i being chunk c of
+        # environment i
+        def sequences(tensor):
+            if num_chunks == 1:
+                return tensor
+            return tensor.view(num_chunks, T, *tensor.size()[1:]).transpose(0, 1).reshape(
+                T, num_sequences, *tensor.size()[2:])
+
+        obs = self.obs[:-1]
+        obs_items = obs.items if isinstance(obs, TupleTensor) else [obs]
+        tensors = [sequences(item) for item in obs_items] + [
+            sequences(self.actions),
+            sequences(self.value_preds[:-1]),
+            sequences(self.returns[:-1]),
+            sequences(self.masks[:-1]),
+            sequences(self.action_log_probs),
+            sequences(advantages)]
+        # The hidden states the chunks start from, (num_sequences, -1)
+        hidden_states = self.recurrent_hidden_states[:-1:T].reshape(num_sequences, -1)
+
+        for start in range(0, num_sequences, num_sequences_per_batch):
+            indices = perm[start:start + num_sequences_per_batch]
+            N = indices.size(0)
+            buffers = self.sequence_buffers.get((T, N))
+            if buffers is None:
+                buffers = [tensor.new_empty(T, N, *tensor.size()[2:]) for tensor in tensors] + [
+                    hidden_states.new_empty(N, hidden_states.size(1))]
+                self.sequence_buffers[T, N] = buffers
+            for tensor, buffer in zip(tensors, buffers):
+                torch.index_select(tensor, 1, indices, out=buffer)
+            torch.index_select(hidden_states, 0, indices, out=buffers[-1])
 
             # Flatten the (T, N, ...) tensors to (T * N, ...)
-            obs_batch = _flatten_helper(T, N, obs_batch)
-            actions_batch = _flatten_helper(T, N, actions_batch)
-            value_preds_batch = _flatten_helper(T, N, value_preds_batch)
-            return_batch = _flatten_helper(T, N, return_batch)
-            masks_batch = _flatten_helper(T, N, masks_batch)
-            old_action_log_probs_batch = _flatten_helper(T, N, \
-                    old_action_log_probs_batch)
-            adv_targ = _flatten_helper(T, N, adv_targ)
-
-            yield obs_batch, recurrent_hidden_states_batch, actions_batch, \
-                value_preds_batch, return_batch, masks_batch, old_action_log_probs_batch, adv_targ
+            batch = [_flatten_helper(T, N, buffer) for buffer in buffers[:-1]]
+            obs_batch = batch[:len(obs_items)]
+            obs_batch = TupleTensor(*obs_batch) if len(obs_items) > 1 else obs_batch[0]
+            yield (obs_batch, buffers[-1], *batch[len(obs_items):])
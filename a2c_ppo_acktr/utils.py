@@ -1,3 +1,6 @@
+import os
+
+import torch
 import torch.nn as nn
 
 
@@ -28,6 +31,13 @@ class AddBias(nn.Module):
         return x + bias
 
 
+# Saves through a temporary file, so that a crash while writing leaves the last save intact
+def save_atomic(obj, path):
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
 def update_linear_schedule(optimizer, epoch, total_num_epochs, initial_lr):
     """Decreases the learning rate linearly"""
     lr = initial_lr - (initial_lr * (epoch / float(total_num_epochs)))
@@ -0,0 +1,52 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from envs.envs import make_vec_envs
+from envs.pipelines import pipelines
+
+parser = argparse.ArgumentParser(description='Environment throughput')
+parser.add_argument('--pipeline', default='rack',
+                    help='pipeline whose environment to step (default: rack)')
+parser.add_argument('--scene', default=None,
+                    help='scene to step (default: the pipeline\'s task scene)')
+parser.add_argument('--dense', action='store_true', default=False,
+                    help='step the dense reward environment rather than the sparse one')
+parser.add_argument('--num-processes', type=int, default=8,
+                    help='number of environments stepped in parallel (default: 8)')
+parser.add_argument('--num-steps', type=int, default=1000,
+                    help='number of vectorised steps to time (default: 1000)')
+parser.add_argument('--step-timeout', type=float, default=None,
+                    help='step through the supervised simulator pool with this timeout')
+args = parser.parse_args()
+
+
+# Times random actions through the full make_vec_envs stack. To run without V-Rep, set
+# VREP_STANDIN=1 so that the environments talk to the stand-in in vrep_standin instead.
+def main():
+    pipeline = pipelines[args.pipeline]
+    env = pipeline['dense' if args.dense else 'sparse']
+    scene = args.scene or pipeline['task']
+    device = torch.device('cpu')
+
+    start = time.time()
+    envs = make_vec_envs(env, scene, 0, args.num_processes, None, None, device, False, None,
+                         init_control=False, step_timeout=args.step_timeout)
+    envs.reset()
+    print(f"Launched {args.num_processes} environments in {time.time() - start:.2f}s")
+
+    actions = torch.from_numpy(np.stack([envs.action_space.sample()
+                                         for _ in range(args.num_processes)])).float()
+    start = time.time()
+    for _ in range(args.num_steps):
+        envs.step(actions)
+    elapsed = time.time() - start
+    print(f"{args.num_steps * args.num_processes} steps in {elapsed:.2f}s - "
+          f"{args.num_steps * args.num_processes / elapsed:.1f} FPS")
+    envs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import time
+
+import torch
+from gym.spaces import Box
+
+from a2c_ppo_acktr.storage import RolloutStorage
+
+parser = argparse.ArgumentParser(description='Return computation speed')
+parser.add_argument('--num-steps', type=int, nargs='+', default=[5, 64, 256, 1024],
+                    help='rollout lengths to time (default: 5 64 256 1024)')
+parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 16, 64],
+                    help='numbers of environments to time (default: 1 16 64)')
+parser.add_argument('--repeats', type=int, default=20,
+                    help='times each computation is repeated (default: 20)')
+parser.add_argument('--cuda', action='store_true', default=False,
+                    help='time the computation on the GPU')
+args = parser.parse_args()
+
+
+# RolloutStorage.compute_returns as it was, stepping through every operation in Python
+def reference_returns(rollouts, next_value, use_gae, gamma, tau):
+    if use_gae:
+        rollouts.value_preds[-1] = next_value
+        gae = 0
+        for step in reversed(range(rollouts.rewards.size(0))):
+            delta = rollouts.rewards[step] + gamma * rollouts.value_preds[step + 1] * \
+                rollouts.masks[step + 1] - rollouts.value_preds[step]
+            gae = delta + gamma * tau * rollouts.masks[step + 1] * gae
+            gae = gae * rollouts.bad_masks[step + 1]
+            rollouts.returns[step] = gae + rollouts.value_preds[step]
+    else:
+        rollouts.returns[-1] = next_value
+        for step in reversed(range(rollouts.rewards.size(0))):
+            rollouts.returns[step] = (rollouts.returns[step + 1] * gamma *
+                                      rollouts.masks[step + 1] + rollouts.rewards[step]) * \
+                rollouts.bad_masks[step + 1] + \
+                (1 - rollouts.bad_masks[step + 1]) * rollouts.value_preds[step]
+
+
+# A rollout of random rewards and values, with episodes ending and steps missing here and there
+def random_rollout(num_steps, num_processes, device):
+    rollouts = RolloutStorage(num_steps, num_processes, (1,), Box(-1, 1, (1,)), 1)
+    rollouts.rewards.normal_()
+    rollouts.value_preds.normal_()
+    rollouts.masks.bernoulli_(0.95)
+    rollouts.bad_masks.bernoulli_(0.98)
+    rollouts.to(device)
+    return rollouts
+
+
+def time_returns(compute_returns, rollouts, next_value, use_gae, device):
+    compute_returns(rollouts, next_value, use_gae, 0.99, 0.95)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(args.repeats):
+        compute_returns(rollouts, next_value, use_gae, 0.99, 0.95)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / args.repeats
+
+
+# Times the vectorised RolloutStorage.compute_returns against the step by step version, after
+# checking that they agree exactly.
+def main():
+    torch.set_num_threads(1)
+    device = torch.device('cuda:0' if args.cuda else 'cpu')
+    for use_gae in (True, False):
+        print("GAE" if use_gae else "Discounted returns")
+        for num_steps in args.num_steps:
+            for num_processes in args.num_processes:
+                rollouts = random_rollout(num_steps, num_processes, device)
+                next_value = torch.randn(num_processes, 1, device=device)
+                reference_returns(rollouts, next_value, use_gae, 0.99, 0.95)
+                expected = rollouts.returns.clone()
+                rollouts.returns.zero_()
+                rollouts.compute_returns(next_value, use_gae, 0.99, 0.95)
+                assert torch.equal(rollouts.returns, expected), "Returns differ"
+
+                before = time_returns(reference_returns, rollouts, next_value, use_gae, device)
+                after = time_returns(RolloutStorage.compute_returns, rollouts, next_value,
+                                     use_gae, device)
+                print(f"  {num_steps} steps x {num_processes} processes: "
+                      f"{before * 1e3:.3f}ms -> {after * 1e3:.3f}ms ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import numpy as np
+
+from envs import DRRewardEnvs, ReachOverWallEnv as ROW, ShelfStackEnv as SS
+from envs.BatchedSawyerVecEnv import BatchedSawyerVecEnv, rotations_about
+from envs.DishRackEnv import DishRackEnv, rack_lower, rack_upper
+from vrep_standin.model import dish_rack, reach_over_wall, shelf
+
+# Batched counterparts of the environments in pipelines.py, with the same observations, rewards
+# and infos. Task objects start where the stand-in's layouts put them.
+
+
+class BatchedDishRackVecEnv(BatchedSawyerVecEnv):
+    observation_space = DishRackEnv.observation_space
+    ep_len = 64
+    layout = staticmethod(dish_rack)
+
+    def setup_task(self):
+        rack = self.scene.handles['DishRack']
+        target = self.scene.objects[self.scene.handles['Target']]
+        self.rack_pos = np.tile(self.scene.get_position(rack), (self.num_envs, 1))
+        self.rack_rot = np.zeros(self.num_envs)
+        self.target_offset = target.position
+        self.target_local_rot = target.rotation
+
+    def reset_task(self, mask):
+        n = mask.sum()
+        self.rack_pos[mask, 0] = self.np_random.uniform(rack_lower[0], rack_upper[0], n)
+        self.rack_pos[mask, 1] = self.np_random.uniform(rack_lower[1], rack_upper[1], n)
+        self.rack_rot[mask] = self.np_random.uniform(rack_lower[2], rack_upper[2], n)
+        rot = rotations_about([1., 0., 0.], self.rack_rot[mask])
+        self.target_pos[mask] = self.rack_pos[mask] + rot @ self.target_offset
+        self.target_rot[mask] = rot @ self.target_local_rot
+
+    def task_obs(self):
+        return self.rack_rot[:, None]
+
+    def is_success(self, displacement, orientation_diff):
+        return np.all(orientation_diff <= DRRewardEnvs.max_rot, axis=1) & \
+            np.all(displacement <= DRRewardEnvs.max_displacement, axis=1)
+
+
+class BatchedDRSparseVecEnv(BatchedDishRackVecEnv):
+
+    def rewards(self):
+        displacement = np.abs(self.get_subject_vector())
+        orientation_diff = np.abs(self.get_subject_orientation()[:, :-1])
+        rews = 0.1 * self.is_success(displacement, orientation_diff)
+        return rews, [dict(rew_success=rew) for rew in rews]
+
+
+class BatchedDRDenseVecEnv(BatchedDishRackVecEnv):
+
+    def rewards(self):
+        displacement = np.abs(self.get_subject_vector())
+        dist = np.linalg.norm(displacement, axis=1)
+        orientation_diff = np.abs(self.get_subject_orientation()[:, :-1])
+
+        rew_dist = - dist
+        rew_orientation = - orientation_diff.sum(axis=1) / np.maximum(dist, 0.11)
+        rews = 0.01 * (rew_dist + 0.1 * rew_orientation)
+        rew_success = self.is_success(displacement, orientation_diff).astype(int)
+
+        return rews, [dict(rew_dist=d, rew_orientation=o, rew_success=s)
+                      for d, o, s in zip(rew_dist, rew_orientation, rew_success)]
+
+
+class BatchedReachOverWallVecEnv(BatchedSawyerVecEnv):
+    observation_space = ROW.ReachOverWallEnv.observation_space
+    ep_len = 100
+    layout = staticmethod(reach_over_wall)
+
+    def setup_task(self):
+        target = self.scene.handles['Target']
+        self.wall_pos = self.scene.get_position(self.scene.handles['Wall'])
+        self.target_pos[:] = self.scene.get_position(target)
+        self.target_rot[:] = self.scene.world_pose(target)[1]
+
+    def reset_task(self, mask):
+        n = mask.sum()
+        self.target_pos[mask, 0] = self.np_random.uniform(ROW.cube_lower[0], ROW.cube_upper[0], n)
+        self.target_pos[mask, 1] = self.np_random.uniform(ROW.cube_lower[1], ROW.cube_upper[1], n)
+
+    def task_obs(self):
+        return np.full((self.num_envs, 1), self.wall_pos[0])
+
+
+class BatchedROWSparseVecEnv(BatchedReachOverWallVecEnv):
+
+    def rewards(self):
+        displacement = np.abs(self.get_subject_vector())
+        rews = 0.1 * np.all(displacement <= ROW.max_displacement, axis=1)
+        return rews, [dict(rew_success=rew) for rew in rews]
+
+
+class BatchedROWDenseVecEnv(BatchedReachOverWallVecEnv):
+
+    def rewards(self):
+        reward_dist = - np.linalg.norm(self.subject_pos - self.target_pos, axis=1)
+        return 0.01 * reward_dist, [dict(reward_dist=d) for d in reward_dist]
+
+
+class BatchedShelfStackVecEnv(BatchedSawyerVecEnv):
+    observation_space = SS.ShelfStackEnv.observation_space
+    ep_len = 64
+    layout = staticmethod(shelf)
+    random_joints = False
+
+    def setup_task(self):
+        target = self.scene.handles['Target']
+        self.target_pos[:] = self.scene.get_position(target)
+        self.target_pos[:, :2] = SS.trg_pos
+        self.target_rot[:] = self.scene.world_pose(target)[1]
+        self.start_rot = self.scene.world_pose(self.scene.handles['MvTarget'])[1]
+
+    # As ShelfStackEnv.reset, start with the mug held at a random point above the shelf
+    def reset_joints(self, mask):
+        super().reset_joints(mask)
+        n = mask.sum()
+        start_pos = self.np_random.uniform(SS.start_lower, SS.start_upper, (n, 3))
+        self.solve_ik(mask, start_pos, np.tile(self.start_rot, (n, 1, 1)))
+
+    def orientation_diff(self):
+        return np.abs(self.get_subject_orientation()[:, :-1])
+
+
+class BatchedSSSparseVecEnv(BatchedShelfStackVecEnv):
+
+    def rewards(self):
+        displacement = np.abs(self.get_subject_vector())
+        rews = 0.1 * (np.all(self.orientation_diff() <= SS.max_rot, axis=1) &
+                      np.all(displacement <= SS.max_displacement, axis=1))
+        return rews, [dict(rew_success=rew) for rew in rews]
+
+
+class BatchedSSDenseVecEnv(BatchedShelfStackVecEnv):
+
+    def rewards(self):
+        dist = np.linalg.norm(self.get_subject_vector(), axis=1)
+        orientation_diff = self.orientation_diff().sum(axis=1)
+
+        rew_dist = - dist
+        rew_ctrl = - np.square(np.abs(self.curr_action).mean(axis=1))
+        rew_orientation = - orientation_diff / np.maximum(dist, 0.04)  # Radius = 0.04
+        rews = 0.1 * (rew_dist + rew_ctrl + 0.05 * rew_orientation)
+
+        return rews, [dict(rew_dist=d, rew_orientation=o)
+                      for d, o in zip(rew_dist, rew_orientation)]
@@ -0,0 +1,93 @@
+import numpy as np
+from baselines.common.vec_env import VecEnv
+from gym import spaces
+
+
+class BatchedReach2DVecEnv(VecEnv):
+    """
+    Reach2DEnv for a whole array of arms at once, with kinematics and rewards computed for every
+    arm in one go rather than one process per environment. Finished episodes are reset straight
+    away with their 'episode' info filled in. Rendering is left to Reach2DEnv.
+
+    Reach2DEnv has no notion of success, so for evaluation an arm whose end is within
+    success_dist of the target after a step counts as successful, in the 'rew_success' info.
+
+    The scene name, init_control and action_scale arguments only exist so that make_vec_envs can
+    construct it like the other batched environments (see BatchedSawyerVecEnv), and are unused.
+    """
+    batched = True
+    # As Reach2DEnv's, which isn't imported so that pygame isn't needed
+    observation_space = spaces.Box(np.array([0, 0, 0, 0, 0]),
+                                   np.array([1, 1, 1, 1, 1]),
+                                   dtype=np.float32)
+    action_space = spaces.Box(np.array([0, 0, 0]),
+                              np.array([1, 1, 1]), dtype=np.float32)
+    link_lengths = np.array([0.2, 0.15, 0.1])
+    init_joint_angles = np.array([0.1, 1.0, 0.5])
+    max_dt = np.pi / 18
+    success_dist = 0.02
+
+    def __init__(self, num_envs, scene_name=None, seed=0, init_control=True, action_scale=1.,
+                 ep_len=32):
+        VecEnv.__init__(self, num_envs, self.observation_space, self.action_space)
+        self.np_random = np.random.RandomState(seed)
+        self.ep_len = ep_len
+        self.joint_angles = np.tile(self.init_joint_angles, (num_envs, 1))
+        self.target_pose = np.zeros((num_envs, 2))
+        self.timestep = np.zeros(num_envs, dtype=int)
+        self.episode_rewards = np.zeros(num_envs)
+        self.actions = None
+
+    def reset_envs(self, mask):
+        self.target_pose[mask] = self.np_random.uniform(0, 0.3, (mask.sum(), 2))
+        self.joint_angles[mask] = self.init_joint_angles
+        self.timestep[mask] = 0
+        self.episode_rewards[mask] = 0.
+
+    def reset(self):
+        self.reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._get_obs()
+
+    # Each link lies along the y axis of its joint's frame, so the end is at the sum over links
+    # of length * (-sin, cos) of the cumulative joint angle.
+    def compute_end_pose(self):
+        angles = np.cumsum(self.joint_angles, axis=1)
+        return np.stack([-np.sin(angles) @ self.link_lengths,
+                         np.cos(angles) @ self.link_lengths], axis=1)
+
+    # Joint angles as a fraction of a full turn in [0, 1), as Reach2DEnv.normalise_joints
+    def normalise_joints(self):
+        js = self.joint_angles / np.pi
+        shifted = (js + (np.abs(js) // 2 + 1.5) * 2) / 2.
+        return shifted - np.trunc(shifted)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        joint_velocities = np.asarray(self.actions, dtype=float).reshape(self.num_envs, -1) * \
+            2 * self.max_dt - self.max_dt
+        reward_dist = - np.linalg.norm(self.compute_end_pose() - self.target_pose, axis=1)
+        reward_ctrl = - np.square(joint_velocities).sum(axis=1)
+        rews = reward_dist + reward_ctrl
+
+        self.joint_angles += joint_velocities
+        self.timestep += 1
+        self.episode_rewards += rews
+
+        rew_success = (np.linalg.norm(self.compute_end_pose() - self.target_pose, axis=1) <=
+                       self.success_dist).astype(int)
+        infos = [dict(reward_dist=d, reward_ctrl=c, rew_success=s)
+                 for d, c, s in zip(reward_dist, reward_ctrl, rew_success)]
+        dones = self.timestep == self.ep_len
+        for i in np.flatnonzero(dones):
+            infos[i]['episode'] = {'r': self.episode_rewards[i], 'l': self.ep_len}
+        if dones.any():
+            self.reset_envs(dones)
+        return self._get_obs(), rews, dones, infos
+
+    def _get_obs(self):
+        return np.append(self.normalise_joints(), self.target_pose, axis=1)
+
+    def close(self):
+        pass
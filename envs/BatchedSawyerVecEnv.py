@@ -0,0 +1,202 @@
+import numpy as np
+from baselines.common.vec_env import VecEnv
+
+from envs.GoalDrivenEnv import GoalDrivenEnv
+from envs.SawyerEnv import SawyerEnv
+from vrep_standin.model import Scene
+
+
+# Rotations by angles (N,) about one fixed unit axis, as (N, 3, 3)
+def rotations_about(axis, angles):
+    x, y, z = axis
+    skew = np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+    return np.identity(3) + np.sin(angles)[:, None, None] * skew + \
+        (1 - np.cos(angles))[:, None, None] * (skew @ skew)
+
+
+# Batched model.matrix_to_euler, V-Rep's Euler angles of (N, 3, 3) rotations as (N, 3)
+def matrices_to_euler(rot):
+    beta = np.arcsin(np.clip(rot[:, 0, 2], -1., 1.))
+    alpha = np.arctan2(-rot[:, 1, 2], rot[:, 2, 2])
+    gamma = np.arctan2(-rot[:, 0, 1], rot[:, 0, 0])
+    return np.stack([alpha, beta, gamma], axis=1)
+
+
+class BatchedSawyerVecEnv(VecEnv):
+    """
+    Simulates num_envs Sawyer arms at once in this process, as a stand-in for a vector of
+    GoalDrivenEnvs when what is being worked on is the learning rather than the task. The arm is
+    the kinematic one of vrep_standin, driven by a Cartesian velocity controller: each action
+    moves the tip by action[:3] and rotates it by action[3:] * rotation_scale, through damped
+    least squares on the Jacobian. There are no collisions.
+
+    Observations are laid out as in GoalDrivenEnv._get_obs: the joint angles, the vector from the
+    subject (the tip) to the target, then whatever the task adds. The action wrappers applied to
+    each environment by envs.make_env are applied here to the whole batch, and finished episodes
+    are reset straight away with their 'episode' info filled in, as by bench.Monitor.
+    """
+    batched = True
+    num_joints = SawyerEnv.num_joints
+    action_space = GoalDrivenEnv.action_space
+    observation_space = None
+    ep_len = 64
+    # Scene layout (see vrep_standin.model) the arm and task objects start from
+    layout = None
+    random_joints = True
+    joint_noise = SawyerEnv.scale
+    max_joint_velocity = Scene.max_joint_velocity
+    dt = Scene.dt
+    rotation_scale = Scene.rotation_scale
+    damping = 0.05
+
+    def __init__(self, num_envs, scene_name, seed, init_control=True, action_scale=1.):
+        VecEnv.__init__(self, num_envs, self.observation_space, self.action_space)
+        self.scene_name = scene_name
+        self.init_control = init_control
+        self.action_scale = action_scale
+        self.np_random = np.random.RandomState(seed)
+
+        scene = Scene(self.layout)
+        self.joint_offsets = np.array(scene.joint_offsets)
+        self.joint_axes = np.array(scene.joint_axes, dtype=float)
+        tip = scene.objects[scene.tip]
+        self.tip_offset = tip.position
+        self.tip_rotation = tip.rotation
+        self.init_joint_angles = scene.init_q
+        self.scene = scene
+
+        self.q = np.tile(self.init_joint_angles, (num_envs, 1))
+        self.target_pos = np.zeros((num_envs, 3))
+        self.target_rot = np.tile(np.identity(3), (num_envs, 1, 1))
+        self.timestep = np.zeros(num_envs, dtype=int)
+        self.episode_rewards = np.zeros(num_envs)
+        self.curr_action = np.zeros((num_envs, 6))
+        self.actions = None
+        self.setup_task()
+
+    # Overridden by children to read the task's fixed state from self.scene
+    def setup_task(self):
+        pass
+
+    # Overridden by children to randomise the task state of the environments in mask, before
+    # the arm is placed by reset_joints
+    def reset_task(self, mask):
+        pass
+
+    def reset_joints(self, mask):
+        n = mask.sum()
+        if self.random_joints:
+            self.q[mask] = self.np_random.multivariate_normal(
+                self.init_joint_angles, self.joint_noise * np.identity(self.num_joints), n)
+        else:
+            self.q[mask] = self.init_joint_angles
+
+    def reset_envs(self, mask):
+        self.reset_task(mask)
+        self.reset_joints(mask)
+        self.timestep[mask] = 0
+        self.episode_rewards[mask] = 0.
+        self.curr_action[mask] = 0.
+
+    def reset(self):
+        self.reset_envs(np.ones(self.num_envs, dtype=bool))
+        self.forward_kinematics()
+        return self._get_obs()
+
+    # Tip pose and the Jacobian of every arm, from the joint angles
+    def forward_kinematics(self):
+        n = self.num_envs
+        pos = np.zeros((n, 3))
+        rot = np.tile(np.identity(3), (n, 1, 1))
+        joint_pos = np.empty((n, self.num_joints, 3))
+        joint_axes = np.empty((n, self.num_joints, 3))
+        for i in range(self.num_joints):
+            pos = pos + rot @ self.joint_offsets[i]
+            joint_pos[:, i] = pos
+            joint_axes[:, i] = rot @ self.joint_axes[i]
+            rot = rot @ rotations_about(self.joint_axes[i], self.q[:, i])
+        self.subject_pos = pos + rot @ self.tip_offset
+        self.subject_rot = rot @ self.tip_rotation
+        linear = np.cross(joint_axes, self.subject_pos[:, None] - joint_pos)
+        self.jacobian = np.concatenate([linear, joint_axes], axis=2).transpose(0, 2, 1)
+
+    # Joint velocities (as changes per step) that best produce the Cartesian twists (N, 6)
+    def joint_velocities(self, twists):
+        jacobian_t = self.jacobian.transpose(0, 2, 1)
+        damped = self.jacobian @ jacobian_t + self.damping ** 2 * np.identity(6)
+        dq = (jacobian_t @ np.linalg.solve(damped, twists[:, :, None]))[:, :, 0]
+        max_change = self.max_joint_velocity * self.dt
+        return np.clip(dq, -max_change, max_change)
+
+    # Damped least squares that moves the arms in mask towards tip positions and rotations
+    # (given for those arms only)
+    def solve_ik(self, mask, position, rotation, iterations=100):
+        for _ in range(iterations):
+            self.forward_kinematics()
+            error = rotation @ self.subject_rot[mask].transpose(0, 2, 1)
+            # Small angle approximation of the rotation vector, good enough as it converges
+            angles = 0.5 * np.stack([error[:, 2, 1] - error[:, 1, 2],
+                                     error[:, 0, 2] - error[:, 2, 0],
+                                     error[:, 1, 0] - error[:, 0, 1]], axis=1)
+            twists = np.zeros((self.num_envs, 6))
+            twists[mask] = np.concatenate([position - self.subject_pos[mask], angles], axis=1)
+            self.q[mask] = np.clip(self.q + self.joint_velocities(twists), -np.pi, np.pi)[mask]
+
+    # Subject pose in the target's frame
+    def get_subject_vector(self):
+        diff = self.subject_pos - self.target_pos
+        return (self.target_rot.transpose(0, 2, 1) @ diff[:, :, None])[:, :, 0]
+
+    def get_subject_orientation(self):
+        return matrices_to_euler(self.target_rot.transpose(0, 2, 1) @ self.subject_rot)
+
+    # Batched ScaleActions, InitialController and BoundPositionVelocity, in the order make_env
+    # applies them
+    def process_actions(self, actions):
+        actions = np.array(actions, dtype=float).reshape(self.num_envs, -1) * self.action_scale
+        high = self.action_space.high[0]
+        if self.init_control:
+            vec = self.target_pos - self.subject_pos
+            out = np.any(np.abs(vec) > high, axis=1)
+            vec[out] *= high / np.max(np.abs(vec[out]), axis=1, keepdims=True)
+            actions[:, :3] += vec
+        pos = actions[:, :3]
+        out = np.any(np.abs(pos) > high, axis=1)
+        pos[out] *= high / np.max(np.abs(pos[out]), axis=1, keepdims=True)
+        return actions
+
+    # Rewards and infos for the state before self.curr_action is applied. Overridden by children.
+    def rewards(self):
+        return np.zeros(self.num_envs), [{} for _ in range(self.num_envs)]
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        self.curr_action = self.process_actions(self.actions)
+        rews, infos = self.rewards()
+
+        twists = np.concatenate([self.curr_action[:, :3],
+                                 self.curr_action[:, 3:] * self.rotation_scale], axis=1)
+        self.q = np.clip(self.q + self.joint_velocities(twists), -np.pi, np.pi)
+        self.timestep += 1
+        self.episode_rewards += rews
+
+        dones = self.timestep == self.ep_len
+        for i in np.flatnonzero(dones):
+            infos[i]['episode'] = {'r': self.episode_rewards[i], 'l': self.ep_len}
+        if dones.any():
+            self.reset_envs(dones)
+        self.forward_kinematics()
+        return self._get_obs(), rews, dones, infos
+
+    # Overridden by children to append task observations
+    def task_obs(self):
+        return np.zeros((self.num_envs, 0))
+
+    def _get_obs(self):
+        return np.concatenate([self.q, self.target_pos - self.subject_pos, self.task_obs()],
+                              axis=1)
+
+    def close(self):
+        pass
@@ -14,14 +14,14 @@ class DRSparseEnv(DishRackEnv):
 
     def step(self, a):
         self.curr_action = a
-        displacement = np.abs(self.get_vector(self.target_handle, self.subject_handle))
+        displacement = np.abs(self.get_subject_vector())
         orientation_diff = np.abs(self.get_plate_orientation())
 
         rew = 0.1 if np.all(orientation_diff <= max_rot) and \
                              np.all(displacement <= max_displacement) else 0
 
         self.timestep += 1
-        if self.vis_mode:
+        if self.vis_mode and self.timestep % self.randomise_interval == 0:
             self.randomise_domain()
         self.update_sim()
 
@@ -35,7 +35,7 @@ class DRDenseEnv(DishRackEnv):
 
     def step(self, a):
         self.curr_action = a
-        displacement = np.abs(self.get_vector(self.target_handle, self.subject_handle))
+        displacement = np.abs(self.get_subject_vector())
         dist = np.linalg.norm(displacement)
         orientation_diff = np.abs(self.get_plate_orientation()).sum()
 
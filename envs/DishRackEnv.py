@@ -38,37 +38,41 @@ class DishRackEnv(GoalDrivenEnv):
     stand_h = None
     stand_height = None
     init_stand_pos = None
+    batched_domain = False
+    # Steps between randomisations of the domain, which also happen on every reset
+    randomise_interval = 1
 
     def __init__(self, *args):
+        self.ep_len = 64
         super().__init__(*args)
 
-        self.ep_len = 64
-        self.rack_handle = catch_errors(vrep.simxGetObjectHandle(self.cid,
-                "DishRack", vrep.simx_opmode_blocking))
-        self.rack_pos = catch_errors(vrep.simxGetObjectPosition(self.cid, self.rack_handle,
-                -1, vrep.simx_opmode_blocking))
-        self.rack_rot_ref = catch_errors(vrep.simxGetObjectHandle(self.cid,
-                "DefaultOrientation", vrep.simx_opmode_blocking))
+    def setup_scene(self):
+        super().setup_scene()
+
+        # Vision is set up again on request for each new scene (see render)
+        self.vis_mode = False
+        self.init_colors = []
+        self.rack_handle = self.get_handle("DishRack")
+        self.rack_pos = self.get_initial_position(self.rack_handle)
+        self.rack_rot_ref = self.get_handle("DefaultOrientation")
         self.rack_rot = catch_errors(vrep.simxGetObjectOrientation(self.cid, self.rack_handle,
                 self.rack_rot_ref, vrep.simx_opmode_blocking))
-        self.target_handle = catch_errors(vrep.simxGetObjectHandle(self.cid,
-                "Target", vrep.simx_opmode_blocking))
-        self.joint_targets = None
-        self.mv_trg_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "MvTarget",
-                                                                   vrep.simx_opmode_blocking))
+        self.target_handle = self.get_handle("Target")
+        self.mv_trg_handle = self.get_handle("MvTarget")
 
     def reset(self):
         super(DishRackEnv, self).reset()
         self.rack_pos[0] = self.np_random.uniform(rack_lower[0], rack_upper[0])
         self.rack_pos[1] = self.np_random.uniform(rack_lower[1], rack_upper[1])
         self.rack_rot[0] = self.np_random.uniform(rack_lower[2], rack_upper[2])
-        vrep.simxSetObjectPosition(self.cid, self.rack_handle, -1, self.rack_pos,
+        vrep.simxSetObjectPosition(self.cid, self.rack_handle, self.origin, self.rack_pos,
                                    vrep.simx_opmode_blocking)
         vrep.simxSetObjectOrientation(self.cid, self.rack_handle, self.rack_rot_ref, self.rack_rot,
                                       vrep.simx_opmode_blocking)
-        trg_rot = catch_errors(vrep.simxGetObjectOrientation(self.cid, self.target_handle, -1,
+        trg_rot = catch_errors(vrep.simxGetObjectOrientation(self.cid, self.target_handle,
+                                                             self.origin,
                                                              vrep.simx_opmode_blocking))
-        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, -1, trg_rot,
+        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, self.origin, trg_rot,
                                       vrep.simx_opmode_blocking)
 
         if self.vis_mode:
@@ -77,7 +81,7 @@ class DishRackEnv(GoalDrivenEnv):
                                           self.np_random.uniform(-self.max_height_displacement,
                                                                  self.max_height_displacement,
                                                                  1))
-            vrep.simxSetObjectPosition(self.cid, self.stand_h, -1,
+            vrep.simxSetObjectPosition(self.cid, self.stand_h, self.origin,
                                        self.init_stand_pos + stand_height_diff,
                                        vrep.simx_opmode_blocking)
 
@@ -89,9 +93,7 @@ class DishRackEnv(GoalDrivenEnv):
         return np.append(base_obs, self.rack_rot[:1])
 
     def get_plate_orientation(self):
-        orientation = catch_errors(vrep.simxGetObjectOrientation(
-            self.cid, self.subject_handle, self.target_handle, vrep.simx_opmode_blocking))
-        return np.array(orientation[:-1])
+        return self.get_subject_orientation()[:-1]
 
     # Typical render modes are rgb_array and human. Others are abuse of the get_images/render
     # functions for gathering training data from base environments.
@@ -133,22 +135,18 @@ class DishRackEnv(GoalDrivenEnv):
                              dtype=np.uint8).reshape((self.res[0], self.res[1], num_channels))
 
     def setup_vision(self):
-        self.vis_handle = catch_errors(vrep.simxGetObjectHandle(self.cid,
-                                                                "Vision_sensor",
-                                                                vrep.simx_opmode_blocking))
+        self.vis_handle = self.get_handle("Vision_sensor")
         self.res = self.call_lua_function('get_resolution')[0]
-        self.subject_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "Plate",
-                                                                  vrep.simx_opmode_blocking))
-        self.cloth_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "Cloth",
-                                                                  vrep.simx_opmode_blocking))
-        self.stand_h = catch_errors(vrep.simxGetObjectHandle(self.cid, "Stand",
-                                                             vrep.simx_opmode_blocking))
-        self.init_cam_pos = catch_errors(vrep.simxGetObjectPosition(self.cid, self.vis_handle, -1,
-                                                                    vrep.simx_opmode_blocking))
-        self.init_cam_rot = catch_errors(
-            vrep.simxGetObjectOrientation(self.cid, self.vis_handle, -1, vrep.simx_opmode_blocking))
-        self.init_stand_pos = catch_errors(
-            vrep.simxGetObjectPosition(self.cid, self.stand_h, -1, vrep.simx_opmode_blocking))
+        self.subject_handle = self.get_handle("Plate")
+        if not self.batched_step:
+            self.stream_subject()
+        self.cloth_handle = self.get_handle("Cloth")
+        self.stand_h = self.get_handle("Stand")
+        self.init_cam_pos = self.get_initial_position(self.vis_handle)
+        self.init_cam_rot = self.get_initial_orientation(self.vis_handle)
+        self.init_stand_pos = self.get_initial_position(self.stand_h)
+        # Scenes with the function in scenes/domain_randomisation.lua are randomised in one call
+        self.batched_domain = self.has_lua_function('randomise_domain', ints=[0, 0, 0])
 
         def init_color(handle, scale):
             return [(handle, self.call_lua_function('get_color', ints=[handle])[1], scale)]
@@ -157,57 +155,56 @@ class DishRackEnv(GoalDrivenEnv):
         self.init_colors += init_color(self.rack_handle, 0.05)
         self.init_colors += init_color(self.cloth_handle, 0.05)
 
-        self.light_handles = [catch_errors(vrep.simxGetObjectHandle(self.cid, f'LocalLight{c}',
-                                                                    vrep.simx_opmode_blocking))
-                              for c in ['A', 'B', 'C', 'D']]
-        self.light_poss = [catch_errors(vrep.simxGetObjectPosition(self.cid, handle, -1,
-                                                                   vrep.simx_opmode_blocking))
-                           for handle in self.light_handles]
-        self.light_rots = [catch_errors(vrep.simxGetObjectOrientation(self.cid, handle, -1,
-                                                                   vrep.simx_opmode_blocking))
-                           for handle in self.light_handles]
+        self.light_handles = [self.get_handle(f'LocalLight{c}') for c in ['A', 'B', 'C', 'D']]
+        self.light_poss = [self.get_initial_position(handle) for handle in self.light_handles]
+        self.light_rots = [self.get_initial_orientation(handle) for handle in self.light_handles]
 
-    def randomise_domain(self):
+    # Colours, (handle, position, orientation) poses and (handle, enabled) light states of a new
+    # randomised domain
+    def sample_domain(self):
         # VARY COLORS
         colors = [(handle, self.np_random.normal(loc=color, scale=scale))
                   for handle, color, scale in self.init_colors]
-        for handle, color in colors:
-            self.call_lua_function('set_color', ints=[handle], floats=color)
 
         # VARY CAMERA POSE
         cam_displacement = self.np_random.uniform(-self.max_cam_displace,
                                                   self.max_cam_displace, 3)
-        vrep.simxSetObjectPosition(self.cid, self.vis_handle, -1,
-                                   self.init_cam_pos + cam_displacement,
-                                   vrep.simx_opmode_blocking)
-        orientation_displacement = ((self.np_random.beta(2, 2, 3) - 0.5) * 2
-                                    * self.max_cam_rotation)
-        vrep.simxSetObjectOrientation(self.cid, self.vis_handle, -1,
-                                      self.init_cam_rot + orientation_displacement,
-                                      vrep.simx_opmode_blocking)
 
         # VARY LIGHTING
         # B and C are support lights and can be disabled.
         enabled = np.random.choice(a=[False, True], size=2)
-        for i in range(2):
-            f_name = 'enable_light' if enabled[i] else 'disable_light'
-            self.call_lua_function(f_name, ints=[self.light_handles[i + 1]])
+        lights = [(self.light_handles[i + 1], enabled[i]) for i in range(2)]
         light_displacement = self.np_random.uniform(-self.max_light_displace,
                                                     self.max_light_displace, (4, 3))
         orientation_displacement = self.np_random.uniform(-self.max_cam_rotation,
                                                           self.max_cam_rotation, 3)
-        for handle, pos, pdisplace, rot, rdisplace in zip(self.light_handles, self.light_poss,
-                                                          light_displacement, self.light_rots,
-                                                          orientation_displacement):
-            vrep.simxSetObjectPosition(self.cid, handle, -1, pos + pdisplace,
-                                       vrep.simx_opmode_blocking)
-            vrep.simxSetObjectOrientation(self.cid, handle, -1, rot + rdisplace,
-                                       vrep.simx_opmode_blocking)
+        poses = [(handle, pos + pdisplace, rot + rdisplace)
+                 for handle, pos, pdisplace, rot, rdisplace in zip(
+                     self.light_handles, self.light_poss, light_displacement, self.light_rots,
+                     orientation_displacement)]
         orientation_displacement = self.np_random.uniform(-self.max_cam_rotation,
-                                                            self.max_cam_rotation, 3)
-        vrep.simxSetObjectOrientation(self.cid, self.vis_handle, -1,
-                                      self.init_cam_rot + orientation_displacement,
-                                      vrep.simx_opmode_blocking)
+                                                          self.max_cam_rotation, 3)
+        poses += [(self.vis_handle, self.init_cam_pos + cam_displacement,
+                   self.init_cam_rot + orientation_displacement)]
+        return colors, poses, lights
 
-    def update_sim(self):
-        self.joint_targets = super(DishRackEnv, self).update_sim()
+    def randomise_domain(self):
+        colors, poses, lights = self.sample_domain()
+        if self.batched_domain:
+            ints = [len(colors), len(poses), len(lights)] + [h for h, _ in colors] + \
+                [h for h, _, _ in poses] + [h for h, _ in lights] + [int(e) for _, e in lights]
+            floats = np.concatenate([color for _, color in colors] +
+                                    [np.append(pos, rot) for _, pos, rot in poses])
+            self.call_lua_function('randomise_domain', ints=ints, floats=floats)
+            return
+
+        for handle, color in colors:
+            self.call_lua_function('set_color', ints=[handle], floats=color)
+        for handle, enabled in lights:
+            f_name = 'enable_light' if enabled else 'disable_light'
+            self.call_lua_function(f_name, ints=[handle])
+        for handle, pos, rot in poses:
+            vrep.simxSetObjectPosition(self.cid, handle, self.origin, pos,
+                                       vrep.simx_opmode_blocking)
+            vrep.simxSetObjectOrientation(self.cid, handle, self.origin, rot,
+                                          vrep.simx_opmode_blocking)
@@ -16,16 +16,26 @@ class GoalDrivenEnv(SawyerEnv):
                               dtype=np.float32)
     curr_action = np.array([0.] * 6)
     timestep = 0
+    joint_targets = None
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def setup_scene(self):
+        super().setup_scene()
 
-        self.subject_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "Subject",
-                                                                    vrep.simx_opmode_blocking))
-        self.target_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "Target",
-                                                                   vrep.simx_opmode_blocking))
+        self.subject_handle = self.get_handle("Subject")
+        self.target_handle = self.get_handle("Target")
         self.subject_pos = [0.]*3
         self.target_pos = [0.]*3
+        # Subject pose in the target's frame, as observed after the last simulation step
+        self.subject_vector = np.zeros(3)
+        self.subject_orientation = np.zeros(3)
+
+        # Scenes with the functions in scenes/batched_step.lua can be stepped and observed with
+        # one blocking round-trip instead of one per quantity.
+        self.batched_step = self.has_lua_function('observe_step',
+                                                  ints=[self.subject_handle, self.target_handle])
+        if not self.batched_step:
+            self.stream_joints()
+            self.stream_subject()
 
     def reset(self):
         super(GoalDrivenEnv, self).reset()
@@ -34,16 +44,57 @@ class GoalDrivenEnv(SawyerEnv):
         return self._get_obs()
 
     def _get_obs(self):
-        joint_obs = super(GoalDrivenEnv, self)._get_obs()
-        self.target_pos = self.get_position(self.target_handle)
-        self.subject_pos = self.get_position(self.subject_handle)
+        if self.batched_step:
+            joint_obs = self._observe_step()
+        else:
+            joint_obs = super(GoalDrivenEnv, self)._get_obs()
+            self.target_pos = self.get_position(self.target_handle)
+            self.subject_pos = self.get_position(self.subject_handle)
         pos_vector = self.target_pos - self.subject_pos
 
         return np.append(joint_obs, pos_vector)
 
-    def update_sim(self):
-        _, targets, _, _ = self.call_lua_function('update_robot_movement', floats=self.curr_action)
+    # Reads joint angles, subject/target poses and the last joint targets in a single call.
+    # Being blocking, it also waits for the step triggered in update_sim to finish.
+    def _observe_step(self):
+        _, floats, _, _ = self.call_lua_function('observe_step',
+                                                 ints=[self.subject_handle, self.target_handle])
+        floats = np.array(floats)
+        joint_obs = floats[:self.num_joints]
+        self.subject_pos, self.target_pos, self.subject_vector, self.subject_orientation = \
+            np.split(floats[self.num_joints:self.num_joints + 12], 4)
+        if len(floats) > self.num_joints + 12:
+            self.joint_targets = floats[self.num_joints + 12:]
+        return joint_obs
+
+    # Stream everything _get_obs and the rewards read. Called again if the subject changes.
+    def stream_subject(self):
+        self.stream(vrep.simxGetObjectPosition, self.target_handle, -1)
+        self.stream(vrep.simxGetObjectPosition, self.subject_handle, -1)
+        self.stream(vrep.simxGetObjectPosition, self.subject_handle, self.target_handle)
+        self.stream(vrep.simxGetObjectOrientation, self.subject_handle, self.target_handle)
 
-        vrep.simxSynchronousTrigger(self.cid)
-        vrep.simxGetPingTime(self.cid)
-        return targets
+    # Vector from the target to the subject under the target's axes.
+    def get_subject_vector(self):
+        if self.batched_step:
+            return self.subject_vector
+        return self.get_vector(self.target_handle, self.subject_handle)
+
+    # Orientation of the subject relative to the target.
+    def get_subject_orientation(self):
+        if self.batched_step:
+            return self.subject_orientation
+        return np.array(self.read_stream(vrep.simxGetObjectOrientation, self.subject_handle,
+                                         self.target_handle))
+
+    def update_sim(self):
+        if self.batched_step:
+            # Sent without waiting for a reply; the trigger below is queued behind it.
+            self.call_lua_function('apply_action', floats=self.curr_action,
+                                   opmode=vrep.simx_opmode_oneshot)
+            self.trigger()
+            return self.joint_targets
+        _, self.joint_targets, _, _ = self.call_lua_function('update_robot_movement',
+                                                             floats=self.curr_action)
+        self.step_simulation()
+        return self.joint_targets
@@ -0,0 +1,171 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe, Process, resource_tracker
+
+import numpy as np
+import vrep
+from baselines.common.vec_env import VecEnv, CloudpickleWrapper
+
+from envs.SharedMemoryVecEnv import SharedArray
+from envs.SimulatorPoolVecEnv import close_env
+
+
+class StepBarrier(object):
+    """
+    Lets the threads stepping the robots of one simulator run one at a time, as they share its
+    connection, and triggers the simulation once every robot has sent its action (see
+    VrepEnv.trigger).
+    """
+    def __init__(self, cid, num_robots):
+        self.lock = threading.Lock()
+        self.barrier = threading.Barrier(num_robots,
+                                         action=lambda: vrep.simxSynchronousTrigger(cid))
+
+    def wait(self):
+        self.lock.release()
+        try:
+            self.barrier.wait()
+        finally:
+            self.lock.acquire()
+
+
+class RobotGroup(object):
+    """
+    The robots of one simulator, the first hosting the copies of its scene that the others live
+    in. Each is stepped by a thread of its own up to the shared trigger.
+    """
+    def __init__(self, env_fns):
+        num_robots = len(env_fns)
+        host = env_fns[0](robot=(None, 0, num_robots))
+        self.envs = [host] + [env_fn(robot=(host.unwrapped, i, num_robots))
+                              for i, env_fn in enumerate(env_fns[1:], 1)]
+        self.step_barrier = StepBarrier(host.unwrapped.cid, num_robots)
+        for env in self.envs:
+            env.unwrapped.step_barrier = self.step_barrier
+        self.threads = ThreadPoolExecutor(num_robots)
+
+    def step_env(self, env, action):
+        try:
+            with self.step_barrier.lock:
+                ob, reward, done, info = env.step(action)
+                if done:
+                    ob = env.reset()
+        except Exception:
+            # Rather than leave the others waiting for it at the trigger
+            self.step_barrier.barrier.abort()
+            raise
+        return ob, reward, done, info
+
+    def step(self, actions):
+        obs, rews, dones, infos = zip(*self.threads.map(self.step_env, self.envs, actions))
+        return np.stack(obs), np.stack(rews), np.stack(dones), list(infos)
+
+    def reset(self):
+        return np.stack([env.reset() for env in self.envs])
+
+    # The host last, as closing it shuts the simulator down
+    def close(self):
+        self.threads.shutdown()
+        for env in reversed(self.envs):
+            close_env(env)
+
+
+def worker(remote, parent_remote, env_fns_wrapper):
+    parent_remote.close()
+    group = RobotGroup(env_fns_wrapper.x)
+    index, obs, rews, dones = None, None, None, None
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                obs.array[index], rews.array[index], dones.array[index], infos = group.step(data)
+                remote.send(infos)
+            elif cmd == 'reset':
+                obs.array[index] = group.reset()
+                remote.send(None)
+            elif cmd == 'attach':
+                index, obs, rews, dones = data
+            elif cmd == 'get_spaces':
+                remote.send((group.envs[0].observation_space, group.envs[0].action_space))
+            elif cmd == 'close':
+                group.close()
+                remote.close()
+                break
+            else:
+                raise NotImplementedError
+    except KeyboardInterrupt:
+        print('MultiRobotVecEnv worker: got KeyboardInterrupt')
+        group.close()
+    finally:
+        for buffer in (obs, rews, dones):
+            if buffer is not None:
+                buffer.close()
+
+
+class MultiRobotVecEnv(VecEnv):
+    """
+    Simulates robots_per_sim environments in every V-Rep instance, each in its own copy of the
+    scene, set apart far enough not to interact (see scenes/multi_robot.lua). Every instance runs
+    in a worker process, which steps its robots together with one synchronous trigger. Results
+    are passed back through shared memory, as by SharedMemoryVecEnv.
+
+    Rendering isn't supported, as the copies would be in each other's images.
+    """
+    def __init__(self, env_fns, robots_per_sim):
+        self.closed = False
+        nenvs = len(env_fns)
+        assert nenvs % robots_per_sim == 0, "Each simulator needs the same number of robots"
+        self.slices = [slice(i, i + robots_per_sim) for i in range(0, nenvs, robots_per_sim)]
+        resource_tracker.ensure_running()
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in self.slices])
+        self.ps = [Process(target=worker,
+                           args=(work_remote, remote, CloudpickleWrapper(env_fns[envs])))
+                   for (work_remote, remote, envs) in
+                   zip(self.work_remotes, self.remotes, self.slices)]
+        for p in self.ps:
+            p.daemon = True  # if the main process crashes, we should not cause things to hang
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, nenvs, observation_space, action_space)
+        self.waiting = False
+
+        self.obs = SharedArray((nenvs, *observation_space.shape), observation_space.dtype)
+        self.rews = SharedArray((nenvs,), np.float32)
+        self.dones = SharedArray((nenvs,), np.bool_)
+        for remote, envs in zip(self.remotes, self.slices):
+            remote.send(('attach', (envs, self.obs, self.rews, self.dones)))
+
+    def step_async(self, actions):
+        for remote, envs in zip(self.remotes, self.slices):
+            remote.send(('step', actions[envs]))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = [info for remote in self.remotes for info in remote.recv()]
+        self.waiting = False
+        return self.obs.array, self.rews.array, self.dones.array, infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs.array
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+        for buffer in (self.obs, self.rews, self.dones):
+            buffer.close(unlink=True)
+        self.closed = True
@@ -0,0 +1,47 @@
+import numpy as np
+from baselines.common.vec_env import VecEnvWrapper
+
+
+class PipelinedVecEnv(VecEnvWrapper):
+    """
+    Steps the environments with one step of action latency, so that the simulators run while the
+    policy is choosing the next action instead of waiting for it. step_async(actions) collects
+    the results of the step in flight, sends the new actions and returns, and step_wait hands
+    back those collected results. The policy therefore acts on the observation from before its
+    previous action took effect, and each reward is for the previous action.
+
+    The first step after a reset has nothing in flight, so it returns the reset observation with
+    no reward. An action chosen while an episode ends is applied as the first of the next one.
+    """
+    def __init__(self, venv):
+        super(PipelinedVecEnv, self).__init__(venv)
+        self.in_flight = False
+        self.results = None
+
+    # The wrapped environments may return buffers that the next step overwrites
+    def finish_step(self):
+        obs, rews, dones, infos = self.venv.step_wait()
+        self.in_flight = False
+        return np.array(obs), np.array(rews), np.array(dones), infos
+
+    def step_async(self, actions):
+        if self.in_flight:
+            self.results = self.finish_step()
+        self.venv.step_async(actions)
+        self.in_flight = True
+
+    def step_wait(self):
+        return self.results
+
+    def reset(self):
+        if self.in_flight:
+            self.finish_step()
+        obs = self.venv.reset()
+        self.results = (np.array(obs), np.zeros(self.num_envs, dtype=np.float32),
+                        np.zeros(self.num_envs, dtype=bool), [{} for _ in range(self.num_envs)])
+        return obs
+
+    def close(self):
+        if self.in_flight:
+            self.finish_step()
+        self.venv.close()
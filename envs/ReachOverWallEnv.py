@@ -5,8 +5,6 @@ from gym import spaces
 import vrep
 from envs.GoalDrivenEnv import GoalDrivenEnv
 
-from envs.VrepEnv import check_for_errors, catch_errors
-
 dir_path = os.getcwd()
 
 cube_lower = np.array([0.15, (-0.35), 0.025])
@@ -21,35 +19,30 @@ class ReachOverWallEnv(GoalDrivenEnv):
     observation_space = spaces.Box(np.array([0] * 11), np.array([1] * 11), dtype=np.float32)
 
     def __init__(self, *args):
+        self.ep_len = 100
         super().__init__(*args)
 
-        self.ep_len = 100
+    def setup_scene(self):
+        super().setup_scene()
 
-        return_code, self.sphere_handle = vrep.simxGetObjectHandle(self.cid,
-                "Sphere", vrep.simx_opmode_blocking)
-        check_for_errors(return_code)
-        return_code, self.wall_handle = vrep.simxGetObjectHandle(self.cid,
-                "Wall", vrep.simx_opmode_blocking)
-        check_for_errors(return_code)
-        self.wall_pos = vrep.simxGetObjectPosition(self.cid, self.wall_handle,
-                                                   -1, vrep.simx_opmode_blocking)[1]
-        self.init_wall_rot = vrep.simxGetObjectOrientation(self.cid,
-                self.wall_handle, -1, vrep.simx_opmode_blocking)[1]
+        self.sphere_handle = self.get_handle("Sphere")
+        self.wall_handle = self.get_handle("Wall")
+        self.wall_pos = self.get_initial_position(self.wall_handle)
+        self.init_wall_rot = self.get_initial_orientation(self.wall_handle)
         self.wall_orientation = self.init_wall_rot
-        self.mv_trg_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "MvTarget",
-                                                                  vrep.simx_opmode_blocking))
+        self.mv_trg_handle = self.get_handle("MvTarget")
 
     def reset(self):
         super(ReachOverWallEnv, self).reset()
         self.target_pos[0] = self.np_random.uniform(cube_lower[0], cube_upper[0])
         self.target_pos[1] = self.np_random.uniform(cube_lower[1], cube_upper[1])
-        vrep.simxSetObjectPosition(self.cid, self.sphere_handle, -1, self.target_pos,
+        vrep.simxSetObjectPosition(self.cid, self.sphere_handle, self.origin, self.target_pos,
                                    vrep.simx_opmode_blocking)
-        vrep.simxSetObjectPosition(self.cid, self.wall_handle, -1, self.wall_pos,
+        vrep.simxSetObjectPosition(self.cid, self.wall_handle, self.origin, self.wall_pos,
                                   vrep.simx_opmode_blocking)
-        vrep.simxSetObjectOrientation(self.cid, self.wall_handle, -1, self.init_wall_rot,
+        vrep.simxSetObjectOrientation(self.cid, self.wall_handle, self.origin, self.init_wall_rot,
                                      vrep.simx_opmode_blocking)
-        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, -1, [0., 0., 0.],
+        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, self.origin, [0., 0., 0.],
                                       vrep.simx_opmode_blocking)
 
         return self._get_obs()
@@ -73,7 +66,7 @@ class ReachOverWallEnv(GoalDrivenEnv):
 class ROWSparseEnv(ReachOverWallEnv):
 
     def step(self, a):
-        displacement = np.abs(self.get_vector(self.target_handle, self.subject_handle))
+        displacement = np.abs(self.get_subject_vector())
 
         rew_success = 0.1 if np.all(displacement <= max_displacement) else 0
         rew = rew_success
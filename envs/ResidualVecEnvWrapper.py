@@ -40,12 +40,24 @@ class ResidualVecEnvWrapper(VecEnvWrapper):
     def step_wait(self):
         obs, rew, done, info = self.venv.step_wait()
 
-        self.curr_obs = obs
+        self.curr_obs = np.array(obs)
         return obs, rew, done, info
 
     def step_async(self, action):
+        self.venv.step_async(self.add_initial_action(self.curr_obs, action))
+
+    def step_wait_ready(self):
+        env_ids, obs, rew, done, info = self.venv.step_wait_ready()
+
+        self.curr_obs[env_ids] = obs
+        return env_ids, obs, rew, done, info
+
+    def step_async_envs(self, env_ids, action):
+        self.venv.step_async_envs(env_ids, self.add_initial_action(self.curr_obs[env_ids], action))
+
+    def add_initial_action(self, obs, action):
         with torch.no_grad():
-            _, ip_action, _, _ = self.ip.act(self.normalize_obs(self.curr_obs), None, None,
+            _, ip_action, _, _ = self.ip.act(self.normalize_obs(obs), None, None,
                                              deterministic=True)
         if self.ob_rms:
             ip_action = ip_action.squeeze(1).cpu().numpy()
@@ -56,10 +68,9 @@ class ResidualVecEnvWrapper(VecEnvWrapper):
             pos *= self.action_space.high[0]
         pos /= 0.05
 
-        whole_action = ip_action + action
-        self.venv.step_async(whole_action)
+        return ip_action + action
 
     def reset(self):
         obs = self.venv.reset()
-        self.curr_obs = obs
+        self.curr_obs = np.array(obs)
         return obs
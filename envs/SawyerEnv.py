@@ -17,23 +17,26 @@ class SawyerEnv(VrepEnv):
     identity = scale * np.identity(num_joints)
 
     def __init__(self, *args, random_joints=True):
-        super().__init__(*args)
-
         self.random_joints = random_joints
         self.np_random = np.random.RandomState()
 
+        super().__init__(*args)
+
+    def setup_scene(self):
+        super().setup_scene()
+
         # Get the initial configuration of the robot (needed to later reset the robot's pose)
         self.init_config_tree, _, _, _ = self.call_lua_function('get_configuration_tree')
         _, self.init_joint_angles, _, _ = self.call_lua_function('get_joint_angles')
 
         self.joint_handles = np.array([None] * self.num_joints)
         for i in range(self.num_joints):
-            handle = catch_errors(vrep.simxGetObjectHandle(self.cid, 'Sawyer_joint' + str(i + 1),
-                                                           vrep.simx_opmode_blocking))
-            self.joint_handles[i] = handle
+            self.joint_handles[i] = self.get_handle('Sawyer_joint' + str(i + 1))
 
-        # Start the simulation (the "Play" button in V-Rep should now be in a "Pressed" state)
-        catch_errors(vrep.simxStartSimulation(self.cid, vrep.simx_opmode_blocking))
+        # Start the simulation (the "Play" button in V-Rep should now be in a "Pressed" state).
+        # Robots sharing the scene of another join its simulation.
+        if self.robot == 0:
+            catch_errors(vrep.simxStartSimulation(self.cid, vrep.simx_opmode_blocking))
 
     def seed(self, seed=None):
         self.np_random.seed(seed)
@@ -45,9 +48,21 @@ class SawyerEnv(VrepEnv):
             initial_pose = self.init_joint_angles
         self.call_lua_function('set_joint_angles', ints=self.init_config_tree, floats=initial_pose)
         self.curr_action = np.array([0.] * 6)
+        self.streams_fresh = False
+
+    def stream_joints(self):
+        for handle in self.joint_handles:
+            self.stream(vrep.simxGetJointPosition, int(handle))
 
+    # Until a step refreshes the streams (e.g. just after reset), one Lua call reads all the
+    # joints rather than a blocking read each
     def _get_obs(self):
-        _, joint_angles, _, _ = self.call_lua_function('get_joint_angles')
+        if self.streams_fresh and \
+                (vrep.simxGetJointPosition, (int(self.joint_handles[0]),)) in self.streams:
+            joint_angles = [self.read_stream(vrep.simxGetJointPosition, int(handle))
+                            for handle in self.joint_handles]
+        else:
+            _, joint_angles, _, _ = self.call_lua_function('get_joint_angles')
         assert len(joint_angles) == self.num_joints
 
         return joint_angles
@@ -56,5 +71,4 @@ class SawyerEnv(VrepEnv):
         for handle, velocity in zip(self.joint_handles, self.curr_action):
             catch_errors(vrep.simxSetJointTargetVelocity(self.cid,
                                                          int(handle), velocity, vrep.simx_opmode_oneshot))
-        vrep.simxSynchronousTrigger(self.cid)
-        vrep.simxGetPingTime(self.cid)
+        self.step_simulation()
@@ -0,0 +1,185 @@
+from multiprocessing import Pipe, Process, resource_tracker, shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+from baselines.common.vec_env import VecEnv, CloudpickleWrapper
+
+from envs.SimulatorPoolVecEnv import close_env
+
+
+class SharedArray(object):
+    """
+    A NumPy array in shared memory. Sending it to another process attaches to the same memory
+    there rather than copying the contents.
+    """
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.memory.buf)
+
+    def __getstate__(self):
+        return self.shape, self.dtype, self.memory.name
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    # The creator also frees the memory once everyone is done with it
+    def close(self, unlink=False):
+        self.array = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def worker(remote, parent_remote, env_fn_wrapper):
+    parent_remote.close()
+    env = env_fn_wrapper.x()
+    index, obs, rews, dones, images = None, None, None, None, None
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                ob, reward, done, info = env.step(data)
+                if done:
+                    ob = env.reset()
+                obs.array[index] = ob
+                rews.array[index] = reward
+                dones.array[index] = done
+                remote.send(info)
+            elif cmd == 'reset':
+                obs.array[index] = env.reset()
+                remote.send(None)
+            elif cmd == 'render':
+                if data == 'rgb_array' and images is not None:
+                    images.array[index] = env.render(mode=data)
+                    remote.send(None)
+                else:
+                    remote.send(env.render(mode=data))
+            elif cmd == 'attach':
+                index, obs, rews, dones = data
+            elif cmd == 'attach_images':
+                images = data
+            elif cmd == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == 'close':
+                close_env(env)
+                remote.close()
+                break
+            else:
+                raise NotImplementedError
+    except KeyboardInterrupt:
+        print('SharedMemoryVecEnv worker: got KeyboardInterrupt')
+        close_env(env)
+    finally:
+        for buffer in (obs, rews, dones, images):
+            if buffer is not None:
+                buffer.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    A SubprocVecEnv whose workers write observations, rewards, dones and rgb_array images
+    straight into their slot of arrays in shared memory, so that only actions, infos and other
+    small messages are pickled through the pipes.
+
+    The arrays returned by step_wait, reset and get_images are those shared buffers, and are
+    overwritten by the next call. Observations are kept in the observation space's dtype and
+    rewards as float32, so VecPyTorch wraps them without a copy.
+
+    Environments can also be stepped asynchronously, through step_async_envs and
+    step_wait_ready, so that slow simulators don't hold up the others. step_wait_ready returns as
+    soon as ready_envs of the stepping environments have finished.
+    """
+    def __init__(self, env_fns, ready_envs=None):
+        self.closed = False
+        nenvs = len(env_fns)
+        # Workers inherit the tracker of shared memory, rather than starting their own that would
+        # free the buffers when they exit
+        resource_tracker.ensure_running()
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
+        self.ps = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
+                   for (work_remote, remote, env_fn) in
+                   zip(self.work_remotes, self.remotes, env_fns)]
+        for p in self.ps:
+            p.daemon = True  # if the main process crashes, we should not cause things to hang
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, nenvs, observation_space, action_space)
+        self.ready_envs = ready_envs or nenvs
+        # Environments that have been sent an action and not yet returned the result
+        self.stepping = np.zeros(nenvs, dtype=bool)
+
+        self.obs = SharedArray((nenvs, *observation_space.shape), observation_space.dtype)
+        self.rews = SharedArray((nenvs,), np.float32)
+        self.dones = SharedArray((nenvs,), np.bool_)
+        # Allocated once the resolution is known, when vision is activated (see get_images)
+        self.images = None
+        for i, remote in enumerate(self.remotes):
+            remote.send(('attach', (i, self.obs, self.rews, self.dones)))
+
+    def step_async(self, actions):
+        self.step_async_envs(range(self.num_envs), actions)
+
+    def step_wait(self):
+        infos = [remote.recv() for remote in self.remotes]
+        self.stepping[:] = False
+        return self.obs.array, self.rews.array, self.dones.array, infos
+
+    def step_async_envs(self, env_ids, actions):
+        for i, action in zip(env_ids, actions):
+            self.remotes[i].send(('step', action))
+            self.stepping[i] = True
+
+    # Waits for ready_envs of the stepping environments (or all of them, if fewer are stepping),
+    # then returns the ids of those that have finished by then with their results.
+    def step_wait_ready(self):
+        remaining = {self.remotes[i]: i for i in np.flatnonzero(self.stepping)}
+        num_ready = min(self.ready_envs, len(remaining))
+        ready = []
+        while len(ready) < num_ready:
+            ready += [remaining.pop(remote) for remote in wait(list(remaining))]
+        ready += [remaining.pop(remote) for remote in wait(list(remaining), timeout=0)]
+        env_ids = np.sort(np.array(ready, dtype=int))
+        infos = [self.remotes[i].recv() for i in env_ids]
+        self.stepping[env_ids] = False
+        return env_ids, self.obs.array[env_ids], self.rews.array[env_ids], \
+            self.dones.array[env_ids], infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.obs.array
+
+    def get_images(self, mode='rgb_array'):
+        for pipe in self.remotes:
+            pipe.send(('render', mode))
+        results = [pipe.recv() for pipe in self.remotes]
+        if mode == 'activate' and self.images is None:
+            self.images = SharedArray((self.num_envs, *results[0], 3), np.uint8)
+            for pipe in self.remotes:
+                pipe.send(('attach_images', self.images))
+        if mode == 'rgb_array' and self.images is not None:
+            return self.images.array
+        return results
+
+    def close(self):
+        if self.closed:
+            return
+        for i in np.flatnonzero(self.stepping):
+            self.remotes[i].recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+        for buffer in (self.obs, self.rews, self.dones, self.images):
+            if buffer is not None:
+                buffer.close(unlink=True)
+        self.closed = True
@@ -1,8 +1,10 @@
+import os
+
 import numpy as np
 from gym import spaces
 import vrep
 from envs.GoalDrivenEnv import GoalDrivenEnv
-from envs.VrepEnv import catch_errors
+from envs.VrepEnv import catch_errors, scene_dir_path
 import math
 
 start_lower = np.array([0.87, 0.12, 0.52])  # x, y
@@ -12,6 +14,18 @@ trg_pos = np.array([0.9, 0.15])
 max_displacement = 0.025  # 1.5cm
 max_rot = 0.1  # ~5.7 deg
 
+# Start positions with joint poses that IK found to hold the mug there, level. Built by
+# gather_start_poses.py; without it every reset searches for a pose itself.
+start_poses_path = os.path.join(scene_dir_path, 'shelf_start_poses.npz')
+
+
+# Returns (start positions (N, 3), joint poses (N, 7)), or None if there is no table
+def load_start_poses(path=start_poses_path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as table:
+        return table['positions'], table['poses']
+
 
 class ShelfStackEnv(GoalDrivenEnv):
     observation_space = spaces.Box(np.array([-3.] * 7 + [-math.inf] * 3),
@@ -19,36 +33,35 @@ class ShelfStackEnv(GoalDrivenEnv):
                                    dtype=np.float32)
 
     def __init__(self, *args):
-        super().__init__(*args, random_joints=False)
         self.ep_len = 64
-        self.mv_trg_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "MvTarget",
-                                                                   vrep.simx_opmode_blocking))
-        self.anchor_handle = catch_errors(vrep.simxGetObjectHandle(self.cid, "Anchor",
-                                                                   vrep.simx_opmode_blocking))
-        self.start_rot = catch_errors(vrep.simxGetObjectOrientation(self.cid, self.mv_trg_handle, -1,
-                                                                    vrep.simx_opmode_blocking))
-        self.target_pos = self.get_position(self.target_handle)
+        super().__init__(*args, random_joints=False)
+
+    def setup_scene(self):
+        super().setup_scene()
+        self.mv_trg_handle = self.get_handle("MvTarget")
+        self.anchor_handle = self.get_handle("Anchor")
+        self.start_rot = self.get_initial_orientation(self.mv_trg_handle)
+        self.target_pos = np.array(self.get_initial_position(self.target_handle))
         self.target_pos[0] = trg_pos[0]
         self.target_pos[1] = trg_pos[1]
-        vrep.simxSetObjectPosition(self.cid, self.target_handle, -1, self.target_pos,
+        vrep.simxSetObjectPosition(self.cid, self.target_handle, self.origin, self.target_pos,
                                    vrep.simx_opmode_blocking)
+        self.start_poses = load_start_poses()
 
     def get_mug_orientation(self):
         orientation = catch_errors(vrep.simxGetObjectOrientation(
             self.cid, self.subject_handle, self.target_handle, vrep.simx_opmode_blocking))
         return np.array(orientation[:-1])
 
-    def reset(self):
-        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, -1, self.start_rot,
+    # Tries random start positions until IK finds a joint pose that holds the mug there, level.
+    # Returns the position and pose, leaving the arm in it.
+    def solve_start_pose(self):
+        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, self.origin, self.start_rot,
                                       vrep.simx_opmode_blocking)
-        success = False
-        while not success:
+        while True:
             super(ShelfStackEnv, self).reset()
-            start_pos = [0, 0, 0]
-            start_pos[0] = self.np_random.uniform(start_lower[0], start_upper[0])
-            start_pos[1] = self.np_random.uniform(start_lower[1], start_upper[1])
-            start_pos[2] = self.np_random.uniform(start_lower[2], start_upper[2])
-            vrep.simxSetObjectPosition(self.cid, self.mv_trg_handle, -1, start_pos,
+            start_pos = self.np_random.uniform(start_lower, start_upper)
+            vrep.simxSetObjectPosition(self.cid, self.mv_trg_handle, self.origin, start_pos,
                                        vrep.simx_opmode_blocking)
             _, pose, _, _ = self.call_lua_function('solve_ik')
             for handle, pos in zip(self.joint_handles, pose):
@@ -56,9 +69,32 @@ class ShelfStackEnv(GoalDrivenEnv):
             displacement = np.abs(self.get_vector(self.mv_trg_handle, self.subject_handle))
             orientation_diff = np.abs(self.get_mug_orientation())
 
-            success = np.all(orientation_diff <= max_rot) and np.all(displacement <= 0.01)
+            if np.all(orientation_diff <= max_rot) and np.all(displacement <= 0.01):
+                return start_pos, pose
+
+    # The tabled start nearest to a random position, with its pose set in the same message as
+    # the IK target and anchor rather than searched for.
+    def reset(self):
+        if self.start_poses is None:
+            self.solve_start_pose()
+            vrep.simxSetObjectPosition(self.cid, self.anchor_handle, self.mv_trg_handle,
+                                       [0., 0., 0.], vrep.simx_opmode_blocking)
+            return self._get_obs()
+
+        super(ShelfStackEnv, self).reset()
+        positions, poses = self.start_poses
+        i = np.argmin(np.square(positions - self.np_random.uniform(start_lower, start_upper))
+                      .sum(axis=1))
+        vrep.simxPauseCommunication(self.cid, True)
+        self.call_lua_function('set_joint_angles', ints=self.init_config_tree, floats=poses[i],
+                               opmode=vrep.simx_opmode_oneshot)
+        vrep.simxSetObjectOrientation(self.cid, self.mv_trg_handle, self.origin, self.start_rot,
+                                      vrep.simx_opmode_oneshot)
+        vrep.simxSetObjectPosition(self.cid, self.mv_trg_handle, self.origin, positions[i],
+                                   vrep.simx_opmode_oneshot)
         vrep.simxSetObjectPosition(self.cid, self.anchor_handle, self.mv_trg_handle, [0., 0., 0.],
-                                   vrep.simx_opmode_blocking)
+                                   vrep.simx_opmode_oneshot)
+        vrep.simxPauseCommunication(self.cid, False)
         return self._get_obs()
 
 
@@ -66,8 +102,8 @@ class SSSparseEnv(ShelfStackEnv):
 
     def step(self, a):
         self.curr_action = a
-        displacement = np.abs(self.get_vector(self.target_handle, self.subject_handle))
-        orientation_diff = np.abs(self.get_mug_orientation())
+        displacement = np.abs(self.get_subject_vector())
+        orientation_diff = np.abs(self.get_subject_orientation()[:-1])
 
         rew_success = 0.1 if np.all(orientation_diff <= max_rot) and \
                              np.all(displacement <= max_displacement) else 0
@@ -86,8 +122,8 @@ class SSDenseEnv(ShelfStackEnv):
 
     def step(self, a):
         self.curr_action = a
-        dist = self.get_distance(self.target_handle, self.subject_handle)
-        orientation_diff = np.abs(self.get_mug_orientation()).sum()
+        dist = np.linalg.norm(self.get_subject_vector())
+        orientation_diff = np.abs(self.get_subject_orientation()[:-1]).sum()
 
         self.timestep += 1
         self.update_sim()
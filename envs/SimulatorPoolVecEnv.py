@@ -0,0 +1,250 @@
+import os
+import signal
+import time
+from multiprocessing import Pipe, Process
+
+import numpy as np
+from baselines.common.vec_env import VecEnv, CloudpickleWrapper
+
+
+# bench.Monitor doesn't pass close on to the environment it wraps, which would leave the
+# simulator running
+def close_env(env):
+    env.close()
+    env.unwrapped.close()
+
+
+def worker(remote, parent_remote, env_fn_wrapper):
+    parent_remote.close()
+    env = env_fn_wrapper.x()
+    # Lets the parent kill the simulator if this process hangs (see SimulatorPoolVecEnv.restart)
+    process = getattr(env.unwrapped, 'process', None)
+    remote.send(process.pid if process is not None else None)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                ob, reward, done, info = env.step(data)
+                if done:
+                    ob = env.reset()
+                remote.send((ob, reward, done, info))
+            elif cmd == 'reset':
+                remote.send(env.reset())
+            elif cmd == 'render':
+                remote.send(env.render(mode=data))
+            elif cmd == 'seed':
+                env.seed(data)
+            elif cmd == 'load_scene':
+                # The thunk loads its scene into the existing simulator and re-applies the
+                # wrappers. The old wrappers (and their monitor files) are simply dropped.
+                env = data.x(env.unwrapped)
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == 'close':
+                close_env(env)
+                remote.close()
+                break
+            else:
+                raise NotImplementedError
+    except KeyboardInterrupt:
+        print('SimulatorPoolVecEnv worker: got KeyboardInterrupt')
+        close_env(env)
+    except Exception:
+        # e.g. a remote API timeout. Don't leave the simulator running, the parent restarts us.
+        close_env(env)
+        raise
+
+
+class SimulatorPoolVecEnv(VecEnv):
+    """
+    A SubprocVecEnv whose workers outlive a single curriculum stage. Rather than closing every
+    simulator and launching new ones for the next scene, load_scene swaps the scene inside each
+    running simulator. Environment thunks (see envs.make_env) must accept an existing base
+    environment to load their scene into.
+
+    Workers are also supervised. One that dies, or takes longer than step_timeout seconds to
+    step, is killed along with its simulator and relaunched while the others keep stepping.
+    Until the replacement has joined the others at an episode boundary, its slot repeats its last
+    observation with done set and a 'bad_transition' info, so that it is masked out of the
+    rollout (see RolloutStorage.bad_masks).
+    """
+    def __init__(self, env_fns, env_name=None, step_timeout=None):
+        self.env_name = env_name
+        self.step_timeout = step_timeout
+        self.env_fns = env_fns
+        self.waiting = False
+        self.closed = False
+        nenvs = len(env_fns)
+        self.remotes = [None] * nenvs
+        self.ps = [None] * nenvs
+        self.sim_pids = [None] * nenvs
+        # Workers being relaunched, and those that have relaunched and wait for an episode end
+        self.restarting = [False] * nenvs
+        self.parked = [False] * nenvs
+        self.last_obs = [None] * nenvs
+        self.np_random = np.random.RandomState()
+        self.step_start = None
+        # Most recent time each worker took to step, for spotting slow simulators
+        self.latencies = np.zeros(nenvs)
+        for i in range(nenvs):
+            self.start_worker(i)
+        for i in range(nenvs):
+            self.sim_pids[i] = self.remotes[i].recv()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+
+    def start_worker(self, i):
+        remote, work_remote = Pipe()
+        p = Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(self.env_fns[i])))
+        p.daemon = True  # if the main process crashes, we should not cause things to hang
+        p.start()
+        work_remote.close()
+        self.remotes[i] = remote
+        self.ps[i] = p
+
+    def restart(self, i):
+        print(f"Simulator {i} crashed or stopped responding. Restarting...")
+        self.ps[i].kill()
+        self.ps[i].join()
+        if self.sim_pids[i] is not None:
+            try:
+                os.killpg(os.getpgid(self.sim_pids[i]), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.remotes[i].close()
+        self.start_worker(i)
+        self.restarting[i] = True
+
+    # Returns the worker's reply, or None if it died or missed the deadline.
+    def recv(self, i, deadline=None):
+        remote = self.remotes[i]
+        timeout = None if deadline is None else max(0., deadline - time.time())
+        try:
+            if not remote.poll(timeout):
+                return None
+            return remote.recv()
+        except (EOFError, OSError):
+            return None
+
+    # A relaunched worker is ready once it has sent its simulator's pid. It is re-seeded so as not
+    # to replay the episodes its predecessor already went through.
+    def finish_restart(self, i):
+        self.sim_pids[i] = self.recv(i)
+        self.remotes[i].send(('seed', int(self.np_random.randint(2 ** 31))))
+        self.restarting[i] = False
+        self.parked[i] = True
+
+    def poll_restarted(self, i):
+        if self.remotes[i].poll():
+            self.finish_restart(i)
+
+    def load_scene(self, env_fns):
+        assert len(env_fns) == self.num_envs
+        self.env_fns = env_fns
+        for i in range(self.num_envs):
+            if self.restarting[i]:
+                # Not worth waiting for, relaunch straight into the new scene
+                self.restart(i)
+            else:
+                self.remotes[i].send(('load_scene', CloudpickleWrapper(env_fns[i])))
+        spaces = None
+        for i in range(self.num_envs):
+            if not self.restarting[i]:
+                spaces = self.recv(i)
+        self.observation_space, self.action_space = spaces
+
+    def step_async(self, actions):
+        self.step_start = time.time()
+        for i, (remote, action) in enumerate(zip(self.remotes, actions)):
+            if self.restarting[i] or self.parked[i]:
+                continue
+            try:
+                remote.send(('step', action))
+            except (BrokenPipeError, OSError):
+                self.restart(i)
+        self.waiting = True
+
+    def step_wait(self):
+        deadline = None if self.step_timeout is None else self.step_start + self.step_timeout
+        results = [None] * self.num_envs
+        for i in range(self.num_envs):
+            if self.restarting[i] or self.parked[i]:
+                continue
+            results[i] = self.recv(i, deadline)
+            self.latencies[i] = time.time() - self.step_start
+            if results[i] is None:
+                self.restart(i)
+        self.waiting = False
+
+        # Relaunched workers rejoin when every stepping worker has finished its episode
+        episode_end = all(results[i][2] for i in range(self.num_envs) if results[i] is not None)
+        for i in range(self.num_envs):
+            if self.restarting[i]:
+                self.poll_restarted(i)
+            if results[i] is not None:
+                continue
+            if self.parked[i] and episode_end:
+                self.remotes[i].send(('reset', None))
+                ob = self.recv(i)
+                if ob is None:
+                    self.restart(i)
+                else:
+                    self.parked[i] = False
+                    self.last_obs[i] = ob
+            results[i] = (self.last_obs[i], 0., True, {'bad_transition': True})
+
+        obs, rews, dones, infos = zip(*results)
+        self.last_obs = list(obs)
+        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+
+    def reset(self):
+        for i in range(self.num_envs):
+            if self.restarting[i]:
+                self.finish_restart(i)
+            self.parked[i] = False
+            self.remotes[i].send(('reset', None))
+        self.last_obs = [self.recv(i) for i in range(self.num_envs)]
+        for i in range(self.num_envs):
+            while self.last_obs[i] is None:
+                self.restart(i)
+                self.finish_restart(i)
+                self.parked[i] = False
+                self.remotes[i].send(('reset', None))
+                self.last_obs[i] = self.recv(i)
+        return np.stack(self.last_obs)
+
+    def get_images(self, mode='rgb_array'):
+        for i in range(self.num_envs):
+            if self.restarting[i]:
+                self.finish_restart(i)
+        for pipe in self.remotes:
+            pipe.send(('render', mode))
+        return [pipe.recv() for pipe in self.remotes]
+
+    def close(self):
+        if self.closed:
+            return
+        for i in range(self.num_envs):
+            if self.waiting and not (self.restarting[i] or self.parked[i]):
+                self.recv(i)
+            if self.restarting[i]:
+                self.recv(i)
+            try:
+                self.remotes[i].send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self.ps:
+            p.join()
+        self.closed = True
+
+
+def get_sim_pool(venv):
+    if isinstance(venv, SimulatorPoolVecEnv):
+        return venv
+    elif hasattr(venv, 'venv'):
+        return get_sim_pool(venv.venv)
+
+    return None
@@ -1,7 +1,9 @@
 import atexit
+import json
 import os
 import platform
 import signal
+import socket
 import time
 
 import numpy as np
@@ -58,6 +60,56 @@ vrep_path = os.path.expanduser('~/Applications/V-REP_PRO_EDU_V3_6_1_Mac/vrep.app
 # See forum.coppeliarobotics.com/viewtopic.php?p=29772
 xvfb_args = ['xvfb-run', '--auto-servernum', '--server-num=1'] \
     if not platform.system() == 'Darwin' else []
+# Curriculum stages that are their task's scene with some obstacle parts made non-respondable.
+# Generated from the stage scenes by gather_respondability.py; stages listed here are set up by
+# changing those flags in the already loaded task scene rather than loading another scene file.
+respondability_path = os.path.join(scene_dir_path, 'respondability.json')
+# Set by VrepEnv.start_shared_display and inherited by the worker processes. When present every
+# V-Rep instance on this machine renders to the same Xvfb server instead of starting its own.
+shared_display_var = 'VREP_SHARED_DISPLAY'
+# Seconds to wait for a freshly launched V-Rep to accept connections before relaunching it
+launch_timeout = 30
+poll_interval = 0.1
+# Metres between copies of a scene holding several robots, enough for them not to interact
+robot_spacing = 5.
+
+
+# Returns {stage: (task scene, {part name: respondable})}
+def load_respondability(path=respondability_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        spec = json.load(f)
+    stages = {}
+    for task, task_spec in spec.items():
+        for stage, non_respondable in task_spec['stages'].items():
+            stages[stage] = (task, {part: part not in non_respondable
+                                    for part in task_spec['parts']})
+        # The task itself has every part respondable, even after loading another stage into it
+        stages[task] = (task, {part: True for part in task_spec['parts']})
+    return stages
+
+
+def kill_process_group(process):
+    try:
+        pgrp = os.getpgid(process.pid)
+        os.killpg(pgrp, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    # Until it has gone, its port can't be taken by the simulator launched in its place
+    process.wait()
+
+
+# Returns once something is listening on the port, rather than sleeping for a fixed time.
+def wait_for_port(port_num, process, timeout=launch_timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            with socket.create_connection((host, port_num), timeout=poll_interval):
+                return True
+        except OSError:
+            time.sleep(poll_interval)
+    return False
 
 
 class VrepEnv(Env):
@@ -67,60 +119,252 @@ class VrepEnv(Env):
     set-up and tear-down of an associated V-Rep scene.
     """
 
-    def __init__(self, scene_name, rank, headless):
+    # Robots after the first of a scene (see MultiRobotVecEnv) are given the environment hosting
+    # them and share its simulator, which the host fills with num_robots copies of its scene.
+    def __init__(self, scene_name, rank, headless, host_env=None, robot=0, num_robots=1):
+        self.robot = robot
+        self.num_robots = num_robots
+        # V-Rep names copies of an object by adding #0, #1... to the original's name
+        self.suffix = '' if robot == 0 else f'#{robot - 1}'
+        # Frame task poses are given in, the world for the original scene
+        self.origin = -1
+        self.origin_position = np.zeros(3)
+        # Set by MultiRobotVecEnv, which triggers the simulation once all robots have acted
+        self.step_barrier = None
+        self.streams = set()
+        self.streams_fresh = False
+        if host_env is not None:
+            self.process = None
+            self.cid = host_env.cid
+            self.scene_name = host_env.scene_name
+            self.scene_file = host_env.scene_file
+            self.respondability = host_env.respondability
+            self.object_handles = host_env.object_handles
+            self.initial_poses = host_env.initial_poses
+            self.setup_scene()
+            return
+
         # Launch a V-Rep server
         # Read more here: http://www.coppeliarobotics.com/helpFiles/en/commandLine.htm
         port_num = base_port_num + rank
         remote_api_string = '-gREMOTEAPISERVERSERVICE_' + str(port_num) + '_FALSE_TRUE'
-        args = [*xvfb_args, vrep_path, '-h' if headless else '', remote_api_string]
+        display = os.environ.get(shared_display_var)
+        if getattr(vrep, 'is_standin', False):
+            # The stand-in (see vrep_standin) brings its own server, which needs no display
+            args = vrep.server_args(port_num)
+            env = None
+        elif display is None:
+            args = [*xvfb_args, vrep_path, '-h' if headless else '', remote_api_string]
+            env = None
+        else:
+            args = [vrep_path, '-h' if headless else '', remote_api_string]
+            env = dict(os.environ, DISPLAY=display)
         self.cid = -1
         while self.cid == -1:
-            self.process = Popen(args, preexec_fn=os.setsid, stdout=DEVNULL)
-            time.sleep(6)
-            self.cid = vrep.simxStart(host, port_num, True, True, 5000, 5)
+            self.process = Popen(args, preexec_fn=os.setsid, stdout=DEVNULL, env=env)
+            if wait_for_port(port_num, self.process):
+                self.cid = vrep.simxStart(host, port_num, True, True, 5000, 5)
             if self.cid == -1:
                 print(f"{rank} failed to connect to V-REP. Retrying...")
-                try:
-                    pgrp = os.getpgid(self.process.pid)
-                    os.killpg(pgrp, signal.SIGKILL)
-                except ProcessLookupError:
-                    pass
+                kill_process_group(self.process)
         catch_errors(vrep.simxSynchronous(self.cid, enable=True))
+        atexit.register(self.close)
+
+        self.scene_name = None
+        self.scene_file = None
+        self.respondability = load_respondability()
+        self.load_scene(scene_name)
+
+    # Replace the current scene, keeping the V-Rep process and connection. Everything that
+    # depends on the scene is set up again by setup_scene.
+    def load_scene(self, scene_name):
+        if self.scene_name is not None:
+            self.stop_simulation()
+        scene_file, respondable = self.respondability.get(scene_name, (scene_name, None))
+        new_file = scene_file != self.scene_file
+        if new_file:
+            self.load_scene_file(scene_file)
+        if respondable is not None:
+            self.set_respondable(respondable)
+        # Copied after the flags are set, so that the copies have them too
+        if new_file and self.num_robots > 1:
+            self.call_lua_function('replicate_scene', ints=[self.num_robots - 1],
+                                   floats=[robot_spacing])
+            self._load_scene_objects()
+        self.scene_name = scene_name
 
-        scene_path = os.path.join(scene_dir_path, f'{scene_name}.ttt')
+        # (getter, args) pairs streamed by V-Rep every step, readable without a round-trip
+        self.streams = set()
+        # Whether the buffered stream values reflect the scene since the last simulation step
+        self.streams_fresh = False
+
+        self.setup_scene()
+
+    def load_scene_file(self, scene_file):
+        if self.scene_file is not None:
+            catch_errors(vrep.simxCloseScene(self.cid, vrep.simx_opmode_blocking))
+        scene_path = os.path.join(scene_dir_path, f'{scene_file}.ttt')
         catch_errors(vrep.simxLoadScene(self.cid, scene_path, 0, vrep.simx_opmode_blocking))
-        atexit.register(self.close)
+        self.scene_file = scene_file
+        self._load_scene_objects()
+
+    # Stopping takes a few simulation passes, only return once it has actually happened.
+    def stop_simulation(self):
+        catch_errors(vrep.simxStopSimulation(self.cid, vrep.simx_opmode_blocking))
+        deadline = time.time() + launch_timeout
+        while time.time() < deadline:
+            vrep.simxGetPingTime(self.cid)
+            _, server_state = vrep.simxGetInMessageInfo(self.cid,
+                                                        vrep.simx_headeroffset_server_state)
+            if not server_state & 1:
+                return
+        raise RuntimeError('V-Rep did not stop the simulation')
 
-    # Function to call a Lua function in V-Rep
+    # Respondable shapes are collided with, non-respondable ones can be passed through.
+    # respondable maps object names to flags. The simulation must be stopped: V-Rep only picks up
+    # changes to dynamic properties when it (re)starts. All flags are sent in a single message.
+    def set_respondable(self, respondable):
+        flags = [(self.get_handle(name), int(flag)) for name, flag in respondable.items()]
+        vrep.simxPauseCommunication(self.cid, True)
+        for handle, flag in flags:
+            vrep.simxSetObjectIntParameter(self.cid, handle, vrep.sim_shapeintparam_respondable,
+                                           flag, vrep.simx_opmode_oneshot)
+        vrep.simxPauseCommunication(self.cid, False)
+        vrep.simxGetPingTime(self.cid)
+
+    def get_respondable(self, name):
+        return bool(catch_errors(vrep.simxGetObjectIntParameter(
+            self.cid, self.get_handle(name), vrep.sim_shapeintparam_respondable,
+            vrep.simx_opmode_blocking)))
+
+    # Overridden by children to look up handles and initial state in a freshly loaded scene.
+    def setup_scene(self):
+        if self.robot > 0:
+            self.origin = self.get_handle('RobotOrigin')
+            self.origin_position = np.array(self.initial_poses[self.origin][0])
+
+    # Start one Xvfb server for every V-Rep instance launched afterwards, including those in
+    # subprocesses. Call before the workers are forked; a no-op on macOS or if already running.
+    @staticmethod
+    def start_shared_display():
+        if platform.system() == 'Darwin' or shared_display_var in os.environ or \
+                getattr(vrep, 'is_standin', False):
+            return
+        display_num = 1
+        while os.path.exists(f'/tmp/.X{display_num}-lock'):
+            display_num += 1
+        process = Popen(['Xvfb', f':{display_num}', '-screen', '0', '1024x768x24',
+                         '-nolisten', 'tcp'], preexec_fn=os.setsid, stdout=DEVNULL,
+                        stderr=DEVNULL)
+        atexit.register(kill_process_group, process)
+        deadline = time.time() + launch_timeout
+        while not os.path.exists(f'/tmp/.X11-unix/X{display_num}'):
+            if time.time() > deadline or process.poll() is not None:
+                raise RuntimeError(f'Xvfb failed to start on display :{display_num}')
+            time.sleep(poll_interval)
+        os.environ[shared_display_var] = f':{display_num}'
+
+    # Resolve the name, handle and absolute pose of every object in the scene with two calls,
+    # instead of one blocking call per object as each environment is set up.
+    def _load_scene_objects(self):
+        handles, _, _, names = catch_errors(vrep.simxGetObjectGroupData(
+            self.cid, vrep.sim_appobj_object_type, 0, vrep.simx_opmode_blocking))
+        self.object_handles = dict(zip(names, handles))
+        # Data type 9 gives 6 floats per object: x, y, z, alpha, beta, gamma
+        _, _, poses, _ = catch_errors(vrep.simxGetObjectGroupData(
+            self.cid, vrep.sim_appobj_object_type, 9, vrep.simx_opmode_blocking))
+        self.initial_poses = {handle: (poses[6 * i:6 * i + 3], poses[6 * i + 3:6 * i + 6])
+                              for i, handle in enumerate(handles)}
+
+    def get_handle(self, name):
+        name += self.suffix
+        if name not in self.object_handles:
+            self.object_handles[name] = catch_errors(vrep.simxGetObjectHandle(
+                self.cid, name, vrep.simx_opmode_blocking))
+        return self.object_handles[name]
+
+    # Poses relative to the origin as they were when the scene was loaded. Copies, as callers
+    # tend to modify them. Scene copies are only ever translated.
+    def get_initial_position(self, handle):
+        if handle not in self.initial_poses:
+            return catch_errors(vrep.simxGetObjectPosition(self.cid, handle, self.origin,
+                                                           vrep.simx_opmode_blocking))
+        return list(np.subtract(self.initial_poses[handle][0], self.origin_position))
+
+    def get_initial_orientation(self, handle):
+        if handle not in self.initial_poses:
+            return catch_errors(vrep.simxGetObjectOrientation(self.cid, handle, self.origin,
+                                                              vrep.simx_opmode_blocking))
+        return list(self.initial_poses[handle][1])
+
+    # Function to call a Lua function in V-Rep, in the script of this robot's copy of the scene
     # Read more here: http://www.coppeliarobotics.com/helpFiles/en/remoteApiExtension.htm
     def call_lua_function(self, lua_function, ints=[], floats=[], strings=[],
                           bytes=bytearray(), opmode=vrep.simx_opmode_blocking):
         return_code, out_ints, out_floats, out_strings, out_buffer = vrep.simxCallScriptFunction(
-            self.cid, 'remote_api', vrep.sim_scripttype_customizationscript, lua_function, ints,
-            floats, strings, bytes, opmode)
+            self.cid, 'remote_api' + self.suffix, vrep.sim_scripttype_customizationscript,
+            lua_function, ints, floats, strings, bytes, opmode)
         check_for_errors(return_code)
         return out_ints, out_floats, out_strings, out_buffer
 
+    # Scenes saved before a function was added to their remote_api script will not expose it.
+    # Probe once so the caller can fall back to the older, chattier path.
+    def has_lua_function(self, lua_function, **kwargs):
+        try:
+            self.call_lua_function(lua_function, **kwargs)
+        except RuntimeError:
+            return False
+        return True
+
     def close(self):
+        if self.process is None:
+            return
         # Shutdown
         print("Closing VREP")
         vrep.simxStopSimulation(self.cid, vrep.simx_opmode_blocking)
         vrep.simxFinish(self.cid)
         atexit.unregister(self.close)
-        try:
-            pgrp = os.getpgid(self.process.pid)
-            os.killpg(pgrp, signal.SIGKILL)
-        except ProcessLookupError:
-            pass
+        kill_process_group(self.process)
+        self.process = None
 
     # Rendering not implemented by default. See DishRackEnv for a more specific implementation.
     def render(self, mode='human'):
         pass
 
+    # Ask V-Rep to send getter(cid, *args) after every simulation step. Later reads through
+    # read_stream come from the local buffer instead of blocking on the network.
+    # Read more here: http://www.coppeliarobotics.com/helpFiles/en/remoteApiModusOperandi.htm
+    def stream(self, getter, *args):
+        catch_errors(getter(self.cid, *args, vrep.simx_opmode_streaming))
+        self.streams.add((getter, args))
+
+    # Buffered values are only used once a step has completed since the scene was last changed
+    # by hand (e.g. on reset); otherwise, or if nothing has arrived yet, fall back to blocking.
+    def read_stream(self, getter, *args):
+        if self.streams_fresh and (getter, args) in self.streams:
+            return_code, value = getter(self.cid, *args, vrep.simx_opmode_buffer)
+            if return_code == vrep.simx_return_ok:
+                return value
+        return catch_errors(getter(self.cid, *args, vrep.simx_opmode_blocking))
+
+    # Start the next simulation step, or with several robots in the scene, wait for the others
+    # to act and start it together
+    def trigger(self):
+        if self.step_barrier is None:
+            vrep.simxSynchronousTrigger(self.cid)
+        else:
+            self.step_barrier.wait()
+
+    # Advance the simulation by one step. The ping only returns once the step has been carried
+    # out, by which point the data streamed during it has also been received.
+    def step_simulation(self):
+        self.trigger()
+        vrep.simxGetPingTime(self.cid)
+        self.streams_fresh = True
+
     # Returns a vector from one item to another under "from"s axes (not the world axes).
     def get_vector(self, from_handle, to_handle):
-        pose = catch_errors(vrep.simxGetObjectPosition(
-            self.cid, to_handle, from_handle, vrep.simx_opmode_blocking))
+        pose = self.read_stream(vrep.simxGetObjectPosition, to_handle, from_handle)
         return np.array(pose)
 
     def get_position(self, handle):
@@ -0,0 +1,7 @@
+import os
+
+from vrep_standin import install, standin_var
+
+# Swap in the V-Rep stand-in before any environment imports vrep (see vrep_standin)
+if os.environ.get(standin_var):
+    install()
@@ -7,12 +7,15 @@ from gym.spaces.box import Box
 
 from baselines import bench
 from baselines.common.vec_env import VecEnvWrapper
-from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
 from baselines.common.vec_env.vec_normalize import VecNormalize as VecNormalize_
 
 from envs.ImageObsVecEnvWrapper import SimImageObsVecEnvWrapper
+from envs.MultiRobotVecEnv import MultiRobotVecEnv
+from envs.PipelinedVecEnv import PipelinedVecEnv
 from envs.ResidualVecEnvWrapper import ResidualVecEnvWrapper
+from envs.SharedMemoryVecEnv import SharedMemoryVecEnv
+from envs.SimulatorPoolVecEnv import SimulatorPoolVecEnv
 from envs.wrappers import PoseEstimatorVecEnvWrapper, InitialController, BoundPositionVelocity, \
     ScaleActions
 from a2c_ppo_acktr.tuple_tensor import TupleTensor
@@ -30,11 +33,23 @@ except ImportError:
 exploration_factor = 1/3
 
 
-def make_env(env_name, scene_path, seed, rank, log_dir, allow_early_resets, vis, init_control):
-    def _thunk():
-        env = env_name(scene_path, rank, not vis)
+def make_env(env_name, scene_path, seed, rank, log_dir, allow_early_resets, vis, init_control,
+             randomise_interval=1):
+    # Given the base environment of a previous stage, loads the scene into its simulator rather
+    # than launching a new one (see SimulatorPoolVecEnv). Given a robot, the (host, index,
+    # number of robots) of one of several sharing a simulator, joins it (see MultiRobotVecEnv).
+    def _thunk(base_env=None, robot=None):
+        if base_env is not None:
+            env = base_env
+            env.load_scene(scene_path)
+        elif robot is not None:
+            env = env_name(scene_path, rank, not vis, *robot)
+        else:
+            env = env_name(scene_path, rank, not vis)
 
         env.seed(seed + rank)
+        if hasattr(env, 'randomise_interval'):
+            env.randomise_interval = randomise_interval
 
         env = BoundPositionVelocity(env)
         if init_control:
@@ -60,15 +75,61 @@ def wrap_initial_policies(envs, device, initial_policies):
 
 def make_vec_envs(env_name, scene_path, seed, num_processes, gamma, log_dir, device,
                   allow_early_resets, initial_policies, num_frame_stack=None, show=False,
-                  no_norm=False, pose_estimator=None, image_ips=None, init_control=True):
-    envs = [make_env(env_name, scene_path, seed, i, log_dir, allow_early_resets, show, init_control)
-            for i in range(num_processes)]
-
-    if len(envs) > 1:
-        envs = SubprocVecEnv(envs)
+                  no_norm=False, pose_estimator=None, image_ips=None, init_control=True,
+                  sim_pool=None, persistent=False, step_timeout=None, ready_envs=None,
+                  randomise_interval=1, pipelined=False, robots_per_sim=1, first_rank=0):
+    # Asynchronous stepping (see SharedMemoryVecEnv.step_wait_ready) is only passed through the
+    # residual, normalising and PyTorch wrappers
+    if ready_envs is not None and (getattr(env_name, 'batched', False) or sim_pool is not None
+                                   or persistent or step_timeout is not None
+                                   or pose_estimator is not None or num_frame_stack is not None):
+        raise ValueError("Asynchronous stepping needs simulators in plain worker processes")
+    # A step left in flight (see PipelinedVecEnv) would be in the way of anything else talking to
+    # the workers between steps
+    if pipelined and (ready_envs is not None or getattr(env_name, 'batched', False)
+                      or sim_pool is not None or persistent or step_timeout is not None
+                      or pose_estimator is not None):
+        raise ValueError("Pipelined stepping needs simulators in plain worker processes")
+    # Copies of the scene get in the way of images, and can't be loaded with the next stage
+    if robots_per_sim > 1 and (ready_envs is not None or getattr(env_name, 'batched', False)
+                               or sim_pool is not None or persistent or step_timeout is not None
+                               or pose_estimator is not None or show
+                               or num_processes % robots_per_sim != 0):
+        raise ValueError("Several robots per simulator need num_processes divisible by their "
+                         "number and plain simulators without vision")
+    if hasattr(env_name, 'start_shared_display'):
+        env_name.start_shared_display()
+    # Simulators take their port from their rank, so another set of environments running
+    # alongside needs ranks of its own
+    envs = [make_env(env_name, scene_path, seed, i, log_dir, allow_early_resets, show, init_control,
+                     randomise_interval)
+            for i in range(first_rank, first_rank + num_processes)]
+
+    # A pool of simulators from a previous stage can only be reused for the same task
+    if sim_pool is not None and (sim_pool.env_name is not env_name
+                                 or sim_pool.num_envs != num_processes):
+        sim_pool.close()
+        sim_pool = None
+
+    if getattr(env_name, 'batched', False):
+        # Simulates every environment in this process (see BatchedSawyerVecEnv)
+        envs = env_name(num_processes, scene_path, seed, init_control,
+                        action_scale=0.05 * exploration_factor)
+    elif sim_pool is not None:
+        sim_pool.load_scene(envs)
+        envs = sim_pool
+    elif persistent or step_timeout is not None:
+        envs = SimulatorPoolVecEnv(envs, env_name=env_name, step_timeout=step_timeout)
+    elif robots_per_sim > 1:
+        envs = MultiRobotVecEnv(envs, robots_per_sim)
+    elif len(envs) > 1 or ready_envs is not None or pipelined:
+        envs = SharedMemoryVecEnv(envs, ready_envs=ready_envs)
     else:
         envs = DummyVecEnv(envs)
 
+    if pipelined:
+        envs = PipelinedVecEnv(envs)
+
     envs = wrap_initial_policies(envs, device, initial_policies)
 
     if pose_estimator is not None:
@@ -171,6 +232,32 @@ class VecPyTorch(VecEnvWrapper):
         reward = torch.from_numpy(reward).unsqueeze(dim=1).float()
         return obs, reward, done, info
 
+    def step_async_envs(self, env_ids, actions):
+        self.venv.step_async_envs(env_ids, actions.squeeze(1).cpu().numpy())
+
+    def step_wait_ready(self):
+        env_ids, obs, reward, done, info = self.venv.step_wait_ready()
+        obs = torch.from_numpy(obs).float().to(self.device)
+        reward = torch.from_numpy(reward).unsqueeze(dim=1).float()
+        return env_ids, obs, reward, done, info
+
+    # As step_wait, but writing the results into the given tensors (see
+    # RolloutStorage.result_slots) instead of new ones, casting to their float32 on the way. On
+    # the CPU, VecNormalize writes its normalised observations straight into obs_out.
+    def step_wait_into(self, obs_out, rewards_out, masks_out, bad_masks_out):
+        if obs_out.device.type == 'cpu' and hasattr(self.venv, 'step_wait_into'):
+            reward, done, info = self.venv.step_wait_into(obs_out.numpy())
+        else:
+            obs, reward, done, info = self.venv.step_wait()
+            obs_out.copy_(torch.from_numpy(obs))
+        rewards_out.view(-1).copy_(torch.from_numpy(reward))
+        masks_out.view(-1).copy_(torch.from_numpy(done)).neg_().add_(1.)
+        bad_masks_out.fill_(1.)
+        for i, info_ in enumerate(info):
+            if info_.get('bad_transition'):
+                bad_masks_out[i] = 0.
+        return done, info
+
 
 class VecNormalize(VecNormalize_):
 
@@ -178,15 +265,61 @@ class VecNormalize(VecNormalize_):
         super(VecNormalize, self).__init__(*args, **kwargs)
         self.training = True
 
-    def _obfilt(self, obs):
+    # Normalised in float64 as before, then written to out if given, in its dtype. The
+    # placeholder observations of restarting simulators (see SimulatorPoolVecEnv), marked by
+    # 'bad_transition' in infos, repeat earlier ones and are left out of the running mean.
+    def _obfilt(self, obs, out=None, infos=None):
         if self.ob_rms:
             if self.training:
-                self.ob_rms.update(obs)
-            obs = np.clip((obs - self.ob_rms.mean) / np.sqrt(self.ob_rms.var + self.epsilon), -self.clipob, self.clipob)
-            return obs
+                real = np.array([not info.get('bad_transition') for info in infos or []], bool)
+                if infos is None or real.all():
+                    self.ob_rms.update(obs)
+                elif real.any():
+                    self.ob_rms.update(obs[real])
+            obs = obs - self.ob_rms.mean
+            obs /= np.sqrt(self.ob_rms.var + self.epsilon)
+            return np.clip(obs, -self.clipob, self.clipob, out=out)
+        elif out is not None:
+            np.copyto(out, obs)
+            return out
         else:
             return obs
 
+    def step_async_envs(self, env_ids, actions):
+        self.venv.step_async_envs(env_ids, actions)
+
+    def step_wait(self):
+        obs, rews, news, infos = self.venv.step_wait()
+        self.ret = self.ret * self.gamma + rews
+        obs = self._obfilt(obs, infos=infos)
+        if self.ret_rms:
+            self.ret_rms.update(self.ret)
+            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew,
+                           self.cliprew)
+        return obs, rews, news, infos
+
+    # As step_wait, with the observations written into obs_out (see VecPyTorch.step_wait_into)
+    def step_wait_into(self, obs_out):
+        obs, rews, news, infos = self.venv.step_wait()
+        self.ret = self.ret * self.gamma + rews
+        self._obfilt(obs, out=obs_out, infos=infos)
+        if self.ret_rms:
+            self.ret_rms.update(self.ret)
+            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew,
+                           self.cliprew)
+        return rews, news, infos
+
+    # As step_wait, keeping track of the returns of the environments that stepped
+    def step_wait_ready(self):
+        env_ids, obs, rews, news, infos = self.venv.step_wait_ready()
+        self.ret[env_ids] = self.ret[env_ids] * self.gamma + rews
+        obs = self._obfilt(obs, infos=infos)
+        if self.ret_rms:
+            self.ret_rms.update(self.ret[env_ids])
+            rews = np.clip(rews / np.sqrt(self.ret_rms.var + self.epsilon), -self.cliprew,
+                           self.cliprew)
+        return env_ids, obs, rews, news, infos
+
     def train(self):
         self.training = True
 
@@ -1,3 +1,6 @@
+from envs.BatchedGoalEnvs import BatchedDRSparseVecEnv, BatchedDRDenseVecEnv, \
+    BatchedROWSparseVecEnv, BatchedROWDenseVecEnv, BatchedSSSparseVecEnv, BatchedSSDenseVecEnv
+from envs.BatchedReach2DVecEnv import BatchedReach2DVecEnv
 from envs.DRRewardEnvs import DRSparseEnv, DRDenseEnv
 from envs.ReachOverWallEnv import ROWSparseEnv, ROWDenseEnv
 from envs.ShelfStackEnv import SSSparseEnv, SSDenseEnv
@@ -212,5 +215,20 @@ pipelines = {
     },
 }
 
+# The same curricula on arms simulated in batches in the training process, for working on the
+# learning side at speed (see BatchedSawyerVecEnv). Obstacles aren't modelled, so the stages only
+# differ by name.
+pipelines.update({
+    'rack_batched': {**rack, 'sparse': BatchedDRSparseVecEnv, 'dense': BatchedDRDenseVecEnv},
+    'wall_batched': {**wall, 'sparse': BatchedROWSparseVecEnv, 'dense': BatchedROWDenseVecEnv},
+    'shelf_batched': {**shelf, 'sparse': BatchedSSSparseVecEnv, 'dense': BatchedSSDenseVecEnv},
+})
 
-
+# Planar three link arm for quick demo and regression runs, with no simulator at all. It has
+# only the one dense reward.
+pipelines['reach2d'] = {
+    'sparse': BatchedReach2DVecEnv,
+    'dense': BatchedReach2DVecEnv,
+    'task': 'reach2d',
+    'curriculum': []
+}
@@ -0,0 +1,72 @@
+import argparse
+import json
+
+import numpy as np
+import vrep
+
+from envs.VrepEnv import VrepEnv, catch_errors, respondability_path
+from envs.pipelines import pipelines
+
+parser = argparse.ArgumentParser(description='Respondability')
+parser.add_argument('--pipelines', nargs='+', default=list(pipelines.keys()),
+                    help='pipelines whose curriculum stages to describe (default: all)')
+parser.add_argument('--tolerance', type=float, default=1e-4,
+                    help='max difference in any shape pose between a stage and its task')
+args = parser.parse_args()
+
+
+def get_shapes(env):
+    handles, _, _, names = catch_errors(vrep.simxGetObjectGroupData(
+        env.cid, vrep.sim_object_shape_type, 0, vrep.simx_opmode_blocking))
+    _, _, poses, _ = catch_errors(vrep.simxGetObjectGroupData(
+        env.cid, vrep.sim_object_shape_type, 9, vrep.simx_opmode_blocking))
+    flags = {name: env.get_respondable(name) for name in names}
+    return flags, dict(zip(names, np.reshape(poses, (-1, 6))))
+
+
+# Script for describing each curriculum stage scene as its task scene with a set of obstacle parts
+# made non-respondable (see VrepEnv.load_scene). Stages that differ from their task in any other
+# way (missing shapes, moved shapes) are left out and keep being loaded from their own files.
+def main():
+    tasks = {}
+    for name in args.pipelines:
+        pipeline = pipelines[name]
+        tasks.setdefault(pipeline['task'], set()).update(pipeline['curriculum'])
+
+    env = None
+    spec = {}
+    for task, stages in tasks.items():
+        if env is None:
+            env = VrepEnv(task, 0, True)
+        else:
+            env.load_scene_file(task)
+        task_flags, task_poses = get_shapes(env)
+
+        parts = set()
+        task_stages = {}
+        for stage in sorted(stages):
+            env.load_scene_file(stage)
+            flags, poses = get_shapes(env)
+            if flags.keys() != task_flags.keys() or \
+                    any(np.abs(poses[name] - task_poses[name]).max() > args.tolerance
+                        for name in poses):
+                print(f"{stage} differs from {task} by more than respondability, skipping")
+                continue
+            non_respondable = sorted(name for name, flag in flags.items()
+                                     if task_flags[name] and not flag)
+            if any(flag and not task_flags[name] for name, flag in flags.items()):
+                print(f"{stage} has parts respondable that are not in {task}, skipping")
+                continue
+            parts.update(non_respondable)
+            task_stages[stage] = non_respondable
+            print(f"{stage}: {len(non_respondable)} non-respondable parts")
+        if task_stages:
+            spec[task] = {'parts': sorted(parts), 'stages': task_stages}
+
+    env.close()
+    with open(respondability_path, 'w') as f:
+        json.dump(spec, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+
+import numpy as np
+
+from envs.ShelfStackEnv import ShelfStackEnv, start_poses_path
+
+parser = argparse.ArgumentParser(description='Start poses')
+parser.add_argument('--scene', default='shelf',
+                    help='shelf scene to solve the start poses in (default: shelf)')
+parser.add_argument('--num-poses', type=int, default=2000,
+                    help='number of start positions to find poses for (default: 2000)')
+parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+args = parser.parse_args()
+
+
+# Script for building the table of start positions above the shelf with the joint poses that hold
+# the mug there, which ShelfStackEnv.reset draws from instead of searching with IK every episode.
+# The shelf stages only differ in their obstacles, so one table serves all of them.
+def main():
+    env = ShelfStackEnv(args.scene, 0, True)
+    env.seed(args.seed)
+    positions = np.zeros((args.num_poses, 3))
+    poses = np.zeros((args.num_poses, env.num_joints))
+    for i in range(args.num_poses):
+        positions[i], poses[i] = env.solve_start_pose()
+        if (i + 1) % 100 == 0:
+            print(f"{i + 1}/{args.num_poses} start poses")
+    env.close()
+    np.savez(start_poses_path, positions=positions, poses=poses)
+
+
+if __name__ == "__main__":
+    main()
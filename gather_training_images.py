@@ -34,7 +34,8 @@ def main():
 
     envs = make_vec_envs(DRSparseEnv, 'dish_rack_vis', args.seed + 1000, args.num_processes,
                          args.gamma, args.log_dir, device, False, policies, no_norm=True,
-                         show=(args.num_processes == 1))
+                         show=(args.num_processes == 1),
+                         randomise_interval=args.randomise_interval)
 
     null_action = torch.zeros((args.num_processes, envs.action_space.shape[0]))
     save_path = os.path.join(save_root, f'training_data/{args.seed}')
@@ -11,10 +11,13 @@ import torch
 
 from a2c_ppo_acktr import algo
 from a2c_ppo_acktr.arguments import get_args
+from a2c_ppo_acktr.evaluation import evaluate, BackgroundEvaluator
 from envs.envs import make_vec_envs, get_vec_normalize
+from envs.SimulatorPoolVecEnv import get_sim_pool
 from a2c_ppo_acktr.model import Policy
 from a2c_ppo_acktr.storage import RolloutStorage
-from a2c_ppo_acktr.utils import update_linear_schedule
+from a2c_ppo_acktr.checkpoints import CheckpointWriter
+from a2c_ppo_acktr.utils import update_linear_schedule, save_atomic
 from a2c_ppo_acktr.visualize import visdom_plot
 from envs.pipelines import pipelines
 
@@ -32,8 +35,28 @@ if args.cuda and torch.cuda.is_available() and args.cuda_deterministic:
     torch.backends.cudnn.benchmark = False
     torch.backends.cudnn.deterministic = True
 
+# Arguments a learner state is saved with, which a run resuming it has to share
+resume_args = ['algo', 'seed', 'num_processes', 'num_steps', 'recurrent_policy', 'lr',
+               'ppo_epoch', 'num_mini_batch', 'gamma', 'initial_policy', 'reuse_residual']
 
-def main(env, scene_path):
+
+# Refuses to resume a learner state saved by a run with different arguments, e.g. one left behind
+# by an earlier crashed run with the same --save-as
+def check_resume_args(state, state_path):
+    saved = state.get('args', {})
+    changed = [f"{name} ({saved.get(name)} -> {getattr(args, name)})" for name in resume_args
+               if saved.get(name) != getattr(args, name)]
+    if changed:
+        raise ValueError(f"{state_path} was saved with different arguments: {', '.join(changed)}. "
+                         f"Remove it to train from scratch, or rerun with the arguments it was "
+                         f"saved with to resume it.")
+
+
+# initial_policies may be handed over in memory from the previous stage, and sim_pool is a
+# SimulatorPoolVecEnv to load this stage's scene into. Unless keep_sims is set the simulators are
+# closed at the end of the stage; otherwise the pool is returned for the next one. Stages trained
+# side by side need simulator ranks starting at different first_ranks (see schedule_curricula.py).
+def main(env, scene_path, initial_policies=None, sim_pool=None, keep_sims=False, first_rank=0):
     try:
         os.makedirs(args.log_dir)
     except OSError:
@@ -41,6 +64,11 @@ def main(env, scene_path):
         for f in files:
             os.remove(f)
     save_path = os.path.join(args.save_dir, args.algo)
+    # The complete learner state, which a stage interrupted by a crash is resumed from
+    state_path = os.path.join(save_path, args.save_as + "_state.pt")
+    state = torch.load(state_path) if os.path.exists(state_path) else None
+    if state is not None:
+        check_resume_args(state, state_path)
 
     eval_x = []
     eval_y = []
@@ -48,9 +76,9 @@ def main(env, scene_path):
     torch.set_num_threads(1)
     device = torch.device("cuda:0" if args.cuda else "cpu")
 
-    initial_policies = torch.load(os.path.join(args.load_dir, args.algo,
-                                               args.initial_policy + ".pt")) \
-        if args.initial_policy else None
+    if initial_policies is None and args.initial_policy:
+        initial_policies = torch.load(os.path.join(args.load_dir, args.algo,
+                                                   args.initial_policy + ".pt"))
 
     if args.reuse_residual:
         residual, ob_rms, initial_policies = initial_policies
@@ -64,7 +92,12 @@ def main(env, scene_path):
 
     envs = make_vec_envs(env, scene_path, args.seed, args.num_processes, args.gamma, args.log_dir,
                          device, False, initial_policies, pose_estimator=pose_estimator,
-                         init_control=not args.dense_ip)
+                         init_control=not args.dense_ip, sim_pool=sim_pool,
+                         persistent=keep_sims, step_timeout=args.step_timeout,
+                         ready_envs=args.ready_envs,
+                         randomise_interval=args.randomise_interval,
+                         pipelined=args.pipelined_stepping,
+                         robots_per_sim=args.robots_per_sim, first_rank=first_rank)
     if args.reuse_residual:
         vec_norm = get_vec_normalize(envs)
         if vec_norm is not None:
@@ -85,7 +118,8 @@ def main(env, scene_path):
         agent = algo.PPO(actor_critic, args.clip_param, args.ppo_epoch, args.num_mini_batch,
                          args.value_loss_coef, args.entropy_coef, lr=args.lr, eps=args.eps,
                          max_grad_norm=args.max_grad_norm,
-                         burn_in=initial_policies is not None and not args.reuse_residual)
+                         burn_in=initial_policies is not None and not args.reuse_residual,
+                         bptt_length=args.bptt_length, target_kl=args.target_kl)
     elif args.algo == 'acktr':
         agent = algo.A2C_ACKTR(actor_critic, args.value_loss_coef, args.entropy_coef, acktr=True)
 
@@ -93,12 +127,42 @@ def main(env, scene_path):
                               envs.observation_space.shape, envs.action_space,
                               actor_critic.recurrent_hidden_state_size)
 
+    if state is not None:
+        actor_critic.load_state_dict(state['actor_critic'])
+        agent.optimizer.load_state_dict(state['optimizer'])
+        if hasattr(agent, 'burn_in'):
+            agent.burn_in = state['burn_in']
+        vec_norm = get_vec_normalize(envs)
+        if vec_norm is not None:
+            vec_norm.ob_rms, vec_norm.ret_rms = state['ob_rms'], state['ret_rms']
+        torch_rng, cuda_rng, np_rng = state['rng']
+        torch.set_rng_state(torch_rng)
+        if cuda_rng is not None:
+            torch.cuda.set_rng_state_all(cuda_rng)
+        np.random.set_state(np_rng)
+
     obs = envs.reset()
     rollouts.obs[0].copy_(obs)
     rollouts.to(device)
+    # VecPyTorch can write each step's results straight into the rollout
+    in_place = hasattr(envs, 'step_wait_into')
 
     episode_rewards = deque(maxlen=64)
 
+    max_trials = 50
+    evaluation = None
+    evaluator = None
+    # Set to the policy saved when an evaluation ends the stage
+    trained_policies = None
+    if args.eval_interval is not None and args.eval_processes is not None:
+        evaluator = BackgroundEvaluator(
+            lambda: make_vec_envs(env, scene_path, args.seed + 1000, args.eval_processes,
+                                  args.gamma, None, device, False, initial_policies,
+                                  pose_estimator=pose_estimator, init_control=not args.dense_ip,
+                                  randomise_interval=args.randomise_interval,
+                                  first_rank=first_rank + args.num_processes),
+            max_trials, device)
+
     num_updates = int(args.num_env_steps) // args.num_steps // args.num_processes
     total_num_steps = 0
     j = 0
@@ -106,43 +170,53 @@ def main(env, scene_path):
     max_mean_rew = - math.inf
     mean_ep_rew = - math.inf
     evals_without_improv = 0
-
+    if state is not None:
+        j, total_num_steps, max_succ, max_mean_rew, mean_ep_rew, evals_without_improv = \
+            state['progress']
+        eval_x, eval_y = state['evals']
+        episode_rewards.extend(state['episode_rewards'])
+        print(f"Resuming {args.save_as} after {j} updates")
+
+    start_num_steps = total_num_steps
+    # Saves are written in the background, the policy copied to the CPU on the way
+    checkpoints = CheckpointWriter()
     start = time.time()
     start_update = start
     while (not use_metric and j < num_updates) or (use_metric and max_succ < args.trg_succ_rate):
         if args.eval_interval is not None and j % args.eval_interval == 0:
-            print("Evaluating current policy...")
-            i = 0
-            total_successes = 0
-            max_trials = 50
-            eval_recurrent_hidden_states = torch.zeros(
-                args.num_processes, actor_critic.recurrent_hidden_state_size, device=device)
-            eval_masks = torch.zeros(args.num_processes, 1, device=device)
-            while i + args.num_processes <= max_trials:
-
-                with torch.no_grad():
-                    _, action, _, eval_recurrent_hidden_states = actor_critic.act(
-                        obs, eval_recurrent_hidden_states, eval_masks, deterministic=True)
-
-                obs, _, dones, infos = envs.step(action)
-
-                if np.all(dones):  # Rigid - assumes episodes are fixed length
-                    rews = []
-                    for info in infos:
-                        rews.append(info['rew_success'])
-                    i += args.num_processes
-                    rew = sum([int(rew > 0) for rew in rews])
-                    total_successes += rew
-
+            ob_rms = getattr(get_vec_normalize(envs), 'ob_rms', None)
+            if evaluator is not None:
+                evaluator.submit(total_num_steps, actor_critic, ob_rms)
+            else:
+                print("Evaluating current policy...")
+                total_successes, i, obs = evaluate(actor_critic, envs, rollouts.obs[0], max_trials,
+                                                   device)
+                # Training carries on from the start of the episodes the evaluation left off at
+                rollouts.obs[0].copy_(obs)
+                rollouts.masks[0].zero_()
+                evaluation = (total_num_steps, actor_critic, ob_rms, total_successes, i)
+        if evaluator is not None:
+            evaluation = evaluator.poll()
+        if evaluation is not None and evaluation[-1] == 0:
+            print(f"Evaluation after {evaluation[0]} timesteps finished no episodes, skipping it")
+            evaluation = None
+
+        if evaluation is not None:
+            eval_num_steps, eval_policy, eval_ob_rms, total_successes, i = evaluation
+            evaluation = None
             p_succ = (100 * total_successes / i)
-            eval_x += [total_num_steps]
+            eval_x += [eval_num_steps]
             eval_y += [p_succ]
 
-            end = time.time()
-            print(f"Evaluation: {total_successes} successful out of {i} episodes - "
-                  f"{p_succ:.2f}% successful. Eval length: {end - start_update}")
+            if evaluator is not None:
+                print(f"Evaluation after {eval_num_steps} timesteps: {total_successes} successful "
+                      f"out of {i} episodes - {p_succ:.2f}% successful.")
+            else:
+                end = time.time()
+                print(f"Evaluation: {total_successes} successful out of {i} episodes - "
+                      f"{p_succ:.2f}% successful. Eval length: {end - start_update}")
+                start_update = end
             torch.save([eval_x, eval_y], os.path.join(args.save_as + "_eval.pt"))
-            start_update = end
 
             if p_succ > max_succ:
                 max_succ = p_succ
@@ -155,15 +229,12 @@ def main(env, scene_path):
             else:
                 evals_without_improv += 1
 
+            # The policy as it was evaluated, which training may have moved on from since
             if evals_without_improv == 10 or max_succ >= args.trg_succ_rate:
-                save_model = actor_critic
-                if args.cuda:
-                    save_model = copy.deepcopy(actor_critic).cpu()
-
-                save_model = [save_model, getattr(get_vec_normalize(envs), 'ob_rms', None),
-                              initial_policies]
                 extra = "_final" if evals_without_improv == 5 else ""
-                torch.save(save_model, os.path.join(save_path, args.save_as + f"{extra}.pt"))
+                checkpoints.save(os.path.join(save_path, args.save_as + f"{extra}.pt"),
+                                 lambda model: [model, eval_ob_rms, initial_policies], eval_policy)
+                trained_policies = [eval_policy, eval_ob_rms, initial_policies]
                 break
 
         # save for every interval-th episode or for the last epoch
@@ -171,17 +242,14 @@ def main(env, scene_path):
                 or (use_metric and evals_without_improv == 0)) and args.save_dir != "":
             os.makedirs(save_path, exist_ok=True)
 
-            save_model = actor_critic
-            if args.cuda:
-                save_model = copy.deepcopy(actor_critic).cpu()
-
             if pose_estimator is not None:
-                save_model = [save_model, pose_estimator, initial_policies]
+                saved_with = pose_estimator
             else:
-                save_model = [save_model, getattr(get_vec_normalize(envs), 'ob_rms', None),
-                              initial_policies]
+                saved_with = copy.deepcopy(getattr(get_vec_normalize(envs), 'ob_rms', None))
 
-            torch.save(save_model, os.path.join(save_path, args.save_as + ".pt"))
+            checkpoints.save(os.path.join(save_path, args.save_as + ".pt"),
+                             lambda model, ob_rms=saved_with: [model, ob_rms, initial_policies],
+                             actor_critic)
             # torch.save(save_model, os.path.join(save_path, args.save_as + f"{j * args.num_processes * args.num_steps}.pt"))
 
         if args.use_linear_lr_decay:
@@ -195,25 +263,38 @@ def main(env, scene_path):
         if args.algo == 'ppo' and args.use_linear_clip_decay:
             agent.clip_param = args.clip_param  * (1 - j / float(num_updates))
 
-        for step in range(args.num_steps):
-            # Sample actions
-            with torch.no_grad():
-                value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
-                        rollouts.obs[step],
-                        rollouts.recurrent_hidden_states[step],
-                        rollouts.masks[step])
-
-            # Obser reward and next obs
-            obs, reward, done, infos = envs.step(action)
-
-            for info in infos:
-                if 'episode' in info.keys():
-                    episode_rewards.append(info['episode']['r'])
-
-            # If done then clean the history of observations.
-            masks = torch.FloatTensor([[0.0] if done_ else [1.0]
-                                       for done_ in done])
-            rollouts.insert(obs, recurrent_hidden_states, action, action_log_prob, value, reward, masks)
+        if args.ready_envs is not None:
+            collect_async(envs, actor_critic, rollouts, episode_rewards)
+            obs = rollouts.obs[-1]
+        else:
+            for step in range(args.num_steps):
+                # Sample actions
+                with torch.no_grad():
+                    value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
+                            rollouts.obs[step],
+                            rollouts.recurrent_hidden_states[step],
+                            rollouts.masks[step])
+
+                # Obser reward and next obs, straight into the rollout unless a wrapper on top
+                # of VecPyTorch is in the way
+                if in_place:
+                    envs.step_async(action)
+                    done, infos = envs.step_wait_into(*rollouts.result_slots())
+                    rollouts.insert_policy(recurrent_hidden_states, action, action_log_prob,
+                                           value)
+                else:
+                    obs, reward, done, infos = envs.step(action)
+
+                    # If done then clean the history of observations.
+                    masks = 1. - torch.from_numpy(np.asarray(done, dtype=np.float32)).unsqueeze(1)
+                    bad_masks = torch.FloatTensor([[0.0] if info.get('bad_transition') else [1.0]
+                                                   for info in infos])
+                    rollouts.insert(obs, recurrent_hidden_states, action, action_log_prob, value,
+                                    reward, masks, bad_masks)
+
+                for info in infos:
+                    if 'episode' in info.keys():
+                        episode_rewards.append(info['episode']['r'])
 
         with torch.no_grad():
             next_value = actor_critic.get_value(rollouts.obs[-1],
@@ -237,14 +318,18 @@ def main(env, scene_path):
             end = time.time()
             print("Updates {}, num timesteps {}, FPS {} \n Last {} training episodes: mean/median reward {:.1f}/{:.1f}, min/max reward {:.1f}/{:.1f}".
                 format(j, total_num_steps,
-                       int(total_num_steps / (end - start)),
+                       int((total_num_steps - start_num_steps) / (end - start)),
                        len(episode_rewards),
                        mean_ep_rew,
                        np.median(episode_rewards),
                        np.min(episode_rewards),
-                       np.max(episode_rewards), dist_entropy,
-                       value_loss, action_loss))
+                       np.max(episode_rewards)))
+            print(" dist entropy {:.3f}, value loss {:.3f}, action loss {:.3f}".format(
+                dist_entropy.item(), value_loss.item(), action_loss.item()))
             print("Update length: ", end - start_update)
+            if getattr(agent, 'target_kl', None) is not None:
+                print("PPO epochs: {}/{}, {:.2f}s saved".format(
+                    agent.epochs_used, agent.ppo_epoch, agent.time_saved))
             start_update = end
 
         if args.vis and (j % args.vis_interval == 0 or (not use_metric and j == num_updates - 1)):
@@ -256,6 +341,26 @@ def main(env, scene_path):
 
         j += 1
 
+        if args.save_dir != "" and j % args.save_interval == 0:
+            os.makedirs(save_path, exist_ok=True)
+            vec_norm = get_vec_normalize(envs)
+            checkpoint = {
+                'args': {name: getattr(args, name) for name in resume_args},
+                'burn_in': getattr(agent, 'burn_in', None),
+                'ob_rms': copy.deepcopy(getattr(vec_norm, 'ob_rms', None)),
+                'ret_rms': copy.deepcopy(getattr(vec_norm, 'ret_rms', None)),
+                'rng': (torch.get_rng_state(),
+                        torch.cuda.get_rng_state_all() if args.cuda else None,
+                        np.random.get_state()),
+                'progress': (j, total_num_steps, max_succ, max_mean_rew, mean_ep_rew,
+                             evals_without_improv),
+                'evals': (list(eval_x), list(eval_y)),
+                'episode_rewards': list(episode_rewards),
+            }
+            checkpoints.save(state_path, lambda model, optimizer, state=checkpoint:
+                             dict(state, actor_critic=model.state_dict(), optimizer=optimizer),
+                             actor_critic, agent.optimizer)
+
     if use_metric:
         if max_succ >= args.trg_succ_rate:
             print(f"Achieved greater than {args.trg_succ_rate}% success, advancing curriculum.")
@@ -263,17 +368,65 @@ def main(env, scene_path):
             print(f"Policy converged with max success rate < {args.trg_succ_rate}%")
     # Copy logs to permanent location so new graphs can be drawn.
     copy_tree(args.log_dir, os.path.join('logs', args.save_as))
+    # The next stage carries on from the policy saved, which is the one last evaluated if the
+    # stage ended on an evaluation
+    if trained_policies is None:
+        trained_policies = [actor_critic, pose_estimator if pose_estimator is not None
+                            else getattr(get_vec_normalize(envs), 'ob_rms', None), initial_policies]
+    if evaluator is not None:
+        evaluator.close()
+    checkpoints.close()
+    # The stage is done, so a later run shouldn't pick it up again
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    if keep_sims:
+        return total_num_steps, trained_policies, get_sim_pool(envs)
     envs.close()
-    return total_num_steps
+    return total_num_steps, trained_policies, None
 
 
-def train_with_metric(pipeline, train, save_base):
+# Fills the rollout stepping the environments asynchronously. The policy acts on whichever
+# environments have finished their last step, each moving along its own column of the rollout,
+# until all of them have taken num_steps steps.
+def collect_async(envs, actor_critic, rollouts, episode_rewards):
+    env_ids = torch.arange(args.num_processes)
+    num_stepping = 0
+    while len(env_ids) > 0 or num_stepping > 0:
+        if len(env_ids) > 0:
+            with torch.no_grad():
+                value, action, action_log_prob, recurrent_hidden_states = actor_critic.act(
+                    *rollouts.current(env_ids))
+            rollouts.insert_actions(env_ids, recurrent_hidden_states, action, action_log_prob,
+                                    value)
+            envs.step_async_envs(env_ids.numpy(), action)
+            num_stepping += len(env_ids)
+
+        env_ids, obs, reward, done, infos = envs.step_wait_ready()
+        num_stepping -= len(env_ids)
+
+        for info in infos:
+            if 'episode' in info.keys():
+                episode_rewards.append(info['episode']['r'])
+
+        masks = 1. - torch.from_numpy(np.asarray(done, dtype=np.float32)).unsqueeze(1)
+        bad_masks = torch.FloatTensor([[0.0] if info.get('bad_transition') else [1.0]
+                                       for info in infos])
+        env_ids = torch.from_numpy(env_ids)
+        rollouts.insert_results(env_ids, obs, reward, masks, bad_masks)
+        env_ids = env_ids[rollouts.env_steps[env_ids] < rollouts.num_steps]
+
+
+def check_metric_args():
     if args.use_linear_clip_decay:
         raise ValueError("Cannot use clip decay with unbounded metric-based training length.")
     if args.eval_interval is None:
         raise ValueError("Need to set eval_interval to evaluate success rate")
     args.use_linear_lr_decay = False
 
+
+def train_with_metric(pipeline, train, save_base):
+    check_metric_args()
+
     training_lengths = []
     save_path = os.path.join(args.save_dir, args.algo)
     target = args.trg_succ_rate
@@ -295,21 +448,54 @@ def train_with_metric(pipeline, train, save_base):
     return total_train_times, training_lengths
 
 
+# Returns the stages of the curriculum completed so far, as {stage index: (scene, training length)}
+def load_manifest(path):
+    return torch.load(path) if os.path.exists(path) else {}
+
+
 def execute_curriculum(pipeline, save_base):
-    training_lengths = []
     criteria_string = f"until {args.trg_succ_rate}% successful" if use_metric \
         else f"for {args.num_env_steps} timesteps"
-    for scene in pipeline['curriculum']:
+    save_path = os.path.join(args.save_dir, args.algo)
+    os.makedirs(save_path, exist_ok=True)
+    manifest_path = os.path.join(save_path, f"{save_base}_manifest.pt")
+    manifest = load_manifest(manifest_path)
+    first_stage = max(manifest, default=-1) + 1 if args.first_stage is None else args.first_stage
+    # Stages from the first on are trained again
+    manifest = {stage: entry for stage, entry in manifest.items() if stage < first_stage}
+    training_lengths = [length for _, (_, length) in sorted(manifest.items())]
+    stages = pipeline['curriculum'] + [pipeline['task']]
+    if first_stage == len(stages):
+        return training_lengths
+    trained_policies = None
+    sim_pool = None
+    if first_stage > 0:
+        print(f"Starting from stage {first_stage}, {stages[first_stage]}")
+        args.reuse_residual = True
+        args.initial_policy = f'{save_base}_{stages[first_stage - 1]}'
+        initial_path = os.path.join(save_path, args.initial_policy + ".pt")
+        if not os.path.exists(initial_path):
+            raise ValueError(f"Cannot start from stage {first_stage} without the policy of stage "
+                             f"{first_stage - 1}, {initial_path}")
+        trained_policies = torch.load(initial_path)
+    for stage, scene in enumerate(pipeline['curriculum'][first_stage:], first_stage):
         print(f"Training {scene} {criteria_string}")
         args.save_as = f'{save_base}_{scene}'
-        training_lengths += [main(pipeline['sparse'], scene)]
+        length, trained_policies, sim_pool = main(pipeline['sparse'], scene, trained_policies,
+                                                  sim_pool, keep_sims=args.persistent_sims)
+        training_lengths += [length]
+        manifest[stage] = (scene, length)
+        save_atomic(manifest, manifest_path)
         args.reuse_residual = True
         args.initial_policy = args.save_as
     scene = pipeline['task']
     print(f"Training on {scene} full task")
     args.save_as = f'{save_base}_{scene}'
     args.trg_succ_rate = 101  # Does not affect fixed length curriculum
-    training_lengths += [main(pipeline['sparse'], scene)]
+    length, _, _ = main(pipeline['sparse'], scene, trained_policies, sim_pool)
+    training_lengths += [length]
+    manifest[len(stages) - 1] = (scene, length)
+    save_atomic(manifest, manifest_path)
     return training_lengths
 
 
@@ -318,12 +504,15 @@ def train_baseline(pipeline, save_base):
     scene = pipeline['task']
     print(f"Training {scene} until {args.trg_succ_rate}% successful with dense rewards")
     args.save_as = f'{save_base}_dense_{scene}'
-    training_lengths += [main(pipeline['dense'], scene)]
+    length, trained_policies, sim_pool = main(pipeline['dense'], scene,
+                                              keep_sims=args.persistent_sims)
+    training_lengths += [length]
     args.initial_policy = args.save_as
     print(f"Training on {scene} until convergence")
     args.save_as = f'{save_base}_sparse_{scene}'
     args.trg_succ_rate = 101
-    training_lengths += [main(pipeline['sparse'], scene)]
+    length, _, _ = main(pipeline['sparse'], scene, trained_policies, sim_pool)
+    training_lengths += [length]
     return training_lengths
 
 
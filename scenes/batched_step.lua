@@ -0,0 +1,37 @@
+-- Functions to append to the 'remote_api' customization script of a scene so that
+-- GoalDrivenEnv can apply an action and observe the result with a single blocking call.
+-- Scenes without them still work, falling back to one remote call per quantity.
+--
+-- The synchronous trigger can only come from the client, so a step is:
+--   apply_action (oneshot, no reply) -> simxSynchronousTrigger -> observe_step (blocking)
+
+last_joint_targets = {}
+
+-- inFloats: the Cartesian action, as passed to update_robot_movement.
+apply_action = function(inInts, inFloats, inStrings, inBuffer)
+    local _, targets = update_robot_movement(inInts, inFloats, inStrings, inBuffer)
+    last_joint_targets = targets
+    return {}, {}, {}, ''
+end
+
+-- inInts: {subject handle, target handle}
+-- Returns floats laid out as: joint angles (7), subject position (3), target position (3),
+-- subject position relative to the target (3), subject orientation relative to the target (3),
+-- followed by the joint targets from the last applied action (7, or none before the first).
+observe_step = function(inInts, inFloats, inStrings, inBuffer)
+    local subject, target = inInts[1], inInts[2]
+    local _, out = get_joint_angles({}, {}, {}, '')
+    local parts = {
+        sim.getObjectPosition(subject, -1),
+        sim.getObjectPosition(target, -1),
+        sim.getObjectPosition(subject, target),
+        sim.getObjectOrientation(subject, target),
+        last_joint_targets,
+    }
+    for _, part in ipairs(parts) do
+        for _, v in ipairs(part) do
+            out[#out + 1] = v
+        end
+    end
+    return {}, out, {}, ''
+end
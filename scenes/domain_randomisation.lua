@@ -0,0 +1,28 @@
+-- Function to append to the 'remote_api' customization script of a vision scene so that
+-- DishRackEnv can apply all of its domain randomisation with a single blocking call.
+-- Scenes without it still work, falling back to one remote call per colour, pose and light.
+
+-- inInts: {number of colours c, number of poses p, number of lights l,
+--          c object handles, p object handles, l light handles, l enabled flags (0 or 1)}
+-- inFloats: the c colours (3 each), then the p poses as world position and orientation (6 each)
+randomise_domain = function(inInts, inFloats, inStrings, inBuffer)
+    local num_colors, num_poses, num_lights = inInts[1], inInts[2], inInts[3]
+    local i, f = 4, 1
+    for _ = 1, num_colors do
+        set_color({inInts[i]}, {inFloats[f], inFloats[f + 1], inFloats[f + 2]}, {}, '')
+        i, f = i + 1, f + 3
+    end
+    for _ = 1, num_poses do
+        sim.setObjectPosition(inInts[i], -1, {inFloats[f], inFloats[f + 1], inFloats[f + 2]})
+        sim.setObjectOrientation(inInts[i], -1, {inFloats[f + 3], inFloats[f + 4], inFloats[f + 5]})
+        i, f = i + 1, f + 6
+    end
+    for j = 0, num_lights - 1 do
+        if inInts[i + num_lights + j] ~= 0 then
+            enable_light({inInts[i + j]}, {}, {}, '')
+        else
+            disable_light({inInts[i + j]}, {}, {}, '')
+        end
+    end
+    return {}, {}, {}, ''
+end
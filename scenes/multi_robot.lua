@@ -0,0 +1,26 @@
+-- Function to append to the 'remote_api' customization script of a scene so that one V-Rep
+-- instance can simulate several robots (see MultiRobotVecEnv). Only called with the simulation
+-- stopped, as VrepEnv does right after loading the scene.
+
+-- inInts: {number of copies n}
+-- inFloats: {spacing}
+-- Copies every object in the scene n times, this script included, the k-th copy translated by
+-- k * spacing along y. V-Rep names the copies' objects with the suffixes #0, #1..., and each
+-- copied script resolves object names against its own copy. The copies' root objects are parented
+-- to a dummy RobotOrigin#(k-1) at their offset, the frame their task poses are given in.
+replicate_scene = function(inInts, inFloats, inStrings, inBuffer)
+    local copies, spacing = inInts[1], inFloats[1]
+    local objects = sim.getObjectsInTree(sim.handle_scene)
+    for k = 1, copies do
+        local copy = sim.copyPasteObjects(objects, 0)
+        local origin = sim.createDummy(0.01)
+        sim.setObjectName(origin, 'RobotOrigin#' .. (k - 1))
+        sim.setObjectPosition(origin, -1, {0, k * spacing, 0})
+        for i, handle in ipairs(objects) do
+            if sim.getObjectParent(handle) == -1 then
+                sim.setObjectParent(copy[i], origin, false)
+            end
+        end
+    end
+    return {}, {}, {}, ''
+end
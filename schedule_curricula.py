@@ -0,0 +1,144 @@
+import hashlib
+import os
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+import numpy as np
+import torch
+
+from a2c_ppo_acktr.utils import save_atomic
+from envs.pipelines import pipelines
+from main import main, args, use_metric, check_metric_args
+
+
+class Stage(object):
+    """
+    A node in the tree of curriculum stages: the scene at the end of path, trained with the seed
+    after the stages before it. Runs of pipelines that agree up to a stage share it and every
+    stage before it, so it is trained once and they all carry on from its saved policy.
+    """
+    def __init__(self, pipeline, seed, path, parent, save_base):
+        self.env = pipeline['sparse']
+        self.scene = path[-1]
+        # The task is trained until convergence rather than to the target success rate
+        self.is_task = len(path) == len(pipeline['curriculum']) + 1
+        self.seed = seed
+        self.parent = parent
+        self.key = (self.env.__name__, seed, tuple(path), self.is_task)
+        digest = hashlib.md5(repr(self.key).encode()).hexdigest()[:8]
+        self.name = f'{save_base}_{seed}_{self.scene}_{digest}'
+        # Seeds the policy and minibatch sampling, so that seeds are independent of each other
+        # and every stage of one differs from the stage before it
+        self.rng_seed = int(digest, 16)
+        self.length = None
+
+
+# Returns the stages of every (pipeline, seed) run, merged into a tree, and {(pipeline, seed):
+# [stages of the run]}
+def build_tree(pipeline_names, seeds, save_base):
+    stages = {}
+    runs = {}
+    for pipeline_name in pipeline_names:
+        pipeline = pipelines[pipeline_name]
+        scenes = pipeline['curriculum'] + [pipeline['task']]
+        for seed in seeds:
+            parent = None
+            runs[pipeline_name, seed] = []
+            for depth in range(1, len(scenes) + 1):
+                stage = Stage(pipeline, seed, scenes[:depth], parent, save_base)
+                parent = stages.setdefault(stage.key, stage)
+                runs[pipeline_name, seed] += [parent]
+    return list(stages.values()), runs
+
+
+# Runs in a process of its own, sending back the training length
+def train_stage(remote, stage, first_rank, target):
+    # The process starts with the scheduler's random state, the same for every stage
+    torch.manual_seed(stage.rng_seed)
+    torch.cuda.manual_seed_all(stage.rng_seed)
+    np.random.seed(stage.rng_seed)
+    save_path = os.path.join(args.save_dir, args.algo)
+    args.seed = stage.seed
+    args.save_as = stage.name
+    args.log_dir = os.path.join(args.log_dir, stage.name)
+    args.trg_succ_rate = 101 if stage.is_task else target
+    trained_policies = None
+    if stage.parent is not None:
+        args.reuse_residual = True
+        args.initial_policy = stage.parent.name
+        trained_policies = torch.load(os.path.join(save_path, args.initial_policy + ".pt"))
+    print(f"Training {stage.scene} as {stage.name}")
+    length, _, _ = main(stage.env, stage.scene, trained_policies, first_rank=first_rank)
+    remote.send(length)
+    remote.close()
+
+
+# Trains every seed of the pipelines, each stage they share once, as many stages at a time as
+# there are cores for. Returns {pipeline: (total training lengths, training lengths)} as
+# train_with_metric does. Stages finished by an earlier call with the same save_base are
+# recorded in its stage tree and not trained again.
+def schedule(pipeline_names, save_base):
+    if use_metric:
+        check_metric_args()
+    save_path = os.path.join(args.save_dir, args.algo)
+    os.makedirs(save_path, exist_ok=True)
+    seeds = range(0, args.num_seeds * 16, 16)
+    stages, runs = build_tree(pipeline_names, seeds, save_base)
+    tree_path = os.path.join(save_path, f"{save_base}_stage_tree.pt")
+    lengths = torch.load(tree_path) if os.path.exists(tree_path) else {}
+    for stage in stages:
+        stage.length = lengths.get(stage.name)
+
+    # Every stage needs simulators of its own, on ports clear of the others'
+    ranks_per_stage = args.num_processes + (args.eval_processes or 0)
+    num_slots = args.parallel_stages or max(1, os.cpu_count() // ranks_per_stage)
+    free_slots = list(range(num_slots))
+    pending = [stage for stage in stages if stage.length is None]
+    print(f"Training {len(pending)} of {len(stages)} stages for {len(runs)} runs, "
+          f"{num_slots} at a time")
+    running = {}
+    failed = []
+    while pending or running:
+        # Stages can start once the one before them is done; after a failure none do
+        ready = [stage for stage in pending
+                 if stage.parent is None or stage.parent.length is not None]
+        while ready and free_slots and not failed:
+            stage = ready.pop(0)
+            pending.remove(stage)
+            slot = free_slots.pop()
+            remote, work_remote = Pipe()
+            process = Process(target=train_stage, args=(work_remote, stage,
+                                                        slot * ranks_per_stage,
+                                                        args.trg_succ_rate))
+            process.start()
+            work_remote.close()
+            running[remote] = (stage, process, slot)
+        if not running:
+            break
+        for remote in wait(list(running)):
+            stage, process, slot = running.pop(remote)
+            try:
+                stage.length = remote.recv()
+                lengths[stage.name] = stage.length
+                save_atomic(lengths, tree_path)
+            except EOFError:
+                failed += [stage.name]
+            process.join()
+            free_slots.append(slot)
+    if failed:
+        raise RuntimeError(f"Training failed for {', '.join(failed)}")
+
+    results = {}
+    for pipeline_name in pipeline_names:
+        training_lengths = [[stage.length for stage in runs[pipeline_name, seed]]
+                            for seed in seeds]
+        total_train_times = [sum(run_lengths) for run_lengths in training_lengths]
+        print(f"{pipeline_name}: {total_train_times}")
+        torch.save([total_train_times, training_lengths],
+                   os.path.join(save_path, f"{save_base}_{pipeline_name}_train_lengths.pt"))
+        results[pipeline_name] = (total_train_times, training_lengths)
+    return results
+
+
+if __name__ == "__main__":
+    schedule(args.pipelines or [args.pipeline], args.save_as)
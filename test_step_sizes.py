@@ -2,25 +2,17 @@ import numpy as np
 from torch import save
 
 from envs.pipelines import pipelines
-from main import train_with_metric, execute_curriculum, args
+from main import args
+from schedule_curricula import schedule
 
 if __name__ == "__main__":
-    pipeline_base = args.pipeline
-    results = []
-    tags = []
     save_base = args.save_as
-    target = args.trg_succ_rate
-    for i in range(5):
-        length = f"{2**i}cm"
-        curr_pipeline = f"{args.pipeline}_{2**i}"
-        args.trg_succ_rate = target
-        print(f"Training with {length} curriculum (if available)...")
-        try:
-            results += [train_with_metric(pipelines[curr_pipeline], execute_curriculum,
-                                          f"{save_base}_{length}")]
-            tags += [length]
-        except KeyError:
-            continue
+    # The curricula of every step size start the same way, so they're trained together
+    step_sizes = [2**i for i in range(5) if f"{args.pipeline}_{2**i}" in pipelines]
+    tags = [f"{step_size}cm" for step_size in step_sizes]
+    print(f"Training with {', '.join(tags)} curricula...")
+    results = schedule([f"{args.pipeline}_{step_size}" for step_size in step_sizes], save_base)
+    results = list(results.values())
     averages = [np.mean(totals) for totals, _ in results]
     to_save = list(zip(tags, averages))
     for tag, average in to_save:
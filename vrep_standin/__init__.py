@@ -0,0 +1,10 @@
+import sys
+
+# Set to run the environments against the stand-in rather than V-Rep
+standin_var = 'VREP_STANDIN'
+
+
+# Make `import vrep` give the stand-in's remote API. Must run before any module imports vrep.
+def install():
+    from vrep_standin import api
+    sys.modules['vrep'] = api
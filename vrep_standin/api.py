@@ -0,0 +1,223 @@
+import socket
+import sys
+import time
+from multiprocessing.connection import Client
+
+from vrepConst import *
+
+# Marks this module as the stand-in when installed as vrep (see VrepEnv.__init__)
+is_standin = True
+
+# Per client ID: connection, paused oneshot messages, buffered streams, last server state
+_clients = {}
+_next_id = 0
+
+
+class _ClientState(object):
+    def __init__(self, connection, timeout):
+        self.connection = connection
+        self.timeout = timeout
+        self.paused = None
+        self.buffers = {}
+        self.server_state = 0
+
+
+# Command that starts a stand-in server listening on the port, in place of V-Rep
+def server_args(port_num):
+    return [sys.executable, '-m', 'vrep_standin.server', str(port_num)]
+
+
+# Small messages go out straight away. Otherwise a oneshot message followed by a blocking one
+# waits on a delayed acknowledgement, costing tens of milliseconds per step.
+def no_delay(connection):
+    sock = socket.socket(fileno=connection.fileno())
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.detach()
+
+
+def _mode(operation_mode):
+    return operation_mode & 0xff0000
+
+
+# Blocking calls wait for the result, oneshot ones are sent without a reply (queued while
+# communication is paused), streaming ones start the server sending the value after every step
+# and buffered ones read the last value it sent.
+def _call(client_id, name, args, operation_mode=simx_opmode_blocking, default=None):
+    client = _clients.get(client_id)
+    if client is None:
+        return simx_return_initialize_error_flag, default
+    key = (name, args)
+    if _mode(operation_mode) == simx_opmode_buffer:
+        if key in client.buffers:
+            return simx_return_ok, client.buffers[key]
+        return simx_return_novalue_flag, default
+    if _mode(operation_mode) == simx_opmode_oneshot:
+        if client.paused is not None:
+            client.paused.append((name, args, False))
+        else:
+            client.connection.send((name, args, False))
+        return simx_return_novalue_flag, default
+    if _mode(operation_mode) == simx_opmode_streaming:
+        name, args = 'stream', key
+    elif _mode(operation_mode) != simx_opmode_blocking:
+        return simx_return_illegal_opmode_flag, default
+
+    try:
+        client.connection.send((name, args, True))
+        if not client.connection.poll(client.timeout):
+            return simx_return_timeout_flag, default
+        code, value, client.server_state, updates = client.connection.recv()
+    except (EOFError, OSError):
+        return simx_return_local_error_flag, default
+    client.buffers.update(updates)
+    if code != simx_return_ok:
+        return code, default
+    if name == 'stream':
+        client.buffers[key] = value
+        return simx_return_novalue_flag, value
+    return code, value
+
+
+def simxStart(connectionAddress, connectionPort, waitUntilConnected,
+              doNotReconnectOnceDisconnected, timeOutInMs, commThreadCycleInMs):
+    global _next_id
+    deadline = time.time() + timeOutInMs / 1000
+    while True:
+        try:
+            connection = Client((connectionAddress, connectionPort))
+            no_delay(connection)
+            break
+        except OSError:
+            if not waitUntilConnected or time.time() > deadline:
+                return -1
+            time.sleep(0.1)
+    client_id = _next_id
+    _next_id += 1
+    _clients[client_id] = _ClientState(connection, timeOutInMs / 1000)
+    return client_id
+
+
+def simxFinish(clientID):
+    for client_id in (list(_clients) if clientID == -1 else [clientID]):
+        client = _clients.pop(client_id, None)
+        if client is not None:
+            client.connection.close()
+
+
+def simxSynchronous(clientID, enable):
+    return _call(clientID, 'synchronous', (enable,))[0]
+
+
+# Like V-Rep's, returns without waiting for the step. simxGetPingTime waits for it.
+def simxSynchronousTrigger(clientID):
+    code, _ = _call(clientID, 'trigger', (), simx_opmode_oneshot)
+    return simx_return_ok if code == simx_return_novalue_flag else code
+
+
+def simxGetPingTime(clientID):
+    start = time.time()
+    code, _ = _call(clientID, 'ping', ())
+    return code, int((time.time() - start) * 1000)
+
+
+def simxGetInMessageInfo(clientID, infoType):
+    client = _clients.get(clientID)
+    if client is None or infoType != simx_headeroffset_server_state:
+        return -1, 0
+    return 1, client.server_state
+
+
+def simxPauseCommunication(clientID, enable):
+    client = _clients.get(clientID)
+    if client is None:
+        return simx_return_initialize_error_flag
+    if enable:
+        client.paused = []
+    elif client.paused is not None:
+        client.connection.send(('batch', client.paused, False))
+        client.paused = None
+    return simx_return_ok
+
+
+def simxLoadScene(clientID, scenePathAndName, options, operationMode):
+    return _call(clientID, 'load_scene', (scenePathAndName, options), operationMode)[0]
+
+
+def simxCloseScene(clientID, operationMode):
+    return _call(clientID, 'close_scene', (), operationMode)[0]
+
+
+def simxStartSimulation(clientID, operationMode):
+    return _call(clientID, 'start_simulation', (), operationMode)[0]
+
+
+def simxStopSimulation(clientID, operationMode):
+    return _call(clientID, 'stop_simulation', (), operationMode)[0]
+
+
+def simxGetObjectHandle(clientID, objectName, operationMode):
+    return _call(clientID, 'get_object_handle', (objectName,), operationMode, 0)
+
+
+def simxGetObjectGroupData(clientID, objectType, dataType, operationMode):
+    code, value = _call(clientID, 'get_object_group_data', (objectType, dataType),
+                        operationMode, ([], [], [], []))
+    return (code, *value)
+
+
+def simxGetObjectPosition(clientID, objectHandle, relativeToObjectHandle, operationMode):
+    return _call(clientID, 'get_object_position', (objectHandle, relativeToObjectHandle),
+                 operationMode, [0., 0., 0.])
+
+
+def simxSetObjectPosition(clientID, objectHandle, relativeToObjectHandle, position,
+                          operationMode):
+    return _call(clientID, 'set_object_position',
+                 (objectHandle, relativeToObjectHandle, [float(p) for p in position]),
+                 operationMode)[0]
+
+
+def simxGetObjectOrientation(clientID, objectHandle, relativeToObjectHandle, operationMode):
+    return _call(clientID, 'get_object_orientation', (objectHandle, relativeToObjectHandle),
+                 operationMode, [0., 0., 0.])
+
+
+def simxSetObjectOrientation(clientID, objectHandle, relativeToObjectHandle, eulerAngles,
+                             operationMode):
+    return _call(clientID, 'set_object_orientation',
+                 (objectHandle, relativeToObjectHandle, [float(a) for a in eulerAngles]),
+                 operationMode)[0]
+
+
+def simxGetJointPosition(clientID, jointHandle, operationMode):
+    return _call(clientID, 'get_joint_position', (jointHandle,), operationMode, 0.)
+
+
+def simxSetJointPosition(clientID, jointHandle, position, operationMode):
+    return _call(clientID, 'set_joint_position', (jointHandle, float(position)),
+                 operationMode)[0]
+
+
+def simxSetJointTargetVelocity(clientID, jointHandle, targetVelocity, operationMode):
+    return _call(clientID, 'set_joint_target_velocity', (jointHandle, float(targetVelocity)),
+                 operationMode)[0]
+
+
+def simxGetObjectIntParameter(clientID, objectHandle, parameterID, operationMode):
+    return _call(clientID, 'get_object_int_parameter', (objectHandle, parameterID),
+                 operationMode, 0)
+
+
+def simxSetObjectIntParameter(clientID, objectHandle, parameterID, parameterValue,
+                              operationMode):
+    return _call(clientID, 'set_object_int_parameter',
+                 (objectHandle, parameterID, int(parameterValue)), operationMode)[0]
+
+
+def simxCallScriptFunction(clientID, scriptDescription, options, functionName, inputInts,
+                           inputFloats, inputStrings, inputBuffer, operationMode):
+    code, value = _call(clientID, 'call_script_function',
+                        (scriptDescription, functionName, [int(i) for i in inputInts],
+                         [float(f) for f in inputFloats], list(inputStrings), inputBuffer),
+                        operationMode, ([], [], [], bytearray()))
+    return (code, *value)
@@ -0,0 +1,337 @@
+import numpy as np
+
+
+# V-Rep's Euler angles (alpha, beta, gamma) compose as R = Rx(alpha) Ry(beta) Rz(gamma)
+def euler_to_matrix(euler):
+    ca, cb, cg = np.cos(euler)
+    sa, sb, sg = np.sin(euler)
+    return np.array([[cb * cg, -cb * sg, sb],
+                     [ca * sg + sa * sb * cg, ca * cg - sa * sb * sg, -sa * cb],
+                     [sa * sg - ca * sb * cg, sa * cg + ca * sb * sg, ca * cb]])
+
+
+def matrix_to_euler(rot):
+    beta = np.arcsin(np.clip(rot[0, 2], -1., 1.))
+    if abs(rot[0, 2]) < 1. - 1e-9:
+        return [np.arctan2(-rot[1, 2], rot[2, 2]), beta, np.arctan2(-rot[0, 1], rot[0, 0])]
+    # Gimbal lock, only alpha + gamma is defined
+    return [np.arctan2(rot[2, 1], rot[1, 1]), beta, 0.]
+
+
+# Rotation of norm(vec) radians about vec
+def axis_angle(vec):
+    angle = np.linalg.norm(vec)
+    if angle < 1e-12:
+        return np.identity(3)
+    x, y, z = np.asarray(vec) / angle
+    skew = np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+    return np.identity(3) + np.sin(angle) * skew + (1 - np.cos(angle)) * skew @ skew
+
+
+# Inverse of axis_angle
+def rotation_vector(rot):
+    angle = np.arccos(np.clip((np.trace(rot) - 1) / 2, -1., 1.))
+    axis = np.array([rot[2, 1] - rot[1, 2], rot[0, 2] - rot[2, 0], rot[1, 0] - rot[0, 1]])
+    if angle < 1e-6:
+        return axis / 2
+    if np.pi - angle < 1e-6:
+        # sin(angle) ~ 0, recover the axis from the symmetric part instead
+        column = np.argmax(np.diag(rot))
+        axis = (rot[:, column] + np.identity(3)[column]) / np.sqrt(2 * (1 + rot[column, column]))
+        return axis * angle
+    return axis * angle / (2 * np.sin(angle))
+
+
+# Orientation whose z axis, the direction vision sensors look along, points from eye to point
+def look_at(eye, point):
+    z = np.asarray(point, dtype=float) - eye
+    z /= np.linalg.norm(z)
+    x = np.cross([0., 0., 1.], z)
+    x /= np.linalg.norm(x)
+    return np.stack([x, np.cross(z, x), z], axis=1)
+
+
+class SceneObject(object):
+    def __init__(self, name, kind, parent, position, rotation, size, color, axis):
+        self.name = name
+        # 'shape', 'dummy', 'joint', 'light' or 'sensor'
+        self.kind = kind
+        self.parent = parent
+        # Pose relative to the parent, joints rotate about axis on top of it
+        self.position = np.array(position, dtype=float)
+        self.rotation = np.identity(3) if rotation is None else np.array(rotation, dtype=float)
+        self.axis = None if axis is None else np.array(axis, dtype=float)
+        # Radius of the disc drawn for a shape by Scene.render
+        self.size = size
+        self.color = None if color is None else np.array(color, dtype=float)
+        self.enabled = True
+        self.int_params = {}
+
+
+class Scene(object):
+    """
+    A kinematic stand-in for the V-Rep scenes in scenes/: a 7 joint arm with roughly a Sawyer's
+    reach, plus the objects the environments look up by name. Joints move straight towards their
+    targets, nothing is dynamic and nothing collides.
+    """
+    dt = 0.05
+    max_joint_velocity = 2.
+    # Radians of rotation per unit of rotational action in update_robot_movement
+    rotation_scale = 0.02
+    # Joint offsets from the previous joint and rotation axes in its frame. With every angle at
+    # zero the arm is stretched out along x at shoulder height.
+    joint_offsets = [[0., 0., 0.317], [0.081, 0., 0.], [0.2, 0., 0.], [0.2, 0., 0.],
+                     [0.2, 0., 0.], [0.2, 0., 0.], [0.1, 0., 0.]]
+    joint_axes = [[0, 0, 1], [0, 1, 0], [1, 0, 0], [0, 1, 0], [1, 0, 0], [0, 1, 0], [1, 0, 0]]
+    tip_offset = [0.1, 0., 0.]
+    home_seed = [0., 0.3, 0., 1.2, 0., 0.8, 0.]
+    resolution = [128, 128]
+    field_of_view = 1.
+    background = [90, 90, 90]
+
+    # Copies of a scene (see Simulator.replicate_scene) number their handles from first_handle
+    # and add suffix to their objects' names
+    def __init__(self, layout, first_handle=1, suffix=''):
+        self.first_handle = first_handle
+        self.suffix = suffix
+        # Where the root objects are placed relative to the world
+        self.origin = np.zeros(3)
+        self.objects = {}
+        self.handles = {}
+        self.poses = {}
+        self.add('Sawyer', 'shape', size=0.08, color=[0.6, 0.1, 0.1])
+        parent = self.handles['Sawyer']
+        self.joints = []
+        for i, (offset, axis) in enumerate(zip(self.joint_offsets, self.joint_axes)):
+            parent = self.add(f'Sawyer_joint{i + 1}', 'joint', parent, offset, axis=axis)
+            self.joints.append(parent)
+        # The IK tip, whose pose update_robot_movement and solve_ik drive to MvTarget's
+        self.tip = self.add('Sawyer_tip', 'dummy', parent, self.tip_offset)
+        self.q = np.zeros(len(self.joints))
+        # Position targets, or None for joints driven by velocity
+        self.joint_targets = [None] * len(self.joints)
+        self.joint_velocities = np.zeros(len(self.joints))
+        self.last_joint_targets = []
+        self.layout = layout
+        layout(self)
+        self.init_q = self.q.copy()
+
+    def add(self, name, kind, parent=-1, position=(0., 0., 0.), rotation=None, size=0.,
+            color=None, axis=None):
+        handle = self.first_handle + len(self.objects)
+        self.objects[handle] = SceneObject(name + self.suffix, kind, parent, position, rotation,
+                                           size, color, axis)
+        self.handles[name] = handle
+        return handle
+
+    def changed(self):
+        self.poses = {}
+
+    # Absolute (position, rotation matrix) of an object, or of the world for handle -1
+    def world_pose(self, handle):
+        if handle == -1:
+            return np.zeros(3), np.identity(3)
+        if handle not in self.poses:
+            obj = self.objects[handle]
+            parent_pos, parent_rot = self.parent_pose(obj)
+            position = parent_pos + parent_rot @ obj.position
+            rotation = parent_rot @ obj.rotation
+            if obj.axis is not None:
+                rotation = rotation @ axis_angle(obj.axis * self.q[self.joints.index(handle)])
+            self.poses[handle] = (position, rotation)
+        return self.poses[handle]
+
+    def parent_pose(self, obj):
+        if obj.parent == -1:
+            return self.origin, np.identity(3)
+        return self.world_pose(obj.parent)
+
+    def get_position(self, handle, relative_to=-1):
+        position, _ = self.world_pose(handle)
+        rel_pos, rel_rot = self.world_pose(relative_to)
+        return rel_rot.T @ (position - rel_pos)
+
+    def get_orientation(self, handle, relative_to=-1):
+        _, rotation = self.world_pose(handle)
+        _, rel_rot = self.world_pose(relative_to)
+        return matrix_to_euler(rel_rot.T @ rotation)
+
+    # Joints and the tip are placed by the arm's configuration and can't be moved directly
+    def set_position(self, handle, relative_to, position):
+        obj = self.objects[handle]
+        if obj.kind == 'joint' or handle == self.tip:
+            return
+        rel_pos, rel_rot = self.world_pose(relative_to)
+        parent_pos, parent_rot = self.parent_pose(obj)
+        obj.position = parent_rot.T @ (rel_pos + rel_rot @ np.asarray(position) - parent_pos)
+        self.changed()
+
+    def set_orientation(self, handle, relative_to, euler):
+        obj = self.objects[handle]
+        if obj.kind == 'joint' or handle == self.tip:
+            return
+        _, rel_rot = self.world_pose(relative_to)
+        _, parent_rot = self.parent_pose(obj)
+        obj.rotation = parent_rot.T @ rel_rot @ euler_to_matrix(euler)
+        self.changed()
+
+    def set_joint_angles(self, angles):
+        self.q = np.array(angles, dtype=float)
+        self.joint_targets = list(self.q)
+        self.joint_velocities[:] = 0.
+        self.changed()
+
+    # Damped least squares IK from angles q (by default the current ones) that brings the tip to
+    # the given position and, unless it is None, rotation. The arm itself is left as it was.
+    def solve_ik(self, position, rotation=None, q=None, iterations=50, tolerance=1e-5,
+                 damping=0.05):
+        current = self.q
+        self.q = np.array(self.q if q is None else q, dtype=float)
+        rows = 3 if rotation is None else 6
+        for _ in range(iterations):
+            self.changed()
+            tip_pos, tip_rot = self.world_pose(self.tip)
+            error = position - tip_pos
+            if rotation is not None:
+                error = np.concatenate([error, rotation_vector(rotation @ tip_rot.T)])
+            if error @ error < tolerance ** 2:
+                break
+            jacobian = np.zeros((6, len(self.joints)))
+            for i, handle in enumerate(self.joints):
+                joint_pos, joint_rot = self.world_pose(handle)
+                axis = joint_rot @ self.objects[handle].axis
+                jacobian[:3, i] = np.cross(axis, tip_pos - joint_pos)
+                jacobian[3:, i] = axis
+            jacobian = jacobian[:rows]
+            step = jacobian.T @ np.linalg.solve(jacobian @ jacobian.T +
+                                                damping ** 2 * np.identity(rows), error)
+            self.q = np.clip(self.q + step, -np.pi, np.pi)
+        q, self.q = self.q, current
+        self.changed()
+        return q
+
+    # Move every joint towards its target, or at its target velocity
+    def step(self):
+        max_change = self.max_joint_velocity * self.dt
+        for i, target in enumerate(self.joint_targets):
+            if target is None:
+                self.q[i] += self.joint_velocities[i] * self.dt
+            else:
+                self.q[i] += np.clip(target - self.q[i], -max_change, max_change)
+        self.changed()
+
+    # Called by the layouts: put the arm in a pose with its tip at position, and orient the IK tip
+    # so that it matches orientation (by default that of the arm's pose).
+    def set_home(self, position, orientation=None):
+        self.q = self.solve_ik(np.asarray(position, dtype=float), q=self.home_seed,
+                               iterations=500)
+        self.changed()
+        if orientation is not None:
+            tip = self.objects[self.tip]
+            _, tip_rot = self.world_pose(self.tip)
+            tip.rotation = tip.rotation @ tip_rot.T @ euler_to_matrix(orientation)
+            self.changed()
+        self.joint_targets = list(self.q)
+        return self.world_pose(self.tip)
+
+    def snapshot(self):
+        return ({handle: (obj.position.copy(), obj.rotation.copy())
+                 for handle, obj in self.objects.items()},
+                self.q.copy(), list(self.joint_targets), self.joint_velocities.copy())
+
+    def restore(self, snapshot):
+        poses, q, targets, velocities = snapshot
+        for handle, (position, rotation) in poses.items():
+            self.objects[handle].position = position
+            self.objects[handle].rotation = rotation
+        self.q, self.joint_targets, self.joint_velocities = q, targets, velocities
+        self.changed()
+
+    # A crude picture from a vision sensor: every shape (or only the entity to render) is a disc,
+    # drawn far to near, scaled by the number of enabled lights.
+    def render(self, sensor, entity=-1, grayscale=False):
+        width, height = self.resolution
+        sensor_pos, sensor_rot = self.world_pose(sensor)
+        focal = width / (2 * np.tan(self.field_of_view / 2))
+        shapes = [(handle, obj) for handle, obj in self.objects.items()
+                  if obj.kind == 'shape' and (entity == -1 or handle == entity)]
+        points = [sensor_rot.T @ (self.world_pose(handle)[0] - sensor_pos) for handle, _ in shapes]
+        lights = [obj for obj in self.objects.values() if obj.kind == 'light' and obj.enabled]
+        brightness = min(1., 0.4 + 0.2 * len(lights))
+
+        image = np.zeros((height, width, 3))
+        if not grayscale:
+            image[:] = self.background
+        rows, cols = np.mgrid[:height, :width]
+        for point, (_, obj) in sorted(zip(points, shapes), key=lambda pair: -pair[0][2]):
+            if point[2] <= 0:
+                continue
+            u = width / 2 + focal * point[0] / point[2]
+            v = height / 2 + focal * point[1] / point[2]
+            radius = focal * obj.size / point[2]
+            color = 255 if grayscale else np.clip(obj.color, 0., 1.) * 255 * brightness
+            image[(cols - u) ** 2 + (rows - v) ** 2 <= radius ** 2] = color
+        if grayscale:
+            image = image[:, :, :1]
+        return image.astype(np.uint8).tobytes()
+
+
+def _arm_and_table(scene):
+    scene.add('Table', 'shape', position=[0.4, 0., -0.4], size=0.4, color=[0.45, 0.3, 0.2])
+
+
+def dish_rack(scene):
+    _arm_and_table(scene)
+    tip_pos, tip_rot = scene.set_home([0.05, -0.45, 0.35])
+    rack_pos = [0.05, -0.52, 0.05]
+    scene.add('DefaultOrientation', 'dummy', position=rack_pos)
+    scene.add('Stand', 'shape', position=[0.05, -0.52, 0.], size=0.06, color=[0.3, 0.3, 0.3])
+    rack = scene.add('DishRack', 'shape', position=rack_pos, size=0.1, color=[0.7, 0.7, 0.75])
+    scene.add('Target', 'dummy', rack, [0., 0., 0.1], tip_rot)
+    scene.add('Cloth', 'shape', position=[0.05, -0.5, -0.01], size=0.2, color=[0.2, 0.3, 0.6])
+    scene.add('MvTarget', 'dummy', position=tip_pos, rotation=tip_rot)
+    scene.add('Subject', 'dummy', scene.tip)
+    scene.add('Plate', 'shape', scene.tip, size=0.08, color=[0.9, 0.9, 0.85])
+    eye = np.array([0.05, -1.1, 0.6])
+    scene.add('Vision_sensor', 'sensor', position=eye, rotation=look_at(eye, rack_pos))
+    for name, position in zip('ABCD', [[1., -1., 1.5], [-1., -1., 1.5], [1., 1., 1.5],
+                                       [-1., 1., 1.5]]):
+        scene.add(f'LocalLight{name}', 'light', position=position)
+
+
+def reach_over_wall(scene):
+    _arm_and_table(scene)
+    # ReachOverWallEnv resets MvTarget's orientation to [0, 0, 0]
+    tip_pos, tip_rot = scene.set_home([0.3, -0.3, 0.35], orientation=[0., 0., 0.])
+    sphere = scene.add('Sphere', 'shape', position=[0.3, -0.5, 0.1], size=0.03,
+                       color=[0.1, 0.8, 0.1])
+    scene.add('Target', 'dummy', sphere)
+    scene.add('Wall', 'shape', position=[0.3, -0.4, 0.1], size=0.1, color=[0.8, 0.8, 0.8])
+    scene.add('MvTarget', 'dummy', position=tip_pos, rotation=tip_rot)
+    scene.add('Subject', 'dummy', scene.tip)
+
+
+def shelf(scene):
+    _arm_and_table(scene)
+    tip_pos, tip_rot = scene.set_home([0.9, 0.15, 0.55])
+    scene.add('Shelf', 'shape', position=[0.9, 0.15, 0.3], size=0.15, color=[0.5, 0.35, 0.2])
+    scene.add('Target', 'dummy', position=[0.9, 0.15, 0.35], rotation=tip_rot)
+    scene.add('MvTarget', 'dummy', position=tip_pos, rotation=tip_rot)
+    scene.add('Anchor', 'dummy', position=tip_pos)
+    scene.add('Subject', 'shape', scene.tip, size=0.04, color=[0.9, 0.9, 0.9])
+
+
+# Scene files are matched to a layout by the start of their name
+layouts = [
+    ('dish_rack', dish_rack),
+    ('reach', reach_over_wall),
+    ('row_', reach_over_wall),
+    ('shelf', shelf),
+]
+
+
+def layout_for(scene_name):
+    for prefix, layout in layouts:
+        if scene_name.startswith(prefix):
+            return layout
+    return None
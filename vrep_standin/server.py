@@ -0,0 +1,317 @@
+import os
+import sys
+from multiprocessing.connection import Listener
+
+import numpy as np
+
+from vrepConst import *
+from vrep_standin.api import no_delay
+from vrep_standin.model import Scene, axis_angle, layout_for, matrix_to_euler
+
+
+class RemoteError(Exception):
+    pass
+
+
+class Simulator(object):
+    """
+    Serves the subset of the V-Rep remote API used by the environments against a kinematic
+    model (see model.Scene), plus the functions of the scenes' 'remote_api' customization script.
+    The simulation only advances on synchronous triggers, as VrepEnv always enables that mode.
+
+    Copies of the scene made by replicate_scene are kept as scenes of their own, with handles
+    numbered from a multiple of handle_stride. The script functions act on the copy whose
+    'remote_api' script they are called through.
+    """
+    handle_stride = 1000
+
+    def __init__(self):
+        self.scene = None
+        self.scenes = []
+        self.running = False
+        self.snapshot = None
+        # {(function name, args): value} read again after every step for streaming clients
+        self.streams = {}
+        self.stream_updates = {}
+        self.script = {
+            'get_configuration_tree': self.get_configuration_tree,
+            'get_joint_angles': self.get_joint_angles,
+            'set_joint_angles': self.set_joint_angles,
+            'update_robot_movement': self.update_robot_movement,
+            'solve_ik': self.solve_ik,
+            'apply_action': self.apply_action,
+            'observe_step': self.observe_step,
+            'get_resolution': self.get_resolution,
+            'get_image': self.get_image,
+            'get_color': self.get_color,
+            'set_color': self.set_color,
+            'enable_light': self.enable_light,
+            'disable_light': self.disable_light,
+            'randomise_domain': self.randomise_domain,
+            'replicate_scene': self.replicate_scene,
+        }
+
+    def handle(self, name, args):
+        if self.scene is None and name not in ('load_scene', 'close_scene', 'stop_simulation',
+                                               'ping', 'synchronous'):
+            raise RemoteError('no scene loaded')
+        try:
+            return getattr(self, name)(*args)
+        except (KeyError, IndexError, ValueError) as e:
+            raise RemoteError(e)
+
+    # Sent by the client ahead of buffered reads: the current value now, the rest after steps
+    def stream(self, name, args):
+        value = self.handle(name, args)
+        self.streams[(name, args)] = value
+        return value
+
+    def ping(self):
+        return 0
+
+    def synchronous(self, enable):
+        pass
+
+    def trigger(self):
+        if not self.running:
+            return
+        for scene in self.scenes:
+            scene.step()
+        for name, args in self.streams:
+            self.stream_updates[(name, args)] = self.handle(name, args)
+
+    def load_scene(self, path, options):
+        layout = layout_for(os.path.splitext(os.path.basename(path))[0])
+        if layout is None:
+            raise RemoteError(f'the stand-in has no layout for {path}')
+        self.scene = Scene(layout)
+        self.scenes = [self.scene]
+        self.running = False
+        self.streams = {}
+
+    def close_scene(self):
+        self.scene = None
+        self.scenes = []
+        self.running = False
+        self.streams = {}
+
+    def start_simulation(self):
+        if not self.running:
+            self.snapshot = [scene.snapshot() for scene in self.scenes]
+            self.running = True
+
+    # Like V-Rep, put everything back where it was when the simulation started
+    def stop_simulation(self):
+        if self.running:
+            for scene, snapshot in zip(self.scenes, self.snapshot):
+                scene.restore(snapshot)
+            self.running = False
+
+    # The scene or copy an object is in
+    def scene_of(self, handle):
+        return self.scenes[(handle - 1) // self.handle_stride]
+
+    # Names in a copy end in #0, #1...
+    def copy_named(self, name):
+        name, _, index = name.partition('#')
+        return name, self.scenes[int(index) + 1 if index else 0]
+
+    def get_object_handle(self, name):
+        name, scene = self.copy_named(name)
+        return scene.handles[name]
+
+    def get_object_group_data(self, object_type, data_type):
+        objects = [(scene, handle) for scene in self.scenes
+                   for handle, obj in scene.objects.items()
+                   if object_type == sim_appobj_object_type or
+                   (object_type == sim_object_shape_type and obj.kind == 'shape')]
+        handles = [handle for _, handle in objects]
+        if data_type == 0:
+            names = [scene.objects[handle].name for scene, handle in objects]
+            return handles, [], [], names
+        elif data_type == 9:
+            poses = [value for scene, handle in objects
+                     for value in [*scene.get_position(handle), *scene.get_orientation(handle)]]
+            return handles, [], poses, []
+        raise RemoteError(f'unsupported group data type {data_type}')
+
+    def get_object_position(self, handle, relative_to):
+        return list(self.scene_of(handle).get_position(handle, relative_to))
+
+    def set_object_position(self, handle, relative_to, position):
+        self.scene_of(handle).set_position(handle, relative_to, position)
+
+    def get_object_orientation(self, handle, relative_to):
+        return list(self.scene_of(handle).get_orientation(handle, relative_to))
+
+    def set_object_orientation(self, handle, relative_to, euler):
+        self.scene_of(handle).set_orientation(handle, relative_to, euler)
+
+    def get_joint_position(self, handle):
+        scene = self.scene_of(handle)
+        return scene.q[scene.joints.index(handle)]
+
+    def set_joint_position(self, handle, position):
+        scene = self.scene_of(handle)
+        i = scene.joints.index(handle)
+        scene.q[i] = position
+        scene.joint_targets[i] = position
+        scene.changed()
+
+    def set_joint_target_velocity(self, handle, velocity):
+        scene = self.scene_of(handle)
+        i = scene.joints.index(handle)
+        scene.joint_targets[i] = None
+        scene.joint_velocities[i] = velocity
+
+    def get_object_int_parameter(self, handle, parameter):
+        obj = self.scene_of(handle).objects[handle]
+        default = int(obj.kind == 'shape') if parameter == sim_shapeintparam_respondable else 0
+        return obj.int_params.get(parameter, default)
+
+    def set_object_int_parameter(self, handle, parameter, value):
+        self.scene_of(handle).objects[handle].int_params[parameter] = value
+
+    def call_script_function(self, script, function, ints, floats, strings, buffer):
+        if function not in self.script:
+            raise RemoteError(f'no script function {function}')
+        scene = self.scene
+        _, self.scene = self.copy_named(script)
+        try:
+            return self.script[function](list(ints), np.array(floats, dtype=float))
+        finally:
+            self.scene = scene
+
+    # The Lua functions in the scenes' 'remote_api' scripts, as (ints, floats, strings, buffer)
+
+    def get_configuration_tree(self, ints, floats):
+        return list(self.scene.joints), [], [], bytearray()
+
+    def get_joint_angles(self, ints, floats):
+        return [], list(self.scene.q), [], bytearray()
+
+    def set_joint_angles(self, ints, floats):
+        self.scene.set_joint_angles(floats)
+        # The IK target follows the arm so that the next movement starts from where it is
+        mv_target = self.scene.handles.get('MvTarget')
+        if mv_target is not None:
+            self.scene.set_position(mv_target, -1, self.scene.get_position(self.scene.tip))
+        return [], [], [], bytearray()
+
+    # Move the IK target by the Cartesian action and aim the joints at the pose that reaches it
+    def update_robot_movement(self, ints, floats):
+        scene = self.scene
+        mv_target = scene.handles['MvTarget']
+        position, rotation = scene.world_pose(mv_target)
+        rotation = axis_angle(floats[3:6] * scene.rotation_scale) @ rotation
+        scene.set_position(mv_target, -1, position + floats[:3])
+        scene.set_orientation(mv_target, -1, matrix_to_euler(rotation))
+        position, rotation = scene.world_pose(mv_target)
+        targets = scene.solve_ik(position, rotation, iterations=5)
+        scene.joint_targets = list(targets)
+        scene.last_joint_targets = list(targets)
+        return [], list(targets), [], bytearray()
+
+    def solve_ik(self, ints, floats):
+        position, rotation = self.scene.world_pose(self.scene.handles['MvTarget'])
+        return [], list(self.scene.solve_ik(position, rotation, iterations=100)), [], bytearray()
+
+    # See scenes/batched_step.lua
+    def apply_action(self, ints, floats):
+        self.update_robot_movement(ints, floats)
+        return [], [], [], bytearray()
+
+    def observe_step(self, ints, floats):
+        subject, target = ints[:2]
+        scene = self.scene
+        out = [*scene.q, *scene.get_position(subject), *scene.get_position(target),
+               *scene.get_position(subject, target), *scene.get_orientation(subject, target),
+               *scene.last_joint_targets]
+        return [], out, [], bytearray()
+
+    def get_resolution(self, ints, floats):
+        return list(self.scene.resolution), [], [], bytearray()
+
+    def get_image(self, ints, floats):
+        sensor = self.scene.objects[self.scene.handles['Vision_sensor']]
+        entity = sensor.int_params.get(sim_visionintparam_entity_to_render, -1)
+        image = self.scene.render(self.scene.handles['Vision_sensor'], entity, bool(ints[0]))
+        return [], [], [], bytearray(image)
+
+    def get_color(self, ints, floats):
+        return [], list(self.scene.objects[ints[0]].color), [], bytearray()
+
+    def set_color(self, ints, floats):
+        self.scene.objects[ints[0]].color = floats
+        return [], [], [], bytearray()
+
+    def enable_light(self, ints, floats):
+        self.scene.objects[ints[0]].enabled = True
+        return [], [], [], bytearray()
+
+    def disable_light(self, ints, floats):
+        self.scene.objects[ints[0]].enabled = False
+        return [], [], [], bytearray()
+
+    # See scenes/multi_robot.lua
+    def replicate_scene(self, ints, floats):
+        for k in range(1, ints[0] + 1):
+            scene = Scene(self.scene.layout, k * self.handle_stride + 1, f'#{k - 1}')
+            scene.add('RobotOrigin', 'dummy')
+            scene.origin = np.array([0., k * floats[0], 0.])
+            scene.changed()
+            self.scenes.append(scene)
+        return [], [], [], bytearray()
+
+    # See scenes/domain_randomisation.lua
+    def randomise_domain(self, ints, floats):
+        num_colors, num_poses, num_lights = ints[:3]
+        handles = ints[3:]
+        for handle, color in zip(handles[:num_colors], floats[:3 * num_colors].reshape(-1, 3)):
+            self.set_color([handle], color)
+        poses = floats[3 * num_colors:].reshape(-1, 6)
+        for handle, pose in zip(handles[num_colors:num_colors + num_poses], poses):
+            self.set_object_position(handle, -1, list(pose[:3]))
+            self.set_object_orientation(handle, -1, list(pose[3:]))
+        lights = handles[num_colors + num_poses:]
+        for handle, enabled in zip(lights[:num_lights], lights[num_lights:]):
+            self.scene.objects[handle].enabled = bool(enabled)
+        return [], [], [], bytearray()
+
+
+# Messages are (name, args, reply). Replies carry a return code, the value, the server state
+# (bit 0 set while the simulation runs) and any streamed values updated since the last reply.
+def serve(connection, simulator):
+    while True:
+        name, args, reply = connection.recv()
+        messages = args if name == 'batch' else [(name, args, reply)]
+        for name, args, reply in messages:
+            try:
+                code, value = simx_return_ok, simulator.handle(name, args)
+            except RemoteError as e:
+                print(f'V-Rep stand-in: {name}{args} failed: {e}', file=sys.stderr)
+                code, value = simx_return_remote_error_flag, None
+            if reply:
+                connection.send((code, value, int(simulator.running), simulator.stream_updates))
+                simulator.stream_updates = {}
+
+
+# Run as python -m vrep_standin.server <port>, like V-Rep with a remote API server on that port.
+# Takes one client at a time; connections that close straight away (port probes) are dropped.
+def main():
+    port = int(sys.argv[1])
+    simulator = Simulator()
+    with Listener(('127.0.0.1', port)) as listener:
+        while True:
+            connection = listener.accept()
+            no_delay(connection)
+            try:
+                serve(connection, simulator)
+            except (EOFError, ConnectionResetError):
+                pass
+            finally:
+                connection.close()
+
+
+if __name__ == '__main__':
+    main()